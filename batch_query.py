@@ -0,0 +1,212 @@
+"""
+Headless "find similar" for a folder of query images.
+
+    python batch_query.py queries/ --output matches.csv --top-k 10
+    python batch_query.py queries/ --output matches.parquet --backend local --store stores/paintings
+
+Query images are read and decoded on worker threads, as in ingest.py.
+Bytes already in the embedding cache are not decoded again. The rest are
+embedded in batches with the app's EmbeddingEngine (same INFERENCE_*
+settings and vectors as an upload). Each batch is then searched in one
+request, through the same filtering and de-duplication as the app's
+search (queries.search_similar_paintings_batch). On Qdrant that is one
+`search_batch` call, or the `<collection>_pca` tier with QUANTIZATION=pca.
+On a LocalIndex it is one matrix product over the vectors.
+
+Rows (query, rank, image_url, author, score) are appended to the output
+after every batch, so memory stays flat and an interrupted run keeps
+what it wrote; `--resume` skips the queries already in a CSV. Streamlit
+is not imported.
+"""
+import argparse
+import csv
+import os
+import time
+
+from config import (
+    COLLECTION_NAME, MODEL_NAME, EMBEDDING_CACHE_DIR, SEARCH_BACKEND, VECTOR_STORE_PATH,
+    QUANTIZATION, QUANTIZATION_RERANK,
+    INFERENCE_PRECISION, INFERENCE_COMPILE, INFERENCE_BACKEND, ONNX_MODEL_PATH, INFERENCE_THREADS,
+)
+from embedding_cache import EmbeddingCache, engine_variant
+from embeddings import EmbeddingEngine
+from ingest import iter_batches, iter_decoded, list_image_paths
+from projection import tier_projection
+from quantization import qdrant_search_params
+from queries import search_similar_paintings_batch
+from resilient_client import create_client
+from vector_index import LocalIndex
+from vector_store import open_store
+
+COLUMNS = ["query", "rank", "image_url", "author", "score"]
+
+
+class ResultWriter:
+    """
+    Appends result rows to a CSV file, or to a Parquet file (one row
+    group per batch, needs pyarrow) when `path` ends in ".parquet".
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        if self.parquet:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ImportError("Parquet output needs `pip install pyarrow`") from e
+            self._pa = pa
+            self._schema = pa.schema([
+                ("query", pa.string()), ("rank", pa.int32()), ("image_url", pa.string()),
+                ("author", pa.string()), ("score", pa.float32()),
+            ])
+            self._writer = pq.ParquetWriter(path, self._schema)
+        else:
+            exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+            self._file = open(path, "a" if exists else "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            if not exists:
+                self._writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.parquet:
+            self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+        else:
+            self._writer.writerows([row[column] for column in COLUMNS] for row in rows)
+            self._file.flush()
+
+    def close(self):
+        if self.parquet:
+            self._writer.close()
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def done_queries(path):
+    """
+    Query paths already written to a CSV output, for --resume.
+    """
+    if not os.path.exists(path) or path.endswith(".parquet"):
+        return set()
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row["query"] for row in csv.DictReader(f)}
+
+
+def embed_queries(engine, batch, cache=None):
+    """
+    Vectors for a batch of ingest Items: cached ones as they are, the rest
+    in one engine pass (stored in the cache for the next run).
+    """
+    vectors = [item.vector for item in batch]
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    if misses:
+        computed = engine.embed([batch[i].image for i in misses])
+        for i, vector in zip(misses, computed):
+            vectors[i] = vector
+            if cache is not None:
+                cache.put(batch[i].cache_key, vector)
+    return vectors
+
+
+def open_backend(backend, collection_name=COLLECTION_NAME, store_path=VECTOR_STORE_PATH):
+    """
+    (client-like backend, PCA projection or None). The local backend scans
+    the vector store (or a copy of the collection) exactly.
+    """
+    if backend == "local":
+        if store_path:
+            return LocalIndex.from_store(open_store(store_path), collection_name), None
+        return LocalIndex.from_qdrant(create_client(), collection_name), None
+    client = create_client()
+    return client, tier_projection(client, collection_name) if QUANTIZATION == "pca" else None
+
+
+def run_queries(paths, engine, backend, writer, collection_name=COLLECTION_NAME, top_k=10, batch_size=32,
+                workers=4, cache=None, projection=None, include=None, exclude=None):
+    """
+    Embeds and searches `paths` batch by batch, writing each batch's
+    matches before reading on. Returns the number of queries answered.
+    """
+    search_params = qdrant_search_params(QUANTIZATION, QUANTIZATION_RERANK)
+    answered = 0
+    started = time.perf_counter()
+    decoded = iter_decoded(paths, workers, prefetch=batch_size * 2, cache=cache)
+    for batch in iter_batches(decoded, batch_size):
+        vectors = embed_queries(engine, batch, cache)
+        matches = search_similar_paintings_batch(
+            backend, collection_name, vectors, top_k=top_k, search_params=search_params,
+            include=include, exclude=exclude, projection=projection, rerank=QUANTIZATION_RERANK,
+        )
+        writer.write([
+            {"query": item.path, "rank": rank, "image_url": painting["image_url"],
+             "author": painting["author"], "score": painting["score"]}
+            for item, paintings in zip(batch, matches)
+            for rank, painting in enumerate(paintings, 1)
+        ])
+        answered += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"Answered {answered}/{len(paths)} queries ({answered / elapsed * 60:.0f} queries/min)")
+    return answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the most similar paintings for a folder of query images.")
+    parser.add_argument("directory")
+    parser.add_argument("--output", required=True, help="CSV file, or Parquet when it ends in .parquet")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--backend", choices=["qdrant", "local"], default=SEARCH_BACKEND)
+    parser.add_argument("--store", default=VECTOR_STORE_PATH,
+                        help="Vector store for the local backend (default: copy the collection from Qdrant)")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--precision", choices=["fp32", "bf16"], default=INFERENCE_PRECISION)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cache-dir", default=EMBEDDING_CACHE_DIR,
+                        help="Embedding cache directory; pass an empty string to disable")
+    parser.add_argument("--author", action="append", default=[], help="Only match this artist (repeatable)")
+    parser.add_argument("--exclude-author", action="append", default=[], help="Never match this artist (repeatable)")
+    parser.add_argument("--resume", action="store_true", help="Append to a CSV output, skipping queries it holds")
+    args = parser.parse_args()
+    if args.resume and args.output.endswith(".parquet"):
+        parser.error("--resume needs a CSV output")
+
+    paths = list_image_paths(args.directory)
+    if args.resume:
+        done = done_queries(args.output)
+        paths = [path for path in paths if path not in done]
+        print(f"Resuming: {len(done)} queries already answered")
+
+    engine = EmbeddingEngine(
+        model_name=args.model, precision=args.precision, compile=INFERENCE_COMPILE,
+        backend=INFERENCE_BACKEND, onnx_path=ONNX_MODEL_PATH, num_threads=INFERENCE_THREADS,
+    )
+    cache = None
+    if args.cache_dir:
+        variant = engine_variant(args.precision, INFERENCE_BACKEND)
+        cache = EmbeddingCache(cache_dir=args.cache_dir, model_name=args.model, variant=variant)
+    backend, projection = open_backend(args.backend, args.collection, args.store)
+    started = time.perf_counter()
+    with ResultWriter(args.output, append=args.resume) as writer:
+        answered = run_queries(
+            paths, engine, backend, writer, collection_name=args.collection, top_k=args.top_k,
+            batch_size=args.batch_size, workers=args.workers, cache=cache, projection=projection,
+            include={"author": args.author} if args.author else None,
+            exclude={"author": args.exclude_author} if args.exclude_author else None,
+        )
+    elapsed = time.perf_counter() - started
+    rate = answered / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"Done: {answered} queries in {elapsed:.1f}s ({rate:.0f} queries/min), matches in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Micro-batching embedding service shared by all Streamlit sessions.
+
+Sessions submit single images; one worker thread collects whatever
+arrives within `max_wait_ms` (up to `max_batch_size` images) and runs a
+single forward pass for the batch. Each caller gets a Future.
+
+The queue is bounded: when it is full `submit` raises `Overloaded`
+immediately instead of letting latency grow without limit. Requests
+whose deadline has passed while queued are failed without being run.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+class _Request:
+    __slots__ = ("image", "future", "deadline")
+
+    def __init__(self, image, deadline):
+        self.image = image
+        self.future = Future()
+        self.deadline = deadline
+
+
+class MicroBatcher:
+    def __init__(self, embed_fn, max_batch_size=16, max_wait_ms=10, max_queue=64):
+        """
+        `embed_fn(images) -> (len(images), dim) array` runs one batch.
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+
+        self.batches = 0
+        self.images = 0
+        self.rejected = 0
+        self.expired = 0
+        self._stats_lock = threading.Lock()
+
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, image, timeout=30.0):
+        request = _Request(image, time.monotonic() + timeout)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise Overloaded("Embedding service is busy, please try again in a moment")
+        return request.future
+
+    def embed(self, image, timeout=30.0):
+        """
+        Blocking convenience wrapper: the embedding of one image.
+        """
+        future = self.submit(image, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        window_ends = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = window_ends - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.monotonic()
+            live = []
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                if request.deadline < now:
+                    self.expired += 1
+                    request.future.set_exception(TimeoutError("Embedding request expired in the queue"))
+                    continue
+                live.append(request)
+            if not live:
+                continue
+            try:
+                vectors = self.embed_fn([request.image for request in live])
+            except Exception as e:
+                for request in live:
+                    request.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(live)
+            for request, vector in zip(live, vectors):
+                request.future.set_result(vector)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
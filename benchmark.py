@@ -0,0 +1,380 @@
+"""
+Benchmarks for the app's hot paths, runnable offline.
+
+A synthetic collection (clustered unit vectors with `image_url` /
+`author` payloads and a share of duplicate images) is generated into
+an in-memory or local-path QdrantClient, or into a memory-mapped vector
+store served by LocalIndex for the largest sizes. A stub embedding model
+(a fixed random projection of a downsampled image) stands in for DINOv2,
+so nothing is downloaded.
+
+Each operation reports p50/p95/p99 latency and QPS. Results are written
+as JSON together with the commit and configuration, so runs can be
+compared between commits.
+
+    python benchmark.py --points 10000 --output bench/10k.json
+    python benchmark.py --points 1000000 --backend path --path /tmp/bench-qdrant
+    python benchmark.py --points 10000000 --backend local --path /tmp/bench-store --dtype float16
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from qdrant_client import QdrantClient
+from qdrant_client.models import VectorParams, Distance, PointStruct
+
+import pipeline
+from batching import MicroBatcher
+from config import PCA_DIMS
+from embedding_cache import EmbeddingCache
+from filters import ensure_payload_indexes
+from preprocess import Preprocessor, open_image
+from projection import PCAProjection, index_collection, projected_collection
+from queries import (
+    filter_unique_records, recommend_similar, search_similar_paintings, search_similar_paintings_batch,
+    search_region_paintings,
+)
+from regions import QdrantRegions, REGIONS_FILE, StoreRegions, ensure_region_collection, upsert_regions
+from thumbnails import ThumbnailCache
+from vector_index import LocalIndex
+from vector_store import open_store, write_store
+
+COLLECTION = "benchmark"
+OPERATIONS = [
+    "search_similar_paintings",
+    "search_filtered",
+    "search_batch_32",
+    "search_regions",
+    "search_two_tier",
+    "recommend",
+    "filter_unique_records",
+    "load_image",
+    "load_image_grid",
+    "generate_embedding",
+    "generate_embedding_cached",
+    "preprocess_large_jpeg",
+]
+
+
+N_REGIONS = 5   # CLS + a 2x2 grid, as stored by `ingest.py --regions`
+
+
+class StubEngine:
+    """
+    Offline stand-in for EmbeddingEngine: a fixed random projection of the
+    image downsampled to 16x16 RGB. Same interface, no model download.
+    """
+
+    def __init__(self, dim=1024, seed=0):
+        rng = np.random.default_rng(seed)
+        self.projection = rng.standard_normal((16 * 16 * 3, dim)).astype(np.float32)
+
+    @property
+    def hidden_size(self):
+        return self.projection.shape[1]
+
+    def embed(self, images):
+        pixels = np.stack([
+            np.asarray(image.convert("RGB").resize((16, 16)), dtype=np.float32).ravel() / 255.0
+            for image in images
+        ])
+        return pixels @ self.projection
+
+
+# Synthetic collection ---------------------------------------------------
+
+def synthetic_points(count, dim, n_clusters=256, n_authors=500, duplicate_rate=0.02, chunk=10_000, seed=0):
+    """
+    Yields (id, vector, payload) for `count` points. Vectors are noisy
+    copies of `n_clusters` centroids; a `duplicate_rate` share of points
+    repeat an earlier point's image (same vector and image_url).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    for start in range(0, count, chunk):
+        size = min(chunk, count - start)
+        vectors = centroids[rng.integers(n_clusters, size=size)]
+        vectors = vectors + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+        authors = rng.integers(n_authors, size=size)
+        urls = [f"synthetic/{start + i}.jpg" for i in range(size)]
+        duplicates = np.flatnonzero(rng.random(size) < duplicate_rate)
+        for i in duplicates[duplicates > 0]:
+            source = rng.integers(i)   # an earlier point of the same chunk
+            vectors[i], urls[i], authors[i] = vectors[source], urls[source], authors[source]
+        for i in range(size):
+            yield start + i, vectors[i], {"image_url": urls[i], "author": f"Author {authors[i]}"}
+
+
+def create_synthetic_collection(client, collection_name, count, dim, upsert_chunk=1000, **options):
+    client.create_collection(
+        collection_name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+    )
+    ensure_payload_indexes(client, collection_name)
+    batch = []
+    for point_id, vector, payload in synthetic_points(count, dim, **options):
+        batch.append(PointStruct(id=point_id, vector=vector.tolist(), payload=payload))
+        if len(batch) == upsert_chunk:
+            client.upsert(collection_name, points=batch, wait=True)
+            batch = []
+    if batch:
+        client.upsert(collection_name, points=batch, wait=True)
+
+
+def build_backend(backend, count, dim, path=None, dtype="float32"):
+    """
+    Returns a client-like backend holding a synthetic collection:
+    "memory" (QdrantClient(":memory:")), "path" (local-path QdrantClient,
+    reused if it already has the collection) or "local" (LocalIndex over a
+    memory-mapped store at `path`, reused if the size matches).
+    """
+    if backend == "local":
+        if not (os.path.exists(os.path.join(path, "columns.json")) and len(open_store(path)) == count):
+            write_store(path, synthetic_points(count, dim), count, dim, dtype=dtype)
+        return LocalIndex.from_store(open_store(path), COLLECTION)
+
+    client = QdrantClient(":memory:") if backend == "memory" else QdrantClient(path=path)
+    if backend == "path" and client.collection_exists(COLLECTION):
+        if client.count(COLLECTION).count == count:
+            return client
+        client.delete_collection(COLLECTION)
+    create_synthetic_collection(client, COLLECTION, count, dim)
+    return client
+
+
+def synthetic_regions(client, count, dim, directory, n_regions=N_REGIONS, page_size=1000, seed=0):
+    """
+    Gives every point `n_regions` noisy copies of its vector as region
+    vectors: a companion collection for Qdrant backends, a float16 regions
+    file in `directory` for LocalIndex. Returns (regions source, bytes of
+    region vectors, bytes of global vectors); Qdrant sizes are the raw
+    float32 vectors, local sizes the files.
+    """
+    rng = np.random.default_rng(seed)
+    if isinstance(client, LocalIndex):
+        regions = np.lib.format.open_memmap(
+            os.path.join(directory, REGIONS_FILE), mode="w+", dtype=np.float16, shape=(count, n_regions, dim)
+        )
+        for start in range(0, count, page_size):
+            vectors = np.asarray(client.vectors[start:start + page_size], dtype=np.float32)
+            noise = rng.standard_normal((len(vectors), n_regions, dim)).astype(np.float32)
+            regions[start:start + len(vectors)] = vectors[:, None, :] + 0.05 * noise
+        regions.flush()
+        del regions
+        global_bytes = client.vectors.size * client.vectors.itemsize
+        return StoreRegions(directory, client), os.path.getsize(os.path.join(directory, REGIONS_FILE)), global_bytes
+
+    ensure_region_collection(client, COLLECTION, dim)
+    offset = None
+    while True:
+        records, offset = client.scroll(COLLECTION, limit=page_size, offset=offset, with_vectors=True)
+        vectors = np.asarray([record.vector for record in records], dtype=np.float32)
+        noise = rng.standard_normal((len(records), n_regions, dim)).astype(np.float32)
+        upsert_regions(client, COLLECTION, [record.id for record in records], vectors[:, None, :] + 0.05 * noise)
+        if offset is None:
+            break
+    return QdrantRegions(client, COLLECTION), count * n_regions * dim * 4, count * dim * 4
+
+
+def synthetic_tier(client, dims=PCA_DIMS):
+    """
+    Fits a PCA projection on the collection and returns (backend,
+    projection, bytes of the scanned tier): a LocalIndex scanning the
+    projected codes, or the client with a `<collection>_pca` companion.
+    """
+    if isinstance(client, LocalIndex):
+        projection = PCAProjection(dims).fit(client.vectors)
+        tiered = LocalIndex(client.ids, client.vectors, client.payloads, COLLECTION, normalized=True)
+        tiered.set_quantizer(projection)
+        return tiered, None, tiered.codes.nbytes
+
+    records, _ = client.scroll(COLLECTION, limit=100_000, with_payload=False, with_vectors=True)
+    projection = PCAProjection(dims).fit(np.asarray([record.vector for record in records], dtype=np.float32))
+    count = client.count(COLLECTION).count
+    tier = projected_collection(COLLECTION)
+    if not (client.collection_exists(tier) and client.count(tier).count == count):
+        index_collection(client, projection, COLLECTION, page_size=1000)
+    return client, projection, count * dims * 4
+
+
+def synthetic_images(directory, count=64, size=512, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{i}.png")
+        Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+
+# Measurement ------------------------------------------------------------
+
+def measure(fn, iterations, warmup=5):
+    """
+    Calls `fn(i)` `iterations` times after `warmup` calls; returns latency
+    percentiles in milliseconds and the sequential QPS.
+    """
+    for i in range(warmup):
+        fn(i)
+    latencies = np.empty(iterations)
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - call_started
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "mean_ms": float(latencies.mean() * 1000),
+        "qps": iterations / elapsed,
+    }
+
+
+def run(client, dim, operations, iterations=200, seed=0):
+    rng = np.random.default_rng(seed)
+    count = client.count(COLLECTION).count
+    point_ids = [record.id for record in client.scroll(COLLECTION, limit=min(count, 10_000), with_payload=False)[0]]
+    queries = rng.standard_normal((iterations + 10, dim)).astype(np.float32)
+    results = {}
+    index_size = {}
+
+    with tempfile.TemporaryDirectory() as scratch:
+        image_paths = synthetic_images(os.path.join(scratch, "images"))
+
+        benchmarks = {
+            "search_similar_paintings": lambda i: search_similar_paintings(client, COLLECTION, queries[i], top_k=8),
+            # One author out of 500: a ~0.2% selective filter
+            "search_filtered": lambda i: search_similar_paintings(
+                client, COLLECTION, queries[i], top_k=8, include={"author": [f"Author {i % 500}"]}
+            ),
+            # 32 queries in one request, as batch_query.py sends them
+            "search_batch_32": lambda i: search_similar_paintings_batch(
+                client, COLLECTION, queries[i % (len(queries) - 32):][:32], top_k=8
+            ),
+            "recommend": lambda i: recommend_similar(client, COLLECTION, point_ids[i % len(point_ids)], limit=15),
+        }
+
+        if "search_regions" in operations:
+            regions, region_bytes, global_bytes = synthetic_regions(client, count, dim, scratch)
+            query_regions = rng.standard_normal((iterations + 10, N_REGIONS, dim)).astype(np.float32)
+            benchmarks["search_regions"] = lambda i: search_region_paintings(
+                client, COLLECTION, regions, queries[i], query_regions[i], top_k=8, oversample=4
+            )
+            index_size = {
+                "global_bytes": global_bytes,
+                "region_bytes": region_bytes,
+                "region_ratio": region_bytes / global_bytes,
+            }
+
+        if "search_two_tier" in operations:
+            tiered, projection, tier_bytes = synthetic_tier(client)
+            benchmarks["search_two_tier"] = lambda i: search_similar_paintings(
+                tiered, COLLECTION, queries[i], top_k=8, projection=projection, rerank=4
+            )
+            index_size["pca_bytes"] = tier_bytes
+            index_size["pca_ratio"] = tier_bytes / (count * dim * 4)
+
+        wide = client.search(COLLECTION, query_vector=queries[0], limit=100)
+        benchmarks["filter_unique_records"] = lambda i: filter_unique_records(wide)
+
+        # Every call decodes and resizes: the memory tier holds nothing
+        cold = ThumbnailCache(cache_dir="", max_memory_items=0)
+        benchmarks["load_image"] = lambda i: cold.get(image_paths[i % len(image_paths)], (180, 180))
+        benchmarks["load_image_grid"] = lambda i: cold.get_many([
+            (image_paths[(i * 8 + j) % len(image_paths)], (256, 256) if j % 2 == 0 else (100, 100))
+            for j in range(8)
+        ])
+
+        engine = StubEngine(dim)
+        batcher = MicroBatcher(engine.embed)
+        embedding_cache = EmbeddingCache(cache_dir=os.path.join(scratch, "embeddings"), model_name="stub")
+        upload = Image.open(image_paths[0]).convert("RGB")
+        upload_bytes = BytesIO()
+        upload.save(upload_bytes, format="PNG")
+        upload_bytes = upload_bytes.getvalue()
+        # Cold: new bytes every call, so each one goes through the batcher
+        benchmarks["generate_embedding"] = lambda i: pipeline.submit_embedding(
+            embedding_cache, batcher, upload, upload_bytes + i.to_bytes(8, "little")
+        ).result()
+        benchmarks["generate_embedding_cached"] = lambda i: pipeline.submit_embedding(
+            embedding_cache, batcher, upload, upload_bytes
+        ).result()
+
+        # A 24 MP scan: reduced decoding + resize/normalize into the batch array
+        scan_path = os.path.join(scratch, "scan.jpg")
+        Image.open(image_paths[0]).resize((6000, 4000)).save(scan_path, quality=90)
+        preprocessor = Preprocessor()
+        benchmarks["preprocess_large_jpeg"] = lambda i: preprocessor.batch([open_image(scan_path)])
+
+        for name in operations:
+            results[name] = measure(benchmarks[name], iterations)
+    return results, index_size
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths on a synthetic collection.")
+    parser.add_argument("--points", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--backend", choices=["memory", "path", "local"], default="memory")
+    parser.add_argument("--path", default=None, help="Qdrant directory (path) or vector store directory (local)")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="Vector store dtype (local)")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help=f"Comma-separated subset of {', '.join(OPERATIONS)}")
+    parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+    if args.backend != "memory" and not args.path:
+        parser.error(f"--backend {args.backend} needs --path")
+
+    started = time.perf_counter()
+    client = build_backend(args.backend, args.points, args.dim, args.path, args.dtype)
+    setup_seconds = time.perf_counter() - started
+    results, index_size = run(client, args.dim, args.ops.split(","), args.iterations)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "config": {
+            "points": args.points, "dim": args.dim, "backend": args.backend,
+            "dtype": args.dtype, "iterations": args.iterations,
+        },
+        "setup_seconds": setup_seconds,
+        "index_size": index_size,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text if not args.output else "\n".join(
+        f"{name:>26}: p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  "
+        f"p99 {r['p99_ms']:8.2f} ms  {r['qps']:9.1f} qps"
+        for name, r in results.items()
+    ))
+
+
+if __name__ == "__main__":
+    main()
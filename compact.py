@@ -0,0 +1,151 @@
+"""
+One-off compaction of duplicate points in a collection.
+
+Older notebook runs assigned ids as `current_id + i`, so every re-run
+inserted the same files again. This tool:
+
+  1. groups points by `image_url` and keeps one point per image, stored
+     under the deterministic id that ingest.py now uses;
+  2. optionally merges near-duplicate images (cosine similarity above
+     `--near-threshold`, found with tiled matrix products of at most
+     `--block-rows` x `--block-cols` scores) into one
+     point whose payload lists the merged `duplicates`.
+
+    python compact.py                         # dry run, prints the plan
+    python compact.py --near-threshold 0.98 --apply
+"""
+import argparse
+
+import numpy as np
+from qdrant_client.models import PointStruct, PointIdsList
+
+from config import COLLECTION_NAME
+from resilient_client import create_client
+from point_ids import path_point_id
+from query_cache import bump_collection_version
+from vector_index import LocalIndex
+
+# Score tile size for near-duplicate search: 1024 x 16384 float32 is 64 MB
+BLOCK_ROWS = 1024
+BLOCK_COLS = 16384
+
+
+def find_near_duplicates(vectors, threshold, block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """
+    Returns a component label per row: rows whose cosine similarity is at
+    least `threshold` (transitively) share a label. `vectors` must be unit
+    norm. Only one (block_rows, block_cols) tile of scores is held at a
+    time, and only tiles on or above the diagonal are computed.
+    """
+    n = vectors.shape[0]
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for row_start in range(0, n, block_rows):
+        queries = np.asarray(vectors[row_start:row_start + block_rows], dtype=np.float32)
+        for col_start in range(row_start, n, block_cols):
+            tile = queries @ np.asarray(vectors[col_start:col_start + block_cols], dtype=np.float32).T
+            rows, cols = np.nonzero(tile >= threshold)
+            for row, col in zip(rows + row_start, cols + col_start):
+                if col > row:
+                    root_a, root_b = find(row), find(col)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([find(i) for i in range(n)])
+
+
+def plan_compaction(index, near_threshold=None, **blocks):
+    """
+    Returns (points_to_upsert, ids_to_delete, stats).
+    """
+    rows_by_url = {}
+    for row in range(len(index)):
+        image_url = index.payloads[row].get("image_url", "")
+        rows_by_url.setdefault(image_url, []).append(row)
+    urls = sorted(url for url in rows_by_url if url)
+    representatives = np.array([rows_by_url[url][0] for url in urls], dtype=np.int64)
+
+    if near_threshold is not None and len(representatives):
+        labels = find_near_duplicates(index.vectors[representatives], near_threshold, **blocks)
+    else:
+        labels = np.arange(len(representatives))
+
+    members_by_label = {}
+    for position, label in enumerate(labels):
+        members_by_label.setdefault(label, []).append(position)
+
+    # Points without an image_url are left alone
+    to_upsert = []
+    keep_ids = {str(index.point_id(row)) for row in rows_by_url.get("", [])}
+    for positions in members_by_label.values():
+        # The lexicographically first image of a group is the one kept
+        keeper_url = urls[positions[0]]
+        keeper_row = representatives[positions[0]]
+        payload = dict(index.payloads[keeper_row])
+        merged = [urls[p] for p in positions[1:]]
+        if merged:
+            payload["duplicates"] = sorted(set(payload.get("duplicates", [])) | set(merged))
+        keeper_id = path_point_id(keeper_url)
+        keep_ids.add(keeper_id)
+        if keeper_id != index.point_id(keeper_row) or merged or len(rows_by_url[keeper_url]) > 1:
+            to_upsert.append(PointStruct(
+                id=keeper_id,
+                vector=np.asarray(index.vectors[keeper_row], dtype=np.float32).tolist(),
+                payload=payload,
+            ))
+
+    all_ids = [index.point_id(row) for row in range(len(index))]
+    to_delete = [point_id for point_id in all_ids if str(point_id) not in keep_ids]
+    stats = {
+        "points": len(index),
+        "unique_images": len(urls),
+        "kept": len(keep_ids),
+        "near_duplicate_groups": sum(len(p) > 1 for p in members_by_label.values()),
+        "deleted": len(to_delete),
+    }
+    return to_upsert, to_delete, stats
+
+
+def apply_compaction(client, collection_name, to_upsert, to_delete, chunk=256):
+    # Upsert the keepers first so every image stays searchable throughout
+    for start in range(0, len(to_upsert), chunk):
+        client.upsert(collection_name, points=to_upsert[start:start + chunk], wait=True)
+    for start in range(0, len(to_delete), chunk):
+        client.delete(
+            collection_name,
+            points_selector=PointIdsList(points=to_delete[start:start + chunk]),
+            wait=True,
+        )
+    bump_collection_version(collection_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate points in a collection.")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--near-threshold", type=float, default=None,
+                        help="Also merge different images with cosine similarity >= this value")
+    parser.add_argument("--apply", action="store_true", help="Write the changes (default is a dry run)")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    parser.add_argument("--block-cols", type=int, default=BLOCK_COLS)
+    args = parser.parse_args()
+
+    client = create_client()
+    index = LocalIndex.from_qdrant(client, args.collection)
+    to_upsert, to_delete, stats = plan_compaction(
+        index, args.near_threshold, block_rows=args.block_rows, block_cols=args.block_cols
+    )
+    print(stats)
+    if args.apply:
+        apply_compaction(client, args.collection, to_upsert, to_delete)
+        print(f"Compacted {args.collection}: {client.count(args.collection, exact=True).count} points left")
+    else:
+        print("Dry run; pass --apply to write the changes")
+
+
+if __name__ == "__main__":
+    main()
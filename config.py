@@ -0,0 +1,112 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Shared settings for the Streamlit app and the offline ingestion tools
+QDRANT_API = os.getenv("QDRANT_API")
+QDRANT_URL = os.getenv(
+    "QDRANT_URL",
+    "https://cd8db105-544d-457f-aa1a-97d4475c1f56.europe-west3-0.gcp.cloud.qdrant.io"
+)
+
+# Qdrant transport: gRPC instead of REST, per-request timeout (seconds)
+# and HTTP connection pool size
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+QDRANT_TIMEOUT_S = int(os.getenv("QDRANT_TIMEOUT_S", "10"))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "32"))
+
+# App-side resilience (see resilient_client.py): retries of failed reads,
+# a hedged second request after QDRANT_HEDGE_AFTER_MS (0 disables), and a
+# circuit breaker that sends reads to QDRANT_FALLBACK_STORE (a vector
+# store directory) or to the last good answers while Qdrant is failing
+QDRANT_RETRIES = int(os.getenv("QDRANT_RETRIES", "2"))
+QDRANT_HEDGE_AFTER_MS = float(os.getenv("QDRANT_HEDGE_AFTER_MS", "0"))
+QDRANT_BREAKER_FAILURES = int(os.getenv("QDRANT_BREAKER_FAILURES", "5"))
+QDRANT_BREAKER_COOLDOWN_S = float(os.getenv("QDRANT_BREAKER_COOLDOWN_S", "30"))
+QDRANT_FALLBACK_STORE = os.getenv("QDRANT_FALLBACK_STORE", "")
+
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "dino_embedding_collection")
+MODEL_NAME = os.getenv("MODEL_NAME", "facebook/dinov2-large")
+
+# On-disk tier of the content-addressed embedding cache
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+
+# Resized result-grid images; set THUMBNAIL_PREWARM=1 to fill it for the
+# whole collection in a background thread when the app starts
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", ".thumbnail_cache")
+THUMBNAIL_PREWARM = os.getenv("THUMBNAIL_PREWARM", "0") == "1"
+
+# Search backend: "qdrant" queries the cluster directly, "local" copies the
+# collection into an in-process index (exact, or IVF for large collections)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "qdrant")
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact")
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+
+# Optional memory-mapped store (see vector_store.py); when set, the local
+# backend opens it instead of copying the collection from Qdrant
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH")
+
+# Compressed scan + exact re-rank: "none", "int8", "pq" (product
+# quantization with PQ_M sub-spaces) or "pca" (PCA_DIMS projected dims, see
+# projection.py). Applies to the local index and, via Qdrant's own
+# quantization or the <collection>_pca tier, to collections created by ingest.py
+QUANTIZATION = os.getenv("QUANTIZATION", "none")
+QUANTIZATION_RERANK = int(os.getenv("QUANTIZATION_RERANK", "4"))
+PQ_M = int(os.getenv("PQ_M", "64"))
+PCA_DIMS = int(os.getenv("PCA_DIMS", "128"))
+PROJECTION_PATH = os.getenv("PROJECTION_PATH", "projection.npz")
+
+# Inference engine for uploads (see embeddings.EmbeddingEngine). Check a
+# variant with `python embeddings.py images` before switching: stored
+# vectors were produced by the fp32 torch path
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")
+INFERENCE_COMPILE = os.getenv("INFERENCE_COMPILE", "0") == "1"
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH")
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or None
+
+# Load the embedding model in a background thread at startup instead of on
+# the first upload, and show the startup timing breakdown in the sidebar
+MODEL_PREWARM = os.getenv("MODEL_PREWARM", "0") == "1"
+SHOW_STARTUP_TIMING = os.getenv("SHOW_STARTUP_TIMING", "0") == "1"
+
+# Micro-batching of concurrent uploads (see batching.py): batch size cap,
+# how long to wait for more requests, queue bound and per-request timeout
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", "64"))
+EMBED_TIMEOUT_S = float(os.getenv("EMBED_TIMEOUT_S", "30"))
+
+# Process-wide cache of neighbour lists (see query_cache.py). After the
+# collection changes, the QUERY_CACHE_WARM_TOP_N most-viewed paintings are
+# recomputed in the background
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+QUERY_CACHE_WARM_TOP_N = int(os.getenv("QUERY_CACHE_WARM_TOP_N", "50"))
+
+# Precomputed neighbour graph for "Find Similar" (see knn_graph.py); empty
+# to always query the search backend
+KNN_GRAPH_PATH = os.getenv("KNN_GRAPH_PATH", "")
+
+# Prometheus metrics on http://127.0.0.1:METRICS_PORT/metrics (0 disables);
+# SHOW_RUN_TIMING adds a sidebar breakdown of each page run
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SHOW_RUN_TIMING = os.getenv("SHOW_RUN_TIMING", "0") == "1"
+
+# Region vectors for detail search (see regions.py): ingest stores CLS +
+# REGION_GRID x REGION_GRID patch regions per painting, and the upload page
+# offers a re-rank of REGION_OVERSAMPLE x top_k global candidates by MaxSim
+REGION_SEARCH = os.getenv("REGION_SEARCH", "0") == "1"
+REGION_GRID = int(os.getenv("REGION_GRID", "2"))
+REGION_OVERSAMPLE = int(os.getenv("REGION_OVERSAMPLE", "4"))
+
+# COLLECTION_NAME may be an alias of a versioned collection (see
+# versions.py); the app re-resolves it this often and refreshes on a switch
+COLLECTION_ALIAS_CHECK_S = float(os.getenv("COLLECTION_ALIAS_CHECK_S", "10"))
+
+# Image decoding (see preprocess.py): reduced JPEG decoding for embedding
+# and thumbnails, and the largest source image accepted, in pixels (150M
+# admits large museum scans; PIL refuses anything above ~179M anyway)
+PREPROCESS_FAST = os.getenv("PREPROCESS_FAST", "1") == "1"
+PREPROCESS_MAX_PIXELS = int(os.getenv("PREPROCESS_MAX_PIXELS", "150000000"))
@@ -0,0 +1,152 @@
+"""
+Content-addressed cache of image embeddings.
+
+Keys are a SHA-256 of the model name, the engine variant (precision,
+backend, preprocessing and JPEG decode mode; see `engine_variant`) and
+the raw image bytes. The same file always maps to the same entry no
+matter where it came from (an upload, a path on disk), and switching
+models or inference settings never returns vectors computed another way.
+
+Two tiers: an in-memory LRU for the hot set and a directory of .npy files
+that survives restarts. Both are bounded and evict least-recently-used
+entries.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import MODEL_NAME, PREPROCESS_FAST
+
+
+def engine_variant(precision="fp32", backend="torch", preprocess="fast", fast_decode=PREPROCESS_FAST):
+    """
+    Label of the inference settings that change an embedding's value.
+    The defaults are those of ingest.py and sync.py.
+    """
+    return f"{precision}/{backend}/{preprocess}/{'reduced' if fast_decode else 'full'}-decode"
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir=".embedding_cache", model_name=MODEL_NAME, variant=None,
+                 max_memory_items=256, max_disk_items=100_000):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.variant = variant or engine_variant()
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        # Oldest access time first, so the front of the dict is evicted first
+        entries = [
+            (entry.stat().st_mtime, entry.name[:-4])
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".npy")
+        ]
+        for _, key in sorted(entries):
+            self._disk[key] = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def key(self, image_bytes: bytes) -> str:
+        digest = hashlib.sha256(self.model_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(self.variant.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return self._memory[key]
+            on_disk = self.cache_dir and key in self._disk
+
+        if on_disk:
+            try:
+                vector = np.load(self._path(key))
+                os.utime(self._path(key))
+            except (OSError, ValueError):
+                vector = None
+            with self._lock:
+                if vector is not None:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.hits_disk += 1
+                    self._remember(key, vector)
+                    return vector
+                self._disk.pop(key, None)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if not self.cache_dir:
+                return
+            self._disk[key] = None
+            self._disk.move_to_end(key)
+            evicted = []
+            while len(self._disk) > self.max_disk_items:
+                evicted.append(self._disk.popitem(last=False)[0])
+
+        # Write-then-rename so concurrent readers never see a partial file
+        tmp_path = self._path(key) + f".{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, vector)
+        os.replace(tmp_path, self._path(key))
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_or_compute(self, image_bytes, compute):
+        """
+        Returns the cached embedding for `image_bytes`, calling `compute()`
+        and storing its result on a miss.
+        """
+        key = self.key(image_bytes)
+        vector = self.get(key)
+        if vector is None:
+            vector = compute()
+            self.put(key, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": len(self._disk),
+            }
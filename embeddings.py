@@ -0,0 +1,263 @@
+"""
+DINOv2 embedding: model loading, batched inference and faster variants.
+
+The stored representation is the mean of `last_hidden_state` over all
+tokens, computed in fp32. Images are preprocessed by preprocess.py into
+the same pixel tensor as AutoImageProcessor. `EmbeddingEngine` returns
+the same vectors with optional speed-ups (bf16 autocast, torch.compile,
+ONNX Runtime);
+`check_parity` verifies a variant against the fp32 reference before it
+is used against an existing collection.
+
+    python embeddings.py images --variants fp32,bf16,compile,onnx
+
+benchmarks per-image latency and parity of each variant.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoImageProcessor, AutoModel
+
+import metrics
+from config import MODEL_NAME
+from preprocess import Preprocessor, open_image
+from regions import pool_regions
+
+MODEL_SIZES = {
+    "small": "facebook/dinov2-small",
+    "base": "facebook/dinov2-base",
+    "large": "facebook/dinov2-large",
+}
+
+# Minimum cosine similarity to the fp32 reference for a variant to be
+# considered compatible with vectors already in the collection
+PARITY_THRESHOLD = 0.999
+
+
+# Load a DINOv2 processor/model pair in inference mode
+def load_model(model_name=MODEL_NAME):
+    processor = AutoImageProcessor.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    return processor, model
+
+
+# Model inputs for a list of RGB images: normalized into one preallocated
+# batch array that torch wraps without copying
+def pixel_inputs(processor, images):
+    return {"pixel_values": torch.from_numpy(Preprocessor.from_processor(processor).batch(images))}
+
+
+# Embed a list of RGB images in a single forward pass
+def embed_images(processor, model, images):
+    """
+    Returns a (len(images), hidden_size) float32 array of mean-pooled
+    last_hidden_state vectors, the same representation stored in Qdrant.
+    """
+    inputs = pixel_inputs(processor, images)
+    with torch.no_grad():
+        outputs = model(**inputs)
+        embeddings = outputs.last_hidden_state.mean(dim=1)
+    return embeddings.cpu().numpy()
+
+
+# Embed a list of RGB images and pool region vectors from the same pass
+def embed_images_with_regions(processor, model, images, grid=2):
+    """
+    Returns the mean-pooled vectors of `embed_images` and a
+    (len(images), 1 + grid * grid, hidden_size) array of CLS + patch
+    region vectors (see regions.py).
+    """
+    inputs = pixel_inputs(processor, images)
+    with torch.no_grad():
+        hidden = model(**inputs).last_hidden_state
+        embeddings = hidden.mean(dim=1)
+    return embeddings.cpu().numpy(), pool_regions(hidden.cpu().numpy(), grid)
+
+
+class EmbeddingEngine:
+    """
+    Configurable inference for the app.
+
+    precision  "fp32" or "bf16" (autocast; matmuls in bfloat16, pooling in fp32)
+    compile    wrap the model with torch.compile
+    backend    "torch" or "onnx" (exports the model once to `onnx_path`)
+    preprocess "fast" (preprocess.py) or "hf" (AutoImageProcessor, the reference)
+    """
+
+    def __init__(self, model_name=MODEL_NAME, precision="fp32", compile=False,
+                 backend="torch", onnx_path=None, num_threads=None, preprocess="fast"):
+        self.model_name = MODEL_SIZES.get(model_name, model_name)
+        self.precision = precision
+        self.backend = backend
+        self.preprocess = preprocess
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.processor, self.model = load_model(self.model_name)
+        self.session = None
+        if backend == "onnx":
+            onnx_path = onnx_path or f"{self.model_name.replace('/', '_')}.onnx"
+            if not os.path.exists(onnx_path):
+                export_onnx(self.model, onnx_path)
+            self.session = create_onnx_session(onnx_path, num_threads)
+        elif compile:
+            self.model = torch.compile(self.model)
+
+    @property
+    def hidden_size(self):
+        return self.model.config.hidden_size
+
+    def embed(self, images):
+        with metrics.span("embed.preprocess"):
+            inputs = self._inputs(images)
+        with metrics.span("embed.forward"):
+            return self._forward(inputs).mean(axis=1)
+
+    def embed_regions(self, images, grid=2):
+        """
+        (mean vectors, CLS + region vectors) from one forward pass.
+        """
+        with metrics.span("embed.preprocess"):
+            inputs = self._inputs(images)
+        with metrics.span("embed.forward"):
+            hidden = self._forward(inputs)
+        return hidden.mean(axis=1), pool_regions(hidden, grid)
+
+    def _inputs(self, images):
+        if self.preprocess == "hf":
+            return self.processor(images=images, return_tensors="pt")
+        return pixel_inputs(self.processor, images)
+
+    def _forward(self, inputs):
+        # float32 (batch, tokens, hidden_size) last_hidden_state
+        if self.session is not None:
+            hidden = self.session.run(
+                ["last_hidden_state"], {"pixel_values": inputs["pixel_values"].numpy()}
+            )[0]
+            return hidden.astype(np.float32)
+
+        with torch.inference_mode():
+            if self.precision == "bf16":
+                with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+                    hidden = self.model(**inputs).last_hidden_state
+            else:
+                hidden = self.model(**inputs).last_hidden_state
+        return hidden.float().cpu().numpy()
+
+
+# ONNX Runtime ---------------------------------------------------------
+
+class LastHiddenState(torch.nn.Module):
+    # Export only the tensor we pool, not the whole ModelOutput
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).last_hidden_state
+
+
+def export_onnx(model, onnx_path, image_size=224):
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    torch.onnx.export(
+        LastHiddenState(model).eval(),
+        (dummy,),
+        onnx_path,
+        input_names=["pixel_values"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "last_hidden_state": {0: "batch"}},
+        opset_version=17,
+    )
+
+
+def create_onnx_session(onnx_path, num_threads=None):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The ONNX backend needs `pip install onnxruntime`") from e
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+
+# Parity and benchmarking ----------------------------------------------
+
+def check_parity(reference, candidate):
+    """
+    Row-wise cosine similarity between two embedding matrices. Returns
+    (min, mean); a shape mismatch (different model size) returns (0, 0).
+    """
+    if reference.shape != candidate.shape:
+        return 0.0, 0.0
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+    return float(cosine.min()), float(cosine.mean())
+
+
+VARIANTS = {
+    "fp32": {},
+    "bf16": {"precision": "bf16"},
+    "compile": {"compile": True},
+    "onnx": {"backend": "onnx"},
+    "hf_preprocess": {"preprocess": "hf"},
+    "small": {"model_name": "small"},
+    "base": {"model_name": "base"},
+}
+
+
+def benchmark(paths, variants, model_name=MODEL_NAME, repeats=3):
+    # The reference is how stored vectors were made: full decode + AutoImageProcessor
+    full = [Image.open(path).convert("RGB") for path in paths]
+    reduced = [open_image(path) for path in paths]
+    reference = EmbeddingEngine(model_name, preprocess="hf")
+    expected = np.concatenate([reference.embed([image]) for image in full])
+    results = {}
+    for name in variants:
+        options = {"model_name": model_name, **VARIANTS[name]}
+        engine = reference if name == "hf_preprocess" else EmbeddingEngine(**options)
+        images = full if options.get("preprocess") == "hf" else reduced
+        engine.embed(images[:1])   # warm-up (and compilation for torch.compile)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            produced = np.concatenate([engine.embed([image]) for image in images])
+        latency = (time.perf_counter() - started) / (repeats * len(images))
+        min_cos, mean_cos = check_parity(expected, produced)
+        results[name] = {
+            "ms_per_image": latency * 1000,
+            "min_cosine": min_cos,
+            "mean_cosine": mean_cos,
+            "compatible": min_cos >= PARITY_THRESHOLD,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark inference variants against the fp32 reference.")
+    parser.add_argument("directory")
+    parser.add_argument("--variants", default="fp32,bf16,compile,onnx",
+                        help=f"Comma-separated subset of {', '.join(VARIANTS)}")
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--model", default=MODEL_NAME)
+    args = parser.parse_args()
+
+    names = sorted(
+        name for name in os.listdir(args.directory)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )[:args.images]
+    paths = [os.path.join(args.directory, name) for name in names]
+    results = benchmark(paths, args.variants.split(","), model_name=args.model)
+    for name, result in results.items():
+        print(f"{name:>8}: {result['ms_per_image']:7.1f} ms/image, "
+              f"cosine min {result['min_cosine']:.5f} mean {result['mean_cosine']:.5f}, "
+              f"{'compatible' if result['compatible'] else 'NOT compatible'} with stored vectors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Payload filters for similarity search.
+
+Fields in `INDEXED_FIELDS` get a Qdrant payload index when ingest.py
+creates or opens a collection. With an index, Qdrant applies the filter
+while it traverses the vector index, and for very selective filters it
+switches to scanning only the matching points, so a filtered query
+costs about as much as an unfiltered one and never needs an inflated
+`limit`. LocalIndex does the same with an in-memory inverted index (see
+vector_index.py).
+
+    build_filter(include={"author": ["Claude Monet"]}, exclude={"author": ["Edgar Degas"]})
+
+Further metadata fields only need an entry in `INDEXED_FIELDS`.
+"""
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.models import FieldCondition, Filter, MatchAny, PayloadSchemaType
+
+INDEXED_FIELDS = {
+    "author": PayloadSchemaType.KEYWORD,
+}
+
+
+def ensure_payload_indexes(client, collection_name, fields=INDEXED_FIELDS):
+    # Creating an index that already exists is a no-op on the server
+    for field, schema in fields.items():
+        client.create_payload_index(collection_name, field_name=field, field_schema=schema, wait=True)
+
+
+def build_filter(include=None, exclude=None):
+    """
+    Filter from {field: [values]} maps: each `include` field must match one
+    of its values, no `exclude` field may match any of its values. Returns
+    None when there is nothing to filter on.
+    """
+    must = [
+        FieldCondition(key=field, match=MatchAny(any=list(values)))
+        for field, values in (include or {}).items() if values
+    ]
+    must_not = [
+        FieldCondition(key=field, match=MatchAny(any=list(values)))
+        for field, values in (exclude or {}).items() if values
+    ]
+    if not must and not must_not:
+        return None
+    return Filter(must=must or None, must_not=must_not or None)
+
+
+def filter_key(include=None, exclude=None):
+    """
+    Hashable form of the include/exclude maps, for cache keys.
+    """
+    def frozen(values_by_field):
+        return tuple(sorted(
+            (field, tuple(sorted(values))) for field, values in (values_by_field or {}).items() if values
+        ))
+    return frozen(include), frozen(exclude)
+
+
+def facet_unsupported(error):
+    # Servers before 1.12 have no facet endpoint; facets also need a keyword index on the field
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in (400, 404)
+    code = getattr(error, "code", None)
+    if callable(code):
+        return getattr(code(), "name", "") in {"UNIMPLEMENTED", "INVALID_ARGUMENT"}
+    return False
+
+
+def field_values(client, collection_name, field, limit=10_000, page_size=1024):
+    """
+    Distinct values of a payload field, most common first. Uses Qdrant's
+    facet API where the server supports it and a payload-only scroll otherwise.
+    """
+    try:
+        response = client.facet(collection_name, key=field, limit=limit)
+        return [hit.value for hit in response.hits]
+    except Exception as e:
+        if not facet_unsupported(e):
+            raise
+    counts = {}
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            with_payload=[field],
+            with_vectors=False,
+            limit=page_size,
+            offset=offset,
+        )
+        for record in records:
+            value = (record.payload or {}).get(field)
+            if value:
+                counts[value] = counts.get(value, 0) + 1
+        if offset is None:
+            break
+    return sorted(counts, key=lambda value: (-counts[value], value))[:limit]
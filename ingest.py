@@ -0,0 +1,348 @@
+"""
+Batched, resumable ingestion of a directory of paintings into Qdrant.
+
+    python ingest.py images --batch-size 16 --workers 4
+
+Images are decoded on worker threads, embedded in fixed-size batches and
+upserted in bounded chunks. Progress is checkpointed after every
+acknowledged upsert, so a crashed run resumes after the last stored file.
+Point ids are deterministic, so re-ingesting a file overwrites its point.
+"""
+import argparse
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+from config import (
+    COLLECTION_NAME, MODEL_NAME, EMBEDDING_CACHE_DIR, QUANTIZATION, PQ_M,
+    KNN_GRAPH_PATH, REGION_SEARCH, REGION_GRID,
+)
+from resilient_client import create_client
+from embedding_cache import EmbeddingCache
+from quantization import qdrant_quantization_config
+from filters import ensure_payload_indexes
+from point_ids import path_point_id, content_point_id
+from preprocess import open_image
+from query_cache import bump_collection_version
+from knn_graph import update_graph
+from vector_index import LocalIndex
+from embeddings import load_model, embed_images, embed_images_with_regions
+from regions import ensure_region_collection, upsert_regions
+from projection import ensure_projected_collection, tier_projection, upsert_projected
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def extract_author(path: str) -> str:
+    name_parts = os.path.basename(path).split("_")
+    author = []
+    for part in name_parts:
+        if re.search(r"\d", part): break
+        author.append(part)
+    return re.sub(r"[^a-zA-Z ]+", "", " ".join(author)).strip()
+
+
+# List image paths in a stable order so checkpoints stay meaningful
+def list_image_paths(base_directory):
+    names = sorted(
+        name for name in os.listdir(base_directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return [f"{base_directory}/{name}" for name in names]
+
+
+class Item(NamedTuple):
+    path: str
+    image: Optional[Image.Image]
+    vector: Optional[np.ndarray]
+    cache_key: Optional[str]
+    point_id: Optional[str]
+
+
+def load_item(path: str, cache=None, id_from="path"):
+    """
+    Reads one file. When the embedding cache already holds these bytes the
+    image is not decoded and `vector` is the cached embedding. Failed reads
+    come back with neither an image nor a vector.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        point_id = content_point_id(data) if id_from == "content" else path_point_id(path)
+        key = None
+        if cache is not None:
+            key = cache.key(data)
+            vector = cache.get(key)
+            if vector is not None:
+                return Item(path, None, vector, key, point_id)
+        return Item(path, open_image(data), None, key, point_id)
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return Item(path, None, None, None, None)
+
+
+# Checkpoint helpers -------------------------------------------------
+
+def load_checkpoint(checkpoint_path, collection_name=COLLECTION_NAME, model_name=MODEL_NAME):
+    """
+    Progress of an interrupted run into the same collection with the same
+    model; a fresh state otherwise.
+    """
+    fresh = {"collection": collection_name, "model": model_name, "last_path": None, "done": 0}
+    if not os.path.exists(checkpoint_path):
+        return fresh
+    with open(checkpoint_path) as f:
+        state = json.load(f)
+    if state.get("collection") != collection_name or state.get("model") != model_name:
+        print(f"Ignoring {checkpoint_path}: it belongs to {state.get('collection')} / {state.get('model')}")
+        return fresh
+    return state
+
+
+def save_checkpoint(checkpoint_path, state):
+    # Write-then-rename so a crash never leaves a truncated checkpoint
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+# Pipeline stages ----------------------------------------------------
+
+def ensure_collection(client, collection_name, vector_size, quantization="none"):
+    """
+    Creates the collection if it does not exist yet. With `quantization` ("int8" / "pq") Qdrant keeps compressed vectors in
+    RAM next to the originals. Payload indexes for the filterable fields are created either way.
+    """
+    try:
+        client.get_collection(collection_name)
+        exists = True
+    except UnexpectedResponse as err:
+        if err.status_code != 404:
+            raise
+        exists = False
+    except ValueError:
+        # Local-mode clients (":memory:" or a path) report a missing collection this way
+        exists = False
+    if not exists:
+        client.create_collection(
+            collection_name,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+            quantization_config=qdrant_quantization_config(quantization, vector_size, m=PQ_M),
+        )
+    # Also covers collections created before payload indexes were added
+    ensure_payload_indexes(client, collection_name)
+
+
+def iter_decoded(paths, workers, prefetch, cache=None, id_from="path"):
+    """
+    Yields an Item per path, in input order, while reading and decoding
+    on a thread pool. At most `prefetch` files are in flight,
+    so memory does not grow with the number of paths.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(load_item, path, cache, id_from))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_batches(decoded, batch_size):
+    batch = []
+    for item in decoded:
+        if item.image is None and item.vector is None:
+            continue
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batch(processor, model, batch, cache=None, regions=False, region_grid=REGION_GRID):
+    """
+    Vectors for a batch of Items: cached ones as they are, the rest in one
+    forward pass. The second value holds the CLS + region vectors with
+    `regions` (every item must then be decoded) and is None otherwise.
+    """
+    if regions:
+        return embed_images_with_regions(processor, model, [item.image for item in batch], region_grid)
+    vectors = [item.vector for item in batch]
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    if misses:
+        computed = embed_images(processor, model, [batch[i].image for i in misses])
+        for i, vector in zip(misses, computed):
+            vectors[i] = vector
+            if cache is not None:
+                cache.put(batch[i].cache_key, vector)
+    return vectors, None
+
+
+def to_point(item, vector):
+    return PointStruct(
+        id=item.point_id,
+        payload={"image_url": item.path, "author": extract_author(item.path)},
+        vector=vector.tolist(),
+    )
+
+
+def run_ingestion(
+    base_directory,
+    client,
+    processor,
+    model,
+    collection_name=COLLECTION_NAME,
+    batch_size=16,
+    workers=4,
+    upsert_chunk=256,
+    checkpoint_path=None,
+    cache=None,
+    quantization="none",
+    id_from="path",
+    regions=False,
+    region_grid=REGION_GRID,
+    model_name=MODEL_NAME,
+    stored_ids=None,
+):
+    """
+    Embeds every image under `base_directory` into `collection_name`.
+    Point ids are derived from the image path (or, with id_from="content",
+    from the file bytes), so re-running overwrites points instead of
+    duplicating them. With `regions`, CLS + patch region vectors go to the
+    companion collection as well (see regions.py); every image is then
+    decoded, since the embedding cache only holds the mean vectors. With
+    quantization="pca", or when the collection already has a PCA tier, the
+    projected vectors are written to `<collection>_pca` (see projection.py).
+    The checkpoint records the collection and `model_name` it was written
+    for and is removed once the run completes. The ids of the points
+    written are appended to the `stored_ids` list when one is given.
+    """
+    checkpoint_path = checkpoint_path or os.path.join(base_directory, ".ingest_checkpoint.json")
+    state = load_checkpoint(checkpoint_path, collection_name, model_name)
+
+    paths = list_image_paths(base_directory)
+    if state["last_path"] is not None:
+        paths = [p for p in paths if p > state["last_path"]]
+        print(f"Resuming after {state['last_path']} ({state['done']} images already stored)")
+
+    ensure_collection(client, collection_name, model.config.hidden_size, quantization=quantization)
+    if regions:
+        ensure_region_collection(client, collection_name, model.config.hidden_size)
+    projection = tier_projection(client, collection_name, quantization)
+    if projection is not None:
+        ensure_projected_collection(client, collection_name, projection.dims)
+
+    buffer = []
+    region_buffer = []
+    processed = 0
+    started = time.perf_counter()
+
+    def flush():
+        nonlocal buffer, region_buffer
+        if not buffer:
+            return
+        if region_buffer:
+            upsert_regions(client, collection_name, [point.id for point in buffer], region_buffer)
+        if projection is not None:
+            upsert_projected(client, collection_name, projection, buffer)
+        client.upsert(collection_name, points=buffer, wait=True)
+        if stored_ids is not None:
+            stored_ids.extend(point.id for point in buffer)
+        state["last_path"] = buffer[-1].payload["image_url"]
+        state["done"] += len(buffer)
+        save_checkpoint(checkpoint_path, state)
+        elapsed = time.perf_counter() - started
+        print(f"Stored {state['done']} images ({processed / elapsed:.1f} images/sec)")
+        buffer = []
+        region_buffer = []
+
+    decoded = iter_decoded(
+        paths, workers, prefetch=batch_size * 2, cache=None if regions else cache, id_from=id_from
+    )
+    for batch in iter_batches(decoded, batch_size):
+        vectors, region_vectors = embed_batch(processor, model, batch, cache, regions, region_grid)
+        if region_vectors is not None:
+            region_buffer.extend(region_vectors)
+        buffer.extend(to_point(item, vector) for item, vector in zip(batch, vectors))
+        processed += len(batch)
+        if len(buffer) >= upsert_chunk:
+            flush()
+    flush()
+    # Complete: a later run starts from the first file again
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {processed} images in {elapsed:.1f}s ({rate:.1f} images/sec)")
+    bump_collection_version(collection_name)
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed a directory of paintings into Qdrant.")
+    parser.add_argument("directory", nargs="?", default="images")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--upsert-chunk", type=int, default=256)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--cache-dir", default=EMBEDDING_CACHE_DIR,
+                        help="Embedding cache directory; pass an empty string to disable")
+    parser.add_argument("--quantization", choices=["none", "int8", "pq", "pca"], default=QUANTIZATION,
+                        help="Quantization for a newly created collection; pca writes the <collection>_pca tier")
+    parser.add_argument("--id-from", choices=["path", "content"], default="path",
+                        help="Derive point ids from the image path or from its bytes")
+    parser.add_argument("--knn-graph", default=KNN_GRAPH_PATH,
+                        help="Add the new points to this neighbour graph afterwards (see knn_graph.py)")
+    parser.add_argument("--regions", action=argparse.BooleanOptionalAction, default=REGION_SEARCH,
+                        help="Also store CLS + patch region vectors for detail search (see regions.py)")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(cache_dir=args.cache_dir, model_name=args.model) if args.cache_dir else None
+    processor, model = load_model(args.model)
+    client = create_client()
+    stored_ids = []
+    run_ingestion(
+        args.directory,
+        client,
+        processor,
+        model,
+        collection_name=args.collection,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        upsert_chunk=args.upsert_chunk,
+        checkpoint_path=args.checkpoint,
+        cache=cache,
+        quantization=args.quantization,
+        id_from=args.id_from,
+        regions=args.regions,
+        model_name=args.model,
+        stored_ids=stored_ids,
+    )
+    if cache is not None:
+        print(f"Embedding cache: {cache.stats()}")
+    if args.knn_graph:
+        # Re-ingested points overwrite vectors the graph already holds
+        updated = update_graph(args.knn_graph, LocalIndex.from_qdrant(client, args.collection), changed_ids=stored_ids)
+        print(f"Updated {updated} points in the neighbour graph {args.knn_graph}")
+
+
+if __name__ == "__main__":
+    main()
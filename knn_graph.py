@@ -0,0 +1,326 @@
+"""
+Precomputed k-nearest-neighbour graph for "Find Similar".
+
+The collection only changes when ingest.py runs, so each point's top-K
+neighbours can be computed offline and "Find Similar" becomes a lookup.
+Neighbours are unique images: points that share an `image_url` collapse
+to one candidate and a point never lists its own image.
+
+A graph is a directory:
+
+    neighbors.npy         (count, K) int32 graph rows, -1 where there are fewer than K
+    scores.npy            (count, K) float16 cosine similarities
+    ids.npy               point ids (int64), or an "id" string column when not all are integers
+    <column>.offsets.npy  payload string columns, as in vector_store.py
+    <column>.data.bin
+    graph.json            K, payload column names and the id type
+
+Scores are computed with blocked matrix products (`block_rows` queries x
+`block_cols` candidates at a time), so peak memory does not depend on the
+collection size. `update_graph` only scores the new and overwritten
+points against the collection and merges them into the existing lists.
+
+    python knn_graph.py graphs/paintings --k 32
+    python knn_graph.py graphs/paintings --store stores/paintings --update
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from qdrant_client.models import ScoredPoint
+
+from config import COLLECTION_NAME
+from resilient_client import create_client
+from vector_index import LocalIndex
+from vector_store import PAYLOAD_COLUMNS, IdColumn, StringColumn, StringColumnWriter, PayloadTable, open_store
+
+BLOCK_ROWS = 1024
+BLOCK_COLS = 16384
+
+
+# Neighbour computation --------------------------------------------------
+
+def image_codes(payloads, count):
+    """
+    Integer id of each row's image_url; rows without one get their own code.
+    """
+    codes = np.empty(count, dtype=np.int64)
+    seen = {}
+    for row in range(count):
+        image_url = payloads[row].get("image_url") or ("", row)
+        codes[row] = seen.setdefault(image_url, len(seen))
+    return codes
+
+
+def blocked_top_k(vectors, query_rows, column_rows, codes, k, initial=None,
+                  block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """
+    Top-k `column_rows` by inner product for each of `query_rows`, skipping
+    columns with the query's own image code. `initial` (neighbors, scores)
+    lists are merged with the new candidates. Returns (neighbors, scores)
+    with -1 / -inf padding.
+    """
+    neighbors = np.full((len(query_rows), k), -1, dtype=np.int64)
+    scores = np.full((len(query_rows), k), -np.inf, dtype=np.float32)
+    if initial is not None:
+        neighbors[:], scores[:] = initial
+        scores[neighbors < 0] = -np.inf
+
+    for row_start in range(0, len(query_rows), block_rows):
+        rows = query_rows[row_start:row_start + block_rows]
+        queries = np.asarray(vectors[rows], dtype=np.float32)
+        best_rows = neighbors[row_start:row_start + block_rows]
+        best_scores = scores[row_start:row_start + block_rows]
+        for col_start in range(0, len(column_rows), block_cols):
+            columns = column_rows[col_start:col_start + block_cols]
+            block = queries @ np.asarray(vectors[columns], dtype=np.float32).T
+            block[codes[rows][:, None] == codes[columns][None, :]] = -np.inf
+
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(columns, block.shape)], axis=1)
+            merged_scores = np.concatenate([best_scores, block], axis=1)
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows[~np.isfinite(best_scores)] = -1
+        neighbors[row_start:row_start + block_rows] = best_rows
+        scores[row_start:row_start + block_rows] = best_scores
+    return neighbors, scores
+
+
+def first_rows(codes):
+    """
+    The first row of each image: the only rows used as candidates.
+    """
+    _, rows = np.unique(codes, return_index=True)
+    return np.sort(rows)
+
+
+def copy_duplicates(neighbors, scores, codes, rows):
+    # Later rows of an image share the list computed for its first row
+    representative = first_rows(codes)[np.unique(codes, return_inverse=True)[1]]
+    neighbors[rows] = neighbors[representative[rows]]
+    scores[rows] = scores[representative[rows]]
+
+
+def build_graph(index, k=32, block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """
+    Returns (neighbors, scores) for every row of a LocalIndex.
+    """
+    codes = image_codes(index.payloads, len(index))
+    candidates = first_rows(codes)
+    neighbors = np.full((len(index), k), -1, dtype=np.int64)
+    scores = np.full((len(index), k), -np.inf, dtype=np.float32)
+    neighbors[candidates], scores[candidates] = blocked_top_k(
+        index.vectors, candidates, candidates, codes, k, block_rows=block_rows, block_cols=block_cols
+    )
+    duplicates = np.setdiff1d(np.arange(len(index)), candidates)
+    copy_duplicates(neighbors, scores, codes, duplicates)
+    return neighbors, scores
+
+
+# Storage --------------------------------------------------------------
+
+def write_graph(path, index, rows, neighbors, scores, k, columns=PAYLOAD_COLUMNS):
+    """
+    Writes graph rows taken from `index` rows `rows` (in that order).
+    Built in a temporary directory and renamed into place.
+    """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, "neighbors.npy"), neighbors.astype(np.int32))
+    np.save(os.path.join(tmp_path, "scores.npy"), np.where(neighbors >= 0, scores, 0).astype(np.float16))
+
+    ids = [index.point_id(row) for row in rows]
+    id_type = "int" if all(isinstance(point_id, int) for point_id in ids) else "str"
+    if id_type == "int":
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(ids, dtype=np.int64))
+    writers = {name: StringColumnWriter(tmp_path, name) for name in columns}
+    if id_type == "str":
+        writers["id"] = StringColumnWriter(tmp_path, "id")
+    for row, point_id in zip(rows, ids):
+        payload = index.payloads[row]
+        for name in columns:
+            writers[name].append(payload.get(name))
+        if id_type == "str":
+            writers["id"].append(point_id)
+    for writer in writers.values():
+        writer.close()
+    with open(os.path.join(tmp_path, "graph.json"), "w") as f:
+        json.dump({"k": k, "columns": list(columns), "id_type": id_type}, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+class KnnGraph:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "graph.json")) as f:
+            meta = json.load(f)
+        self.k = meta["k"]
+        self.neighbors = np.load(os.path.join(path, "neighbors.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, "scores.npy"), mmap_mode="r")
+        if meta["id_type"] == "int":
+            self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        else:
+            # Integer ids of a mixed collection read back as integers
+            self.ids = IdColumn(path, "id")
+        self.payloads = PayloadTable({name: StringColumn(path, name) for name in meta["columns"]})
+        self._row_of = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def row_of(self):
+        if self._row_of is None:
+            self._row_of = {self.point_id(row): row for row in range(len(self))}
+        return self._row_of
+
+    def point_id(self, row):
+        point_id = self.ids[row]
+        return int(point_id) if isinstance(point_id, np.integer) else point_id
+
+    def similar(self, point_id, limit=15):
+        """
+        Up to `limit` neighbours of a point as ScoredPoints (best first), or
+        None when the point is not in the graph (e.g. ingested after it).
+        """
+        row = self.row_of.get(point_id)
+        if row is None:
+            return None
+        return [
+            ScoredPoint(
+                id=self.point_id(neighbor),
+                version=0,
+                score=float(score),
+                payload=self.payloads[neighbor],
+            )
+            for neighbor, score in zip(self.neighbors[row][:limit], self.scores[row][:limit])
+            if neighbor >= 0
+        ]
+
+
+def open_graph(path):
+    return KnnGraph(path)
+
+
+# Build / incremental update -----------------------------------------------
+
+def create_graph(path, index, k=32, **blocks):
+    neighbors, scores = build_graph(index, k, **blocks)
+    return write_graph(path, index, np.arange(len(index)), neighbors, scores, k)
+
+
+def update_graph(path, index, k=None, changed_ids=(), **blocks):
+    """
+    Adds the points of `index` that are missing from the graph at `path`
+    and re-scores `changed_ids`, points already in the graph whose vector
+    or payload was overwritten. The lists of new and changed points, and
+    of points that listed a changed one, are recomputed against the whole
+    collection; every other list is merged with the new scores. Falls back
+    to a full build when there is no graph, K changed or points were
+    deleted. `k` defaults to the graph's own K.
+    """
+    if not os.path.exists(os.path.join(path, "graph.json")):
+        return create_graph(path, index, k or 32, **blocks)
+    graph = open_graph(path)
+    k = k or graph.k
+    old_rows = np.asarray([index.row_of.get(graph.point_id(row), -1) for row in range(len(graph))], dtype=np.int64)
+    if graph.k != k or (old_rows < 0).any():
+        return create_graph(path, index, k, **blocks)
+
+    is_old = np.zeros(len(index), dtype=bool)
+    is_old[old_rows] = True
+    new_rows = np.flatnonzero(~is_old)
+    changed_rows = np.unique(np.asarray(
+        [graph.row_of[point_id] for point_id in changed_ids if point_id in graph.row_of], dtype=np.int64
+    ))
+    if not len(new_rows) and not len(changed_rows):
+        return 0
+
+    # Graph order: existing rows first (their neighbour indices stay valid), then new ones
+    rows = np.concatenate([old_rows, new_rows])
+    graph_rows = np.arange(len(rows))
+    old_count = len(old_rows)
+    codes = image_codes([index.payloads[row] for row in rows], len(rows))
+    vectors = _RowView(index.vectors, rows)
+
+    candidates = first_rows(codes)
+    fresh = np.zeros(len(rows), dtype=bool)
+    fresh[old_count:] = True
+    fresh[changed_rows] = True
+    neighbors = np.full((len(rows), k), -1, dtype=np.int64)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    neighbors[:old_count] = graph.neighbors
+    scores[:old_count] = graph.scores
+    # Lists holding old scores of changed points, or rows that are no longer
+    # an image's first row (a changed image_url), may now miss a neighbour
+    # ranked just below them, so they are recomputed in full as well
+    invalid = fresh | ~np.isin(graph_rows, candidates)
+    stale = ((neighbors >= 0) & invalid[np.maximum(neighbors, 0)]).any(axis=1)
+    recompute = fresh | stale
+
+    fresh_candidates = candidates[fresh[candidates]]
+    merged_candidates = candidates[~recompute[candidates]]
+    recomputed_candidates = candidates[recompute[candidates]]
+    if len(fresh_candidates):
+        neighbors[merged_candidates], scores[merged_candidates] = blocked_top_k(
+            vectors, merged_candidates, fresh_candidates, codes, k,
+            initial=(neighbors[merged_candidates], scores[merged_candidates]), **blocks
+        )
+    if len(recomputed_candidates):
+        neighbors[recomputed_candidates], scores[recomputed_candidates] = blocked_top_k(
+            vectors, recomputed_candidates, candidates, codes, k, **blocks
+        )
+    copy_duplicates(neighbors, scores, codes, np.setdiff1d(graph_rows, candidates))
+    write_graph(path, index, rows, neighbors, scores, k)
+    return len(new_rows) + len(changed_rows)
+
+
+class _RowView:
+    # vectors[rows[i]] addressed as row i, without copying the matrix
+    def __init__(self, vectors, rows):
+        self.vectors = vectors
+        self.rows = rows
+
+    def __getitem__(self, rows):
+        return self.vectors[self.rows[rows]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the k-NN graph used by \"Find Similar\".")
+    parser.add_argument("path")
+    parser.add_argument("--k", type=int, default=None, help="Neighbours per point (default 32, or the graph's K with --update)")
+    parser.add_argument("--store", default=None, help="Read vectors from a vector store instead of Qdrant")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--update", action="store_true", help="Only add points missing from an existing graph")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    parser.add_argument("--block-cols", type=int, default=BLOCK_COLS)
+    args = parser.parse_args()
+
+    if args.store:
+        index = LocalIndex.from_store(open_store(args.store), args.collection)
+    else:
+        index = LocalIndex.from_qdrant(create_client(), args.collection)
+    started = time.perf_counter()
+    blocks = dict(block_rows=args.block_rows, block_cols=args.block_cols)
+    if args.update:
+        written = update_graph(args.path, index, args.k, **blocks)
+    else:
+        written = create_graph(args.path, index, args.k or 32, **blocks)
+    print(f"Wrote {written} rows to {args.path} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,53 @@
+import time
+_import_started = time.perf_counter()
+
 import os
-import random
-from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from transformers import AutoImageProcessor, AutoModel
+import threading
 import streamlit as st
-import torch
-from PIL import Image
 import base64
-from io import BytesIO
-import requests
-from urllib.parse import urlparse
+
+from config import (
+    COLLECTION_NAME, MODEL_NAME,
+    EMBEDDING_CACHE_DIR, THUMBNAIL_CACHE_DIR, THUMBNAIL_PREWARM,
+    SEARCH_BACKEND, LOCAL_INDEX_MODE, LOCAL_INDEX_NPROBE, VECTOR_STORE_PATH,
+    QUANTIZATION, QUANTIZATION_RERANK, PQ_M, PCA_DIMS, PROJECTION_PATH,
+    INFERENCE_PRECISION, INFERENCE_COMPILE, INFERENCE_BACKEND, ONNX_MODEL_PATH, INFERENCE_THREADS,
+    MODEL_PREWARM, SHOW_STARTUP_TIMING,
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_QUEUE_SIZE, EMBED_TIMEOUT_S,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_WARM_TOP_N,
+    KNN_GRAPH_PATH, METRICS_PORT, SHOW_RUN_TIMING,
+    REGION_SEARCH, REGION_GRID, REGION_OVERSAMPLE, COLLECTION_ALIAS_CHECK_S,
+    QDRANT_RETRIES, QDRANT_HEDGE_AFTER_MS, QDRANT_BREAKER_FAILURES, QDRANT_BREAKER_COOLDOWN_S, QDRANT_FALLBACK_STORE,
+)
+import startup
+import pipeline
+import metrics
+from embedding_cache import EmbeddingCache, engine_variant
+from thumbnails import ThumbnailCache, prewarm_collection
+from vector_index import LocalIndex
+from vector_store import open_store
+from quantization import (
+    load_quantizer, quantizer_path, train_quantizer, qdrant_search_params,
+)
+from query_cache import QueryCache, read_local_version
+from queries import filter_unique_records, recommend_similar, search_similar_paintings, search_region_paintings
+from filters import field_values, filter_key
+from knn_graph import open_graph
+from sampling import IdSampler
+from regions import open_regions
+from projection import load_projection, tier_projection
+from preprocess import open_image
+from versions import resolve_alias
+from resilient_client import CircuitBreaker, ResilientClient, create_client
+
+# torch/transformers are deliberately not imported here (see startup.py)
+startup.record("imports", time.perf_counter() - _import_started)
+
+# Start of this script run, the reference for time-to-first-tile
+run_started = time.perf_counter()
+metrics.start_run()
+if METRICS_PORT:
+    metrics.serve(METRICS_PORT)
 
 # Set page configuration first
 st.set_page_config(
@@ -233,26 +271,111 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-load_dotenv()
-
-QDRANT_API = os.getenv("QDRANT_API")
-QDRANT_URL = "https://cd8db105-544d-457f-aa1a-97d4475c1f56.europe-west3-0.gcp.cloud.qdrant.io"
-
-collection_name = "dino_embedding_collection"
+collection_name = COLLECTION_NAME
 
 # Initialize session state
 if 'selected_record' not in st.session_state:
     st.session_state.selected_record = None
 if 'similar_records' not in st.session_state:
     st.session_state.similar_records = None
-
-# Function to create and cache the Qdrant client
+if 'similar_filter' not in st.session_state:
+    st.session_state.similar_filter = None
+if 'featured_records' not in st.session_state:
+    st.session_state.featured_records = None
+    st.session_state.more_records = []
+    st.session_state.more_cursor = None
+
+# Function to create and cache the Qdrant client: pooled transport, with
+# retried/hedged reads and a circuit breaker falling back to a local replica
+# or the last good answers (see resilient_client.py)
 @st.cache_resource
 def get_client():
-    return QdrantClient(
-        url=QDRANT_URL,
-        api_key=QDRANT_API
-    )
+    with startup.timed("qdrant client"):
+        fallback = None
+        if QDRANT_FALLBACK_STORE:
+            fallback = LocalIndex.from_store(open_store(QDRANT_FALLBACK_STORE), collection_name)
+        client = ResilientClient(
+            create_client(),
+            fallback=fallback,
+            retries=QDRANT_RETRIES,
+            hedge_after=QDRANT_HEDGE_AFTER_MS / 1000 or None,
+            breaker=CircuitBreaker(QDRANT_BREAKER_FAILURES, QDRANT_BREAKER_COOLDOWN_S),
+        )
+    metrics.register_collector("circuit", client.breaker.stats)
+    return client
+
+# Collection behind the COLLECTION_NAME alias (see versions.py), re-resolved
+# every COLLECTION_ALIAS_CHECK_S seconds. Process-wide resources are keyed
+# by it, so switching the alias rebuilds them without a restart
+@st.cache_resource(ttl=COLLECTION_ALIAS_CHECK_S)
+def get_live_collection():
+    if SEARCH_BACKEND == "local" and VECTOR_STORE_PATH:
+        return collection_name
+    try:
+        return resolve_alias(get_client(), collection_name)
+    except Exception:
+        return collection_name
+
+# Start the session over (new featured sample, no selection) after a switch
+if st.session_state.get("live_collection") != get_live_collection():
+    st.session_state.live_collection = get_live_collection()
+    st.session_state.selected_record = None
+    st.session_state.similar_records = None
+    st.session_state.featured_records = None
+    st.session_state.more_records = []
+    st.session_state.more_cursor = None
+
+# Function to create and cache the search backend: the Qdrant client itself,
+# or an in-process copy of the collection with the same query API
+def get_search_backend():
+    return open_search_backend(get_live_collection())
+
+@st.cache_resource(max_entries=1)
+def open_search_backend(live_collection):
+    # Every backend call is timed as a "client.<method>" span
+    if SEARCH_BACKEND != "local":
+        return metrics.Instrumented(get_client())
+    with startup.timed("local index"):
+        return metrics.Instrumented(build_local_index())
+
+def build_local_index():
+    if VECTOR_STORE_PATH:
+        # Memory-mapped: opens in milliseconds and shares pages across workers
+        index = LocalIndex.from_store(open_store(VECTOR_STORE_PATH), collection_name)
+    else:
+        index = LocalIndex.from_qdrant(get_client(), collection_name)
+    if LOCAL_INDEX_MODE == "ivf":
+        index.build_ivf(nprobe=LOCAL_INDEX_NPROBE)
+    if QUANTIZATION != "none":
+        trained = VECTOR_STORE_PATH and quantizer_path(VECTOR_STORE_PATH, QUANTIZATION)
+        if trained and os.path.exists(trained):
+            quantizer, codes = load_quantizer(trained)
+        elif QUANTIZATION == "pca" and os.path.exists(PROJECTION_PATH):
+            # The projection the Qdrant tier was written with
+            quantizer, codes = load_projection(PROJECTION_PATH, PCA_DIMS), None
+        else:
+            quantizer, codes = train_quantizer(QUANTIZATION, index.vectors, m=PQ_M, dims=PCA_DIMS), None
+        index.set_quantizer(quantizer, codes, rerank=QUANTIZATION_RERANK)
+    return index
+
+# Qdrant-side equivalent of the local re-rank (None when quantization is off)
+SEARCH_PARAMS = qdrant_search_params(QUANTIZATION, QUANTIZATION_RERANK)
+
+# PCA tier for Qdrant searches with QUANTIZATION=pca (see projection.py):
+# None for the local backend, which scans its own codes, and while the
+# live collection has no <collection>_pca companion (checked again with
+# the alias, so a tier written by `projection.py index` is picked up)
+def get_projection():
+    if QUANTIZATION != "pca" or SEARCH_BACKEND == "local":
+        return None
+    return open_projection(get_live_collection())
+
+@st.cache_resource(ttl=COLLECTION_ALIAS_CHECK_S, max_entries=1)
+def open_projection(live_collection):
+    try:
+        return tier_projection(get_client(), live_collection)
+    except Exception:
+        return None
 
 def add_header(title, emoji, description=None):
     """
@@ -272,68 +395,178 @@ def add_header(title, emoji, description=None):
     # Simple horizontal rule
     st.markdown("<hr style='margin:0.2rem 0 0.6rem 0'>", unsafe_allow_html=True)
 
-# Load the DINOv2-large model
-@st.cache_resource
+# DINOv2 inference engine (fp32 torch unless configured otherwise). Loaded
+# lazily on the first upload, so browsing the collection never pays for it
+ENGINE_OPTIONS = dict(
+    model_name=MODEL_NAME,
+    precision=INFERENCE_PRECISION,
+    compile=INFERENCE_COMPILE,
+    backend=INFERENCE_BACKEND,
+    onnx_path=ONNX_MODEL_PATH,
+    num_threads=INFERENCE_THREADS,
+)
+
 def load_model():
-    processor = AutoImageProcessor.from_pretrained("facebook/dinov2-large")
-    model = AutoModel.from_pretrained("facebook/dinov2-large")
-    return processor, model
+    return startup.get_engine(**ENGINE_OPTIONS)
+
+# Function to get the engine, with a spinner while it is still loading
+def get_engine():
+    if not startup.engine_ready():
+        with st.spinner("Loading the embedding model..."):
+            return load_model()
+    return load_model()
+
+def get_batcher():
+    batcher = startup.get_batcher(
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        max_queue=BATCH_QUEUE_SIZE,
+        **ENGINE_OPTIONS,
+    )
+    metrics.register_collector("batcher", batcher.stats)
+    return batcher
+
+if MODEL_PREWARM:
+    startup.prewarm(**ENGINE_OPTIONS)
 
-processor, model = load_model()
+# Process-wide embedding cache shared by all sessions
+@st.cache_resource
+def get_embedding_cache():
+    cache = EmbeddingCache(
+        cache_dir=EMBEDDING_CACHE_DIR, model_name=MODEL_NAME,
+        variant=engine_variant(INFERENCE_PRECISION, INFERENCE_BACKEND),
+    )
+    metrics.register_collector("embedding_cache", cache.stats)
+    return cache
+
+# Function to start embedding an upload; returns a Future (resolved right
+# away for bytes seen before, otherwise embedded in a shared batch)
+def submit_embedding(image, image_bytes):
+    get_engine()
+    return pipeline.submit_embedding(
+        get_embedding_cache(), get_batcher(), image, image_bytes, timeout=EMBED_TIMEOUT_S
+    )
 
-# Function to generate an embedding
-def generate_embedding(image):
-    inputs = processor(images=image, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model(**inputs)
-        embedding = outputs.last_hidden_state.mean(dim=1)
-    return embedding.squeeze().numpy()
+# Process-wide thumbnail cache (pooled HTTP session, memory + disk tiers)
+@st.cache_resource
+def get_thumbnail_cache():
+    cache = ThumbnailCache(cache_dir=THUMBNAIL_CACHE_DIR)
+    metrics.register_collector("thumbnail_cache", cache.stats)
+    if THUMBNAIL_PREWARM:
+        threading.Thread(
+            target=prewarm_collection, args=(cache, get_client(), collection_name), daemon=True
+        ).start()
+    return cache
 
 def load_image(url_or_path, target_size=(180, 180)):
+    return load_images([(url_or_path, target_size)])[0]
+
+# Function to load several thumbnails concurrently, in order
+def load_images(items):
+    images = []
+    for (url_or_path, _), (image, error) in zip(items, get_thumbnail_cache().get_many(items)):
+        if image is None:
+            st.error(f"Error loading image {url_or_path}: {error}")
+        images.append(image)
+    return images
+
+# Process-wide cache of neighbour lists, dropped whenever the collection
+# changes (point count, the version counter bumped by ingest/compact, or
+# the collection behind the alias)
+@st.cache_resource
+def get_query_cache():
+    def collection_version():
+        count = get_search_backend().count(collection_name, exact=False).count
+        return count, read_local_version(collection_name), get_live_collection()
+
+    def warm_most_viewed():
+        client = get_search_backend()
+        threading.Thread(
+            target=cache.warm,
+            args=([
+                (("recommend", point_id, 15), lambda point_id=point_id: fetch_similar_records(client, point_id))
+                for point_id in cache.most_viewed(QUERY_CACHE_WARM_TOP_N)
+            ],),
+            daemon=True,
+        ).start()
+
+    cache = QueryCache(
+        version_fn=collection_version,
+        max_items=QUERY_CACHE_SIZE,
+        ttl=QUERY_CACHE_TTL,
+        on_invalidate=warm_most_viewed if QUERY_CACHE_WARM_TOP_N else None,
+    )
+    metrics.register_collector("query_cache", cache.stats)
+    return cache
+
+# Precomputed neighbour graph (memory-mapped), reopened when knn_graph.py rewrites it
+def get_knn_graph():
+    if not KNN_GRAPH_PATH:
+        return None
     try:
-        parsed = urlparse(url_or_path)
-        if parsed.scheme in ('http', 'https'):
-            response = requests.get(url_or_path)
-            img = Image.open(BytesIO(response.content))
-        else:
-            if not os.path.isabs(url_or_path):
-                url_or_path = os.path.abspath(url_or_path)
-            img = Image.open(url_or_path)
+        modified = os.path.getmtime(os.path.join(KNN_GRAPH_PATH, "graph.json"))
+    except OSError:
+        return None
+    return open_knn_graph(KNN_GRAPH_PATH, modified)
 
-        img = img.convert('RGB')
-        img = img.resize(target_size, Image.Resampling.LANCZOS)
+@st.cache_resource(max_entries=1)
+def open_knn_graph(path, modified):
+    return open_graph(path)
 
-        return img
-    except Exception as e:
-        st.error(f"Error loading image {url_or_path}: {str(e)}")
-        return None
+# Region vectors for detail search: next to the vector store for the local
+# backend when exported there, otherwise the companion Qdrant collection
+def get_regions():
+    return load_regions(get_live_collection())
 
-# Function to filter unique records
-def filter_unique_records(records):
-    seen_images = set()
-    unique_records = []
-    
-    for record in records:
-        image_url = record.payload.get("image_url", "")
-        if image_url and image_url not in seen_images:
-            seen_images.add(image_url)
-            unique_records.append(record)
-    
-    return unique_records
+@st.cache_resource(max_entries=1)
+def load_regions(live_collection):
+    index = get_search_backend() if SEARCH_BACKEND == "local" else None
+    return open_regions(get_client(), collection_name, VECTOR_STORE_PATH, index)
 
-# Function to get initial records (randomized)
-def get_initial_records():
-    with st.spinner("Loading art collection..."):
-        client = get_client()
-        records, _ = client.scroll(
-            collection_name=collection_name,
-            with_vectors=False,
-            limit=100
-        )
+# Process-wide id list of the collection, for uniform sampling and paging
+def get_sampler():
+    return open_sampler(get_live_collection())
+
+@st.cache_resource(max_entries=1)
+def open_sampler(live_collection):
+    return IdSampler(get_search_backend(), collection_name)
 
-        unique_records = filter_unique_records(records)
-        random.shuffle(unique_records)  # Shuffle images before displaying
-        return unique_records[:30]  # Show up to 30 images
+# Function to get initial records: a uniform random sample of the whole
+# collection, drawn once per session, plus any pages loaded with "Show more"
+@metrics.span("get_initial_records")
+def get_initial_records():
+    if st.session_state.featured_records is None:
+        with st.spinner("Loading art collection..."):
+            # A few spare points in case some share an image
+            records = get_sampler().sample(36)
+            st.session_state.featured_records = filter_unique_records(records)[:30]  # Show up to 30 images
+    return filter_unique_records(st.session_state.featured_records + st.session_state.more_records)
+
+# Function to append the next page of the collection (scroll cursor,
+# starting from a random painting and wrapping around)
+def load_more_records():
+    sampler = get_sampler()
+    cursor = st.session_state.more_cursor or sampler.random_cursor()
+    records, st.session_state.more_cursor = sampler.page(cursor, limit=30)
+    st.session_state.more_records.extend(records)
+
+# Distinct artists for the sidebar filters, most common first. Only loaded
+# once the filters are switched on (without a facet-capable server this
+# scrolls every payload), and again when the alias moves
+@st.cache_resource(ttl=600, max_entries=1)
+def load_authors(live_collection):
+    return field_values(get_search_backend(), collection_name, "author")
+
+# Function to turn the sidebar artist filters into include/exclude maps
+# (optionally excluding the artist of the painting being matched)
+def similarity_filters(record=None):
+    include_authors = list(st.session_state.get("include_authors", []))
+    exclude_authors = list(st.session_state.get("exclude_authors", []))
+    if record is not None and st.session_state.get("exclude_own_artist") and record.payload.get("author"):
+        exclude_authors.append(record.payload["author"])
+    include = {"author": include_authors} if include_authors else {}
+    exclude = {"author": exclude_authors} if exclude_authors else {}
+    return include, exclude
 
 # Function to update the selected record
 def set_selected_record(new_record):
@@ -346,69 +579,86 @@ def clear_selection():
     st.session_state.similar_records = None
 
 # Function to get similar records
+@metrics.span("get_similar_records")
 def get_similar_records():
-    client = get_client()
     if st.session_state.selected_record is not None:
-        if st.session_state.similar_records is None:
+        include, exclude = similarity_filters(st.session_state.selected_record)
+        current_filter = filter_key(include, exclude)
+        if st.session_state.similar_records is None or st.session_state.similar_filter != current_filter:
+            st.session_state.similar_filter = current_filter
+            point_id = st.session_state.selected_record.id
+            graph = get_knn_graph() if not (include or exclude) else None
+            neighbors = graph.similar(point_id, limit=15) if graph is not None else None
+            if neighbors is not None:
+                # Constant-time lookup; points ingested after the graph was built fall through
+                st.session_state.similar_records = neighbors
+                return neighbors
+            cache = get_query_cache()
+            cache.record_view(point_id)
             with st.spinner("Finding similar artworks..."):
-                similar_records = client.recommend(
-                    collection_name=collection_name,
-                    positive=[st.session_state.selected_record.id],
-                    limit=100
+                st.session_state.similar_records = recommend_similar(
+                    get_search_backend(), collection_name, point_id, limit=15, search_params=SEARCH_PARAMS,
+                    query_cache=cache, include=include, exclude=exclude,
                 )
-                st.session_state.similar_records = filter_unique_records(similar_records)[:15]
         return st.session_state.similar_records
     return get_initial_records()
 
-# Function to search similar paintings
-def search_similar_paintings(embedding, top_k=9):
-    with st.spinner("Discovering similar artworks..."):
-        client = get_client()
-        results = client.search(
-            collection_name=collection_name,
-            query_vector=embedding,
-            limit=50
-        )
-        
-        seen_images = set()
-        paintings = []
-        
-        for result in results:
-            image_url = result.payload.get("image_url", "")
-            if image_url and image_url not in seen_images:
-                seen_images.add(image_url)
-                author = result.payload.get("author", "Unknown Artist")
-                score = result.score
-                paintings.append({"image_url": image_url, "author": author, "score": score})
-                
-                if len(paintings) >= top_k:
-                    break
-        
-        return paintings
+def fetch_similar_records(client, point_id):
+    return recommend_similar(client, collection_name, point_id, limit=15, search_params=SEARCH_PARAMS)
+
+# Function to search similar paintings once the upload's embedding is ready.
+# Runs in the background, so the client and cache are passed in
+def find_similar_paintings(client, query_cache, embedding_future, top_k=9, include=None, exclude=None,
+                           projection=None):
+    embedding = embedding_future.result(timeout=EMBED_TIMEOUT_S)
+    return search_similar_paintings(
+        client, collection_name, embedding, top_k=top_k, search_params=SEARCH_PARAMS, query_cache=query_cache,
+        include=include, exclude=exclude, projection=projection, rerank=QUANTIZATION_RERANK,
+    )
+
+# Function to search by image details: embeds the upload's mean and region
+# vectors in one pass (not batched), then re-ranks a global shortlist
+def find_region_paintings(client, query_cache, regions, engine, image, top_k=9, include=None, exclude=None):
+    embeddings, query_regions = engine.embed_regions([image], REGION_GRID)
+    return search_region_paintings(
+        client, collection_name, regions, embeddings[0], query_regions[0], top_k=top_k,
+        oversample=REGION_OVERSAMPLE, search_params=SEARCH_PARAMS, query_cache=query_cache,
+        include=include, exclude=exclude,
+    )
+
+# Function to draw tiles into placeholder slots in the order their
+# thumbnails arrive (render(slot, position, image) fills one slot)
+def stream_tiles(items, slots, render):
+    cache = get_thumbnail_cache()
+    with metrics.span("tiles"):
+        for position, image, error in pipeline.stream_tiles(cache, items, run_started):
+            with slots[position].container():
+                if image is None:
+                    st.error(f"Error loading image {items[position][0]}: {error}")
+                else:
+                    render(position, image)
 
 # Function to display records in a grid layout
 def display_records(records):
     columns = st.columns(5)  # 5 columns for a compact grid
-    for idx, record in enumerate(records):
-        col_idx = idx % 5
-        image_url = record.payload.get("image_url", "")
-        if not image_url:
-            continue
-            
-        image = load_image(image_url)
-        if image:
-            author = record.payload.get("author", "Unknown Artist")
-            with columns[col_idx]:
-                with st.container():
-                    st.image(image=image, use_container_width=True)
-                    st.markdown(f'<div class="image-caption">{author}</div>', unsafe_allow_html=True)
-                    st.button(
-                        label="Find Similar",
-                        key=f"btn_{record.id}",
-                        on_click=set_selected_record,
-                        args=[record]
-                    )
-                    st.markdown("<div style='margin-bottom:0.4rem'></div>", unsafe_allow_html=True)
+    records = [record for record in records if record.payload.get("image_url", "")]
+    # Lay out every slot first, then fill each one as soon as its thumbnail is ready
+    slots = [columns[idx % 5].empty() for idx in range(len(records))]
+
+    def render(idx, image):
+        record = records[idx]
+        author = record.payload.get("author", "Unknown Artist")
+        st.image(image=image, use_container_width=True)
+        st.markdown(f'<div class="image-caption">{author}</div>', unsafe_allow_html=True)
+        st.button(
+            label="Find Similar",
+            key=f"btn_{record.id}",
+            on_click=set_selected_record,
+            args=[record]
+        )
+        st.markdown("<div style='margin-bottom:0.4rem'></div>", unsafe_allow_html=True)
+
+    stream_tiles([(record.payload["image_url"], (180, 180)) for record in records], slots, render)
 
 # ---------------- Sidebar -----------------
 
@@ -425,10 +675,27 @@ st.sidebar.markdown("""
 st.sidebar.markdown('</div>', unsafe_allow_html=True)
 st.sidebar.markdown("<hr style='margin:0.3rem 0 0.4rem 0'>", unsafe_allow_html=True)
 
+# While the circuit breaker is open, results come from the fallback
+if SEARCH_BACKEND != "local" and get_client().breaker.state != "closed":
+    st.sidebar.warning("The vector database is not responding; showing cached or replica results.")
+
 # Main navigation
 st.sidebar.markdown("<h3 style='font-size:0.9rem; margin-bottom:0.2rem'>Navigation</h3>", unsafe_allow_html=True)
 page = st.sidebar.radio("", ["Painting Collection", "Upload and Discover"], label_visibility="collapsed")
 
+# Artist filters, applied inside the vector search (payload index on "author")
+st.sidebar.markdown("<hr style='margin:0.3rem 0 0.4rem 0'>", unsafe_allow_html=True)
+st.sidebar.markdown("<h3 style='font-size:0.9rem; margin-bottom:0.2rem'>Filter Similar Artworks</h3>", unsafe_allow_html=True)
+if st.sidebar.checkbox("Filter by artist", key="artist_filters"):
+    try:
+        authors = load_authors(get_live_collection())
+    except Exception:
+        metrics.inc("errors_total", where="authors")
+        authors = []
+    st.sidebar.multiselect("Only these artists", authors, key="include_authors")
+    st.sidebar.multiselect("Exclude artists", authors, key="exclude_authors")
+st.sidebar.checkbox("Exclude the selected artwork's artist", key="exclude_own_artist")
+
 # Reset button in sidebar when an image is selected
 if st.session_state.selected_record:
     st.sidebar.markdown("<hr style='margin:0.3rem 0 0.4rem 0'>", unsafe_allow_html=True)
@@ -459,6 +726,29 @@ if st.session_state.selected_record:
             </style>
             """, unsafe_allow_html=True)
 
+# Optional startup timing breakdown and query cache statistics
+if SHOW_STARTUP_TIMING:
+    with st.sidebar.expander("Startup timing"):
+        for phase, seconds in startup.report():
+            st.markdown(f"<div class='sidebar-nav-text'>{phase}: {seconds * 1000:.0f} ms</div>", unsafe_allow_html=True)
+    with st.sidebar.expander("Time to first result"):
+        for label, stats in (("first tile", pipeline.time_to_first_tile.summary()),
+                             ("all tiles", pipeline.time_to_last_tile.summary())):
+            st.markdown(
+                f"<div class='sidebar-nav-text'>{label}: p50 {stats['p50'] * 1000:.0f} ms, "
+                f"p95 {stats['p95'] * 1000:.0f} ms ({stats['count']} pages)</div>",
+                unsafe_allow_html=True,
+            )
+    with st.sidebar.expander("Query cache"):
+        stats = get_query_cache().stats()
+        st.markdown(
+            f"<div class='sidebar-nav-text'>hit rate: {stats['hit_rate']:.0%} "
+            f"({stats['hits']}/{stats['hits'] + stats['misses']})<br>"
+            f"saved: {stats['saved_seconds']:.1f} s<br>"
+            f"entries: {stats['entries']}, invalidations: {stats['invalidations']}</div>",
+            unsafe_allow_html=True,
+        )
+
 # ---------------- Main Pages -----------------
 
 # Painting Collection Section
@@ -510,9 +800,13 @@ if page == "Painting Collection":
 
         if records:
             display_records(records)
+            more_cursor = st.session_state.more_cursor
+            if not st.session_state.selected_record and not (more_cursor and more_cursor.done):
+                st.button("Show more artworks", key="show_more", on_click=load_more_records)
         else:
             st.warning("No images found in the collection. Please try again later.")
     except Exception as e:
+        metrics.inc("errors_total", where="collection_page")
         st.error(f"An error occurred: {str(e)}")
 
 # Upload and Discover Section
@@ -523,6 +817,9 @@ elif page == "Upload and Discover":
         description="Find paintings similar to any image you upload"
     )
 
+    # Start loading the model while the user picks a file
+    startup.prewarm(**ENGINE_OPTIONS)
+
     # Centered text, academic tone
     st.markdown("""
     <div style="text-align:center; margin-top:0.2rem; margin-bottom:0.6rem;">
@@ -537,10 +834,37 @@ elif page == "Upload and Discover":
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         uploaded_file = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"], label_visibility="collapsed")
+        match_details = REGION_SEARCH and st.checkbox(
+            "Match details", help="Re-rank by the best-matching regions of each painting, for faces or textures"
+        )
 
     # Results section with minimal styling
     if uploaded_file is not None:
-        image = Image.open(uploaded_file).convert("RGB")
+        image_bytes = uploaded_file.getvalue()
+        try:
+            image = open_image(image_bytes)
+        except Exception as e:
+            metrics.inc("errors_total", where="upload_decode")
+            st.error(f"Could not read this image: {e}")
+            st.stop()
+
+        # Embed and search in the background while the page is drawn
+        include, exclude = similarity_filters()
+        try:
+            if match_details:
+                results_future = pipeline.submit(
+                    find_region_paintings,
+                    get_search_backend(), get_query_cache(), get_regions(), get_engine(), image, top_k=8,
+                    include=include, exclude=exclude,
+                )
+            else:
+                results_future = pipeline.submit(
+                    find_similar_paintings,
+                    get_search_backend(), get_query_cache(), submit_embedding(image, image_bytes), top_k=8,
+                    include=include, exclude=exclude, projection=get_projection(),
+                )
+        except Exception as e:
+            results_future = pipeline.failed(e)
 
         st.markdown("""
         <div class="header-with-emoji" style="margin-top:1rem;">
@@ -563,8 +887,8 @@ elif page == "Upload and Discover":
         with col2:
             try:
                 # Request 8 similar images
-                embedding = generate_embedding(image)
-                results = search_similar_paintings(embedding, top_k=8)
+                with st.spinner("Discovering similar artworks..."), metrics.span("upload.embed_and_search"):
+                    results = results_future.result()
 
                 if results:
                     st.markdown("""
@@ -573,43 +897,47 @@ elif page == "Upload and Discover":
                     </div>
                     """, unsafe_allow_html=True)
                     
+                    # Two slots per column: even results are large, odd results small.
+                    # Tiles are drawn as soon as each thumbnail arrives
                     columns = st.columns(4)
-                    for col_idx in range(4):
-                        with columns[col_idx]:
-                            idx1 = col_idx * 2
-                            idx2 = col_idx * 2 + 1
-
-                            if idx1 < len(results):
-                                with st.container():
-                                    similar_image = load_image(results[idx1]["image_url"], target_size=(256, 256))
-                                    st.image(similar_image, use_container_width=True)
-                                    st.markdown(
-                                        f'<div class="image-caption">{results[idx1]["author"]}</div>',
-                                        unsafe_allow_html=True
-                                    )
-                                    similarity = int(results[idx1]["score"] * 100)
-                                    st.progress(similarity / 100)
-                                    st.markdown(
-                                        f'<div class="similarity-info">Similarity: {similarity}%</div>',
-                                        unsafe_allow_html=True
-                                    )
-                                    st.markdown("<div style='margin-bottom:0.3rem'></div>", unsafe_allow_html=True)
-
-                            if idx2 < len(results):
-                                with st.container():
-                                    similar_image = load_image(results[idx2]["image_url"], target_size=(100, 100))
-                                    st.image(similar_image, use_container_width=True)
-                                    st.markdown(
-                                        f'<div class="image-caption">{results[idx2]["author"]}</div>',
-                                        unsafe_allow_html=True
-                                    )
-                                    similarity = int(results[idx2]["score"] * 100)
-                                    st.progress(similarity / 100)
-                                    st.markdown(
-                                        f'<div class="similarity-info">Similarity: {similarity}%</div>',
-                                        unsafe_allow_html=True
-                                    )
+                    slots = [columns[idx // 2].empty() for idx in range(len(results))]
+
+                    def render(idx, similar_image):
+                        st.image(similar_image, use_container_width=True)
+                        st.markdown(
+                            f'<div class="image-caption">{results[idx]["author"]}</div>',
+                            unsafe_allow_html=True
+                        )
+                        similarity = int(results[idx]["score"] * 100)
+                        st.progress(similarity / 100)
+                        st.markdown(
+                            f'<div class="similarity-info">Similarity: {similarity}%</div>',
+                            unsafe_allow_html=True
+                        )
+                        if idx % 2 == 0:
+                            st.markdown("<div style='margin-bottom:0.3rem'></div>", unsafe_allow_html=True)
+
+                    stream_tiles([
+                        (result["image_url"], (256, 256) if idx % 2 == 0 else (100, 100))
+                        for idx, result in enumerate(results)
+                    ], slots, render)
                 else:
                     st.warning("No similar paintings found. Try uploading a different image.")
             except Exception as e:
+                metrics.inc("errors_total", where="upload_page")
                 st.error(f"An error occurred while processing your image: {str(e)}")
+
+# Optional breakdown of where this page run spent its time (drawn last,
+# once every span of the run has been recorded)
+if SHOW_RUN_TIMING:
+    with st.sidebar.expander("This page run"):
+        st.markdown(
+            f"<div class='sidebar-nav-text'>total: {(time.perf_counter() - run_started) * 1000:.0f} ms</div>",
+            unsafe_allow_html=True,
+        )
+        for name, seconds, calls in metrics.run_breakdown():
+            st.markdown(
+                f"<div class='sidebar-nav-text'>{name}: {seconds * 1000:.0f} ms"
+                f"{f' ({calls} calls)' if calls > 1 else ''}</div>",
+                unsafe_allow_html=True,
+            )
@@ -0,0 +1,194 @@
+"""
+Timing spans, counters and a Prometheus text endpoint.
+
+    with metrics.span("search"):          # or @metrics.span("search") on a function
+        ...
+    metrics.inc("errors_total", page="upload")
+
+Span durations go into per-name histograms. A span also lands in the
+current page run's breakdown when it runs on the thread that called
+`start_run()` (the Streamlit script thread); work on pool threads is
+only counted in the histograms. Cache statistics are not counted on the
+hot path: `register_collector` exposes a `stats()` dict that is read
+when the endpoint is scraped.
+
+Recording a span costs two `perf_counter` calls and one short lock.
+
+    METRICS_PORT=9464 streamlit run main.py
+    curl localhost:9464/metrics
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "artsearch"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}                 # span name -> [bucket counts..., +Inf count, sum]
+_counters = defaultdict(float)   # (name, sorted label items) -> value
+_collectors = {}                 # prefix -> stats() callable
+_local = threading.local()
+_server = None
+
+
+# Recording ----------------------------------------------------------------
+
+def observe(name, seconds):
+    slot = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[slot] += 1
+        histogram[-1] += seconds
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.append((name, seconds))
+
+
+class span:
+    """
+    Times a block (context manager) or a function (decorator).
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started)
+
+    def __call__(self, fn):
+        def wrapper(*args, **kwargs):
+            with span(self.name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += amount
+
+
+def register_collector(prefix, stats_fn):
+    """
+    Exports every numeric value of `stats_fn()` as `<PREFIX>_<prefix>_<key>` at scrape time.
+    """
+    with _lock:
+        _collectors[prefix] = stats_fn
+
+
+class Instrumented:
+    """
+    Proxy that times every method call of a client as span "client.<method>".
+    """
+
+    def __init__(self, client, prefix="client"):
+        self._client = client
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+        return span(f"{self._prefix}.{name}")(attribute)
+
+
+# Per-run breakdown -----------------------------------------------------------
+
+def start_run():
+    """
+    Starts collecting the spans of this thread (one Streamlit page run).
+    """
+    _local.run = []
+
+
+def run_breakdown():
+    """
+    [(span name, total seconds, calls)] of the current run, in first-seen order.
+    """
+    totals = {}
+    for name, seconds in getattr(_local, "run", None) or []:
+        total, calls = totals.get(name, (0.0, 0))
+        totals[name] = (total + seconds, calls + 1)
+    return [(name, total, calls) for name, (total, calls) in totals.items()]
+
+
+# Prometheus exposition ---------------------------------------------------------
+
+def _labels(items):
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    with _lock:
+        histograms = {name: list(values) for name, values in _histograms.items()}
+        counters = dict(_counters)
+        collectors = dict(_collectors)
+
+    lines = [f"# TYPE {PREFIX}_span_seconds histogram"]
+    for name, values in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), values[:-1]):
+            cumulative += count
+            lines.append(f'{PREFIX}_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{PREFIX}_span_seconds_sum{{span="{name}"}} {values[-1]}')
+        lines.append(f'{PREFIX}_span_seconds_count{{span="{name}"}} {cumulative}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+
+    for prefix, stats_fn in sorted(collectors.items()):
+        try:
+            stats = stats_fn()
+        except Exception:
+            continue
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {PREFIX}_{prefix}_{key} gauge")
+                lines.append(f"{PREFIX}_{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """
+    Serves GET /metrics from a daemon thread (once per process).
+    """
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
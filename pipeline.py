@@ -0,0 +1,96 @@
+"""
+Non-blocking data layer for the result grids.
+
+Streamlit runs the page script top to bottom on one thread, so the
+layer is built on futures rather than an asyncio loop: slow work (the
+upload's embedding, backend queries) is started early and collected
+when it is needed, and thumbnails are yielded in completion order so
+each grid slot is drawn as soon as its own image is ready instead of
+after the slowest one.
+
+`LatencyStats` keeps recent time-to-first-tile / time-to-last-tile
+samples for the sidebar.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ui-query")
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs a blocking call (a backend query) in the background; returns a Future.
+    """
+    return _pool.submit(fn, *args, **kwargs)
+
+
+def completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def failed(exception):
+    future = Future()
+    future.set_exception(exception)
+    return future
+
+
+def submit_embedding(cache, batcher, image, image_bytes, timeout=30.0):
+    """
+    Future for the upload's embedding: resolved immediately on an
+    embedding cache hit, otherwise queued on the micro-batcher and stored
+    in the cache when it arrives.
+    """
+    key = cache.key(image_bytes)
+    vector = cache.get(key)
+    if vector is not None:
+        return completed(vector)
+    future = batcher.submit(image, timeout)
+    future.add_done_callback(lambda done: done.exception() is None and cache.put(key, done.result()))
+    return future
+
+
+class LatencyStats:
+    def __init__(self, max_samples=500):
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            samples = np.asarray(self._samples)
+        if not len(samples):
+            return {"count": 0, "p50": 0.0, "p95": 0.0}
+        return {
+            "count": len(samples),
+            "p50": float(np.percentile(samples, 50)),
+            "p95": float(np.percentile(samples, 95)),
+        }
+
+
+time_to_first_tile = LatencyStats()
+time_to_last_tile = LatencyStats()
+
+
+def stream_tiles(thumbnails, items, started):
+    """
+    Yields (position, image, error) for [(source, size), ...] as each
+    thumbnail finishes and records the time since `started` (perf_counter) to the
+    first and the last tile.
+    """
+    first = True
+    for position, image, error in thumbnails.iter_completed(items):
+        if first:
+            time_to_first_tile.record(time.perf_counter() - started)
+            first = False
+        yield position, image, error
+    if items:
+        time_to_last_tile.record(time.perf_counter() - started)
@@ -0,0 +1,21 @@
+import hashlib
+import uuid
+
+# Fixed namespace so every machine derives the same ids for the same input
+POINT_ID_NAMESPACE = uuid.UUID("5f0c7a52-8a61-4d3e-9a3e-6f1d2b7c9e41")
+
+
+# Deterministic point id for an image path: re-ingesting a file overwrites
+# its point instead of adding a duplicate
+def path_point_id(image_url: str) -> str:
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, image_url))
+
+
+# Deterministic point id for image bytes: identical files share one point
+def content_point_id(data: bytes) -> str:
+    return digest_point_id(hashlib.sha256(data).hexdigest())
+
+
+# Same id from an already computed SHA-256 hex digest of the bytes
+def digest_point_id(digest: str) -> str:
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, digest))
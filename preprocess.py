@@ -0,0 +1,131 @@
+"""
+Image decoding and DINOv2 preprocessing shared by the app and ingestion.
+
+`open_image` decodes only as many pixels as the model needs: JPEGs are
+decoded at 1/2, 1/4 or 1/8 scale through libjpeg's DCT scaling
+(`Image.draft`), and other formats are box-reduced by an integer factor
+right after decoding. The decoded image keeps a shorter side of at least
+`DECODE_MIN_SIDE` (twice the resize edge), so the final bicubic resize
+still filters out the detail the model cannot see. A JPEG scan then
+peaks at 1/64 of the memory of a full decode. PNG and other formats
+are still decoded in full once. Sources above `PREPROCESS_MAX_PIXELS`
+are refused from their header, before any pixel is decoded.
+
+`Preprocessor` does what AutoImageProcessor does for DINOv2 (shortest
+edge to 256 with bicubic resampling, 224 center crop, rescale, ImageNet
+normalization). Resize and crop are a single PIL resize of the crop box,
+and the result is normalized in place into a preallocated
+(batch, 3, 224, 224) float32 array, which torch wraps without a copy.
+
+Reduced decoding changes pixels slightly; `python embeddings.py images
+--variants fp32,hf_preprocess` checks parity with the stored vectors.
+"""
+import math
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from config import PREPROCESS_FAST, PREPROCESS_MAX_PIXELS
+
+# BitImageProcessor defaults used by facebook/dinov2-*
+RESIZE_SHORTEST_EDGE = 256
+CROP_SIZE = 224
+IMAGE_MEAN = (0.485, 0.456, 0.406)
+IMAGE_STD = (0.229, 0.224, 0.225)
+DECODE_MIN_SIDE = 2 * RESIZE_SHORTEST_EDGE
+
+
+# Checked per image from the header; PIL's own process-wide
+# Image.MAX_IMAGE_PIXELS (which refuses about 179M pixels) is left alone
+def check_size(img, max_pixels=PREPROCESS_MAX_PIXELS):
+    width, height = img.size
+    if width * height > max_pixels:
+        raise Image.DecompressionBombError(
+            f"{width}x{height} image exceeds the {max_pixels} pixel limit (PREPROCESS_MAX_PIXELS)"
+        )
+
+
+def open_image(source, min_side=DECODE_MIN_SIDE, fast=PREPROCESS_FAST):
+    """
+    RGB image from bytes, a path or a file object. With `fast`, it is
+    decoded and reduced to the smallest size whose shorter side is still
+    at least `min_side`.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    with Image.open(source) as img:
+        check_size(img)
+        if fast:
+            draft(img, (min_side, min_side))
+        image = img.convert("RGB")
+    if fast:
+        factor = min(image.size) // min_side
+        if factor >= 2:
+            image = image.reduce(factor)
+    return image
+
+
+def draft(img, size):
+    """
+    Asks the JPEG decoder for the largest DCT scale-down that keeps the
+    image at least `size` (aspect ratio kept, shorter side vs. the larger
+    of `size`). A no-op for other formats.
+    """
+    width, height = img.size
+    scale = max(size) / min(width, height)
+    if scale < 1:
+        img.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+
+
+class Preprocessor:
+    def __init__(self, resize=RESIZE_SHORTEST_EDGE, crop=CROP_SIZE, mean=IMAGE_MEAN, std=IMAGE_STD,
+                 resample=Image.Resampling.BICUBIC):
+        self.resize = resize
+        self.crop = crop
+        self.resample = resample
+        std = np.asarray(std, dtype=np.float32).reshape(3, 1, 1)
+        # (pixel / 255 - mean) / std  ==  pixel * scale - offset
+        self.scale = 1.0 / (255.0 * std)
+        self.offset = np.asarray(mean, dtype=np.float32).reshape(3, 1, 1) / std
+
+    @classmethod
+    def from_processor(cls, processor):
+        """
+        Reads the sizes, statistics and resampling filter of an AutoImageProcessor.
+        """
+        return cls(
+            resize=processor.size["shortest_edge"],
+            crop=processor.crop_size["height"],
+            mean=processor.image_mean,
+            std=processor.image_std,
+            resample=Image.Resampling(int(processor.resample)),
+        )
+
+    def crop_box(self, width, height):
+        # Same output size rounding as transformers' shortest-edge resize and center crop
+        if width <= height:
+            new_width, new_height = self.resize, int(self.resize * height / width)
+        else:
+            new_width, new_height = int(self.resize * width / height), self.resize
+        left = (new_width - self.crop) // 2
+        top = (new_height - self.crop) // 2
+        scale_x, scale_y = width / new_width, height / new_height
+        return (left * scale_x, top * scale_y, (left + self.crop) * scale_x, (top + self.crop) * scale_y)
+
+    def into(self, image, out):
+        """
+        Writes the normalized (3, crop, crop) tensor of `image` into `out`.
+        """
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        box = self.crop_box(*image.size)
+        pixels = np.asarray(image.resize((self.crop, self.crop), self.resample, box=box))
+        np.multiply(pixels.transpose(2, 0, 1), self.scale, out=out)
+        out -= self.offset
+
+    def batch(self, images):
+        out = np.empty((len(images), 3, self.crop, self.crop), dtype=np.float32)
+        for i, image in enumerate(images):
+            self.into(image, out[i])
+        return out
@@ -0,0 +1,318 @@
+"""
+PCA projection for two-tier search: every point is scanned at a few
+dimensions, and only a shortlist is re-ranked with the full vectors.
+
+`PCAProjection` is fitted offline on the collection's embeddings. Its
+components are sorted by explained variance, so the first `dims` of them
+form a Matryoshka-style tier, and one fitted projection serves 64, 128 or
+256 dims without refitting. Projected vectors are re-normalized, so the
+tier is searched by cosine like the full collection.
+
+It has the quantizer interface (see quantization.py). With
+QUANTIZATION=pca, `LocalIndex` scans the projected codes and re-ranks
+`QUANTIZATION_RERANK * limit` candidates with the full vectors. On Qdrant,
+the tier is a companion collection `<collection>_pca` holding the
+projected vectors and payloads under the same point ids.
+`two_tier_search` shortlists there, then re-scores the shortlist's full
+vectors. Ingestion and sync write the companion collection with the
+projection saved at PROJECTION_PATH, and the app projects queries with
+that same projection.
+
+    python projection.py fit --store stores/paintings --dims 64,128,256
+    python projection.py index              # backfill <collection>_pca
+
+`fit` reports recall@k of each tier against the exact full-dimension
+search, the per-query speedup and the memory of the scanned vectors.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from qdrant_client.models import Distance, PointStruct, SearchRequest, VectorParams
+
+from config import COLLECTION_NAME, PCA_DIMS, PROJECTION_PATH, QUANTIZATION_RERANK
+from vector_index import LocalIndex, dot, normalize
+
+BLOCK_ROWS = 65536
+
+
+def projected_collection(collection_name):
+    return f"{collection_name}_pca"
+
+
+class PCAProjection:
+    kind = "pca"
+
+    def __init__(self, dims=128, mean=None, components=None, variance=None):
+        self.dims = dims
+        self.mean = mean                # (dim,)
+        self.components = components    # (dim, dim), rows by decreasing variance
+        self.variance = variance        # (dim,) explained variance per component
+
+    def fit(self, vectors, sample_size=100_000, seed=0):
+        rng = np.random.default_rng(seed)
+        n = vectors.shape[0]
+        rows = np.sort(rng.choice(n, sample_size, replace=False)) if n > sample_size else slice(None)
+        sample = normalize(np.asarray(vectors[rows], dtype=np.float32))
+        self.mean = sample.mean(axis=0)
+        centered = sample - self.mean
+        eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered / max(len(sample) - 1, 1))
+        order = np.argsort(eigenvalues)[::-1]
+        self.components = np.ascontiguousarray(eigenvectors[:, order].T, dtype=np.float32)
+        self.variance = np.maximum(eigenvalues[order], 0).astype(np.float32)
+        return self
+
+    def with_dims(self, dims):
+        """
+        The same projection truncated to its first `dims` components.
+        """
+        return PCAProjection(dims, self.mean, self.components, self.variance)
+
+    def explained(self, dims=None):
+        return float(self.variance[:dims or self.dims].sum() / self.variance.sum())
+
+    def project(self, vectors):
+        """
+        (n, dim) or (dim,) vectors -> unit-norm (n, dims) or (dims,) float32.
+        """
+        vectors = normalize(vectors)
+        return normalize((vectors - self.mean) @ self.components[:self.dims].T)
+
+    def encode(self, vectors):
+        codes = np.empty((vectors.shape[0], self.dims), dtype=np.float32)
+        for start in range(0, vectors.shape[0], BLOCK_ROWS):
+            codes[start:start + BLOCK_ROWS] = self.project(vectors[start:start + BLOCK_ROWS])
+        return codes
+
+    def scores(self, codes, query):
+        return dot(codes, self.project(query))
+
+    def state(self):
+        return {"dims": np.int64(self.dims), "mean": self.mean, "components": self.components,
+                "variance": self.variance}
+
+
+def save_projection(path, projection):
+    np.savez(path, kind=projection.kind, **projection.state())
+
+
+def load_projection(path, dims=None):
+    """
+    Projection saved by `save_projection` (or with codes, by
+    quantization.save_quantizer), truncated to `dims` if given.
+    """
+    data = np.load(path)
+    return PCAProjection(
+        dims=dims or int(data["dims"]), mean=data["mean"], components=data["components"],
+        variance=data["variance"],
+    )
+
+
+# Qdrant tier ----------------------------------------------------------
+
+def ensure_projected_collection(client, collection_name, dims):
+    from filters import ensure_payload_indexes
+
+    name = projected_collection(collection_name)
+    if not client.collection_exists(name):
+        client.create_collection(name, vectors_config=VectorParams(size=dims, distance=Distance.COSINE))
+    # Shortlists are filtered here, so the companion needs the payload indexes too
+    ensure_payload_indexes(client, name)
+
+
+def tier_projection(client, collection_name, quantization="none", path=PROJECTION_PATH, dims=PCA_DIMS):
+    """
+    Projection that writes to `collection_name` must also apply to its
+    `<collection>_pca` tier: the saved one, at the companion's size when
+    the companion exists, at `dims` when `quantization` is "pca", else None.
+    """
+    name = projected_collection(collection_name)
+    if client.collection_exists(name):
+        dims = client.get_collection(name).config.params.vectors.size
+    elif quantization != "pca":
+        return None
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} does not exist; fit it on an existing collection with `python projection.py fit`"
+        )
+    return load_projection(path, dims)
+
+
+def upsert_projected(client, collection_name, projection, points):
+    """
+    Writes the projection of `points` (PointStructs of the main collection) to the companion collection.
+    """
+    if not points:
+        return
+    projected = projection.encode(np.asarray([point.vector for point in points], dtype=np.float32))
+    client.upsert(
+        projected_collection(collection_name),
+        points=[
+            PointStruct(id=point.id, vector=vector.tolist(), payload=point.payload)
+            for point, vector in zip(points, projected)
+        ],
+        wait=True,
+    )
+
+
+def index_collection(client, projection, collection_name=COLLECTION_NAME, page_size=256):
+    """
+    (Re)builds `<collection>_pca` from the vectors of the main collection.
+    """
+    ensure_projected_collection(client, collection_name, projection.dims)
+    written, offset = 0, None
+    while True:
+        records, offset = client.scroll(
+            collection_name, limit=page_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        upsert_projected(client, collection_name, projection, records)
+        written += len(records)
+        if offset is None:
+            return written
+
+
+def two_tier_search(client, collection_name, projection, query_vector, limit=10, rerank=4,
+                    query_filter=None, search_params=None):
+    """
+    Shortlists `limit * rerank` points in the projected collection, then
+    re-scores them with the cosine of their full vectors.
+    """
+    candidates = client.search(
+        collection_name=projected_collection(collection_name),
+        query_vector=projection.project(query_vector).tolist(),
+        limit=limit * rerank,
+        query_filter=query_filter,
+        search_params=search_params,
+    )
+    return two_tier_rescore(client, collection_name, [candidates], [query_vector], limit)[0]
+
+
+def two_tier_search_batch(client, collection_name, projection, query_vectors, limit=10, rerank=4,
+                          query_filter=None, search_params=None):
+    """
+    `two_tier_search` for many queries: one search_batch request for the
+    shortlists and one retrieve for all their full vectors.
+    """
+    projected = projection.project(np.asarray(query_vectors, dtype=np.float32))
+    shortlists = client.search_batch(
+        collection_name=projected_collection(collection_name),
+        requests=[
+            SearchRequest(vector=vector.tolist(), limit=limit * rerank, filter=query_filter,
+                          params=search_params, with_payload=True)
+            for vector in projected
+        ],
+    )
+    return two_tier_rescore(client, collection_name, shortlists, query_vectors, limit)
+
+
+def two_tier_rescore(client, collection_name, shortlists, query_vectors, limit):
+    """
+    Re-scores each shortlist with the cosine of its points' full vectors
+    (fetched in one retrieve) against its query; keeps the best `limit`.
+    """
+    ids = list({candidate.id: None for candidates in shortlists for candidate in candidates})
+    if not ids:
+        return [[] for _ in shortlists]
+    records = client.retrieve(collection_name, ids=ids, with_payload=False, with_vectors=True)
+    vectors = {record.id: record.vector for record in records}
+    results = []
+    for candidates, query_vector in zip(shortlists, query_vectors):
+        scored = [candidate for candidate in candidates if candidate.id in vectors]
+        if scored:
+            exact = dot(normalize([vectors[candidate.id] for candidate in scored]), normalize(query_vector))
+            # Copies: the client may cache the shortlist objects themselves
+            scored = [candidate.model_copy(update={"score": float(score)}) for candidate, score in zip(scored, exact)]
+        results.append(sorted(scored, key=lambda candidate: -candidate.score)[:limit])
+    return results
+
+
+# Offline report -------------------------------------------------------
+
+def evaluate(index, projection, queries, k=10, rerank=4):
+    """
+    {dims, explained, recall, ms_per_query, scanned_mb} of the tier
+    against the exact full-dimension scan of `index` over `queries`.
+    """
+    from quantization import recall_at_k
+
+    index.set_quantizer(projection, rerank=rerank)
+    report = {
+        "dims": projection.dims,
+        "explained": projection.explained(),
+        "recall": recall_at_k(index, queries, k),
+        "ms_per_query": time_search(index, queries, k),
+        "scanned_mb": index.codes.nbytes / 1e6,
+    }
+    index.quantizer = index.codes = index.rerank = None
+    return report
+
+
+def baseline(index, queries, k=10):
+    return {
+        "dims": index.vectors.shape[1],
+        "ms_per_query": time_search(index, queries, k),
+        "scanned_mb": index.vectors.nbytes / 1e6,
+    }
+
+
+def time_search(index, queries, k):
+    started = time.perf_counter()
+    for query in queries:
+        index.search(query_vector=query, limit=k, with_payload=False)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a PCA projection for two-tier search.")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--path", default=PROJECTION_PATH, help="Where the projection is saved")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fit_parser = commands.add_parser("fit", help="Fit on a vector store or the collection and report each tier")
+    fit_parser.add_argument("--store", help="Vector store directory (default: copy the collection from Qdrant)")
+    fit_parser.add_argument("--dims", default=f"64,{PCA_DIMS},256",
+                            help=f"Tiers to report; the projection is saved at PCA_DIMS ({PCA_DIMS})")
+    fit_parser.add_argument("--rerank", type=int, default=QUANTIZATION_RERANK)
+    fit_parser.add_argument("--k", type=int, default=10)
+    fit_parser.add_argument("--queries", type=int, default=200)
+    index_parser = commands.add_parser("index", help="Write the projected vectors to <collection>_pca")
+    index_parser.add_argument("--dims", type=int, default=PCA_DIMS, help="Tier size (default: PCA_DIMS)")
+    args = parser.parse_args()
+
+    from resilient_client import create_client
+
+    if args.command == "fit":
+        if args.store:
+            from vector_store import open_store
+            local = LocalIndex.from_store(open_store(args.store), args.collection)
+        else:
+            local = LocalIndex.from_qdrant(create_client(), args.collection)
+        tiers = [int(dims) for dims in args.dims.split(",")]
+        started = time.perf_counter()
+        # Saved at the size ingest, sync and the app use for the tier
+        projection = PCAProjection(dims=PCA_DIMS).fit(local.vectors)
+        save_projection(args.path, projection)
+        print(f"Fitted on {len(local)} vectors in {time.perf_counter() - started:.1f}s, saved to {args.path}")
+
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(len(local), min(args.queries, len(local)), replace=False))
+        queries = np.asarray(local.vectors[rows], dtype=np.float32)
+        full = baseline(local, queries, args.k)
+        print(f"{full['dims']:>5} dims: exact, {full['ms_per_query']:.2f} ms/query, {full['scanned_mb']:.1f} MB")
+        for dims in tiers:
+            report = evaluate(local, projection.with_dims(dims), queries, args.k, args.rerank)
+            print(f"{dims:>5} dims: recall@{args.k} = {report['recall']:.3f} "
+                  f"({report['explained']:.0%} of variance), {report['ms_per_query']:.2f} ms/query "
+                  f"({full['ms_per_query'] / report['ms_per_query']:.1f}x), {report['scanned_mb']:.1f} MB "
+                  f"({full['scanned_mb'] / report['scanned_mb']:.0f}x smaller)")
+
+    elif args.command == "index":
+        if not os.path.exists(args.path):
+            parser.error(f"{args.path} does not exist; run `python projection.py fit` first")
+        projection = load_projection(args.path, args.dims)
+        written = index_collection(create_client(), projection, args.collection)
+        print(f"Wrote {written} {projection.dims}-dim vectors to {projected_collection(args.collection)}")
+
+
+if __name__ == "__main__":
+    main()
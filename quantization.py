@@ -0,0 +1,234 @@
+"""
+Compressed vector representations for the local index.
+
+    ScalarQuantizer   int8 per dimension, 1 byte/dim (4x smaller than float32)
+    ProductQuantizer  m sub-spaces x 256 trained centroids, m bytes/vector
+    PCAProjection     first `dims` principal components, 4 * dims bytes/vector
+                      (see projection.py)
+
+Both expose `encode(vectors) -> codes` and `scores(codes, query)`, the
+approximate inner products used to shortlist candidates. `LocalIndex`
+re-ranks the shortlist against the full-precision vectors.
+
+    python quantization.py stores/paintings --kind pq --m 64
+
+trains a quantizer on a vector store, saves it next to the store and
+reports recall@k against the exact search.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from qdrant_client.models import (
+    CompressionRatio, ProductQuantization, ProductQuantizationConfig, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams,
+)
+
+from projection import PCAProjection, load_projection
+from vector_index import LocalIndex, dot, normalize, top_k
+from vector_store import open_store
+
+BLOCK_ROWS = 65536
+
+
+class ScalarQuantizer:
+    kind = "int8"
+
+    def __init__(self, scale=None):
+        self.scale = scale
+
+    def train(self, vectors):
+        # Symmetric per-dimension range; unit-norm rows keep it well inside [-1, 1]
+        max_abs = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in range(0, vectors.shape[0], BLOCK_ROWS):
+            block = np.abs(np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32))
+            np.maximum(max_abs, block.max(axis=0), out=max_abs)
+        max_abs[max_abs == 0] = 1.0
+        self.scale = max_abs / 127.0
+        return self
+
+    def encode(self, vectors):
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, vectors.shape[0], BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            codes[start:start + BLOCK_ROWS] = np.clip(np.rint(block / self.scale), -127, 127)
+        return codes
+
+    def scores(self, codes, query):
+        return dot(codes, query * self.scale)
+
+    def state(self):
+        return {"scale": self.scale}
+
+
+class ProductQuantizer:
+    kind = "pq"
+
+    def __init__(self, m=64, codebooks=None):
+        self.m = m
+        self.codebooks = codebooks      # (m, 256, dim // m)
+
+    def train(self, vectors, sample_size=50_000, iterations=15, seed=0):
+        rng = np.random.default_rng(seed)
+        n, dim = vectors.shape
+        if dim % self.m:
+            raise ValueError(f"Vector size {dim} is not divisible by m={self.m}")
+        sample_rows = np.sort(rng.choice(n, min(n, sample_size), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+        sub_dim = dim // self.m
+        n_centroids = min(256, len(sample))
+
+        self.codebooks = np.zeros((self.m, 256, sub_dim), dtype=np.float32)
+        for j in range(self.m):
+            part = sample[:, j * sub_dim:(j + 1) * sub_dim]
+            centroids = part[rng.choice(len(part), n_centroids, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = self._nearest(part, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, part)
+                counts = np.bincount(assignment, minlength=n_centroids)[:, None]
+                filled = counts[:, 0] > 0
+                centroids[filled] = sums[filled] / counts[filled]
+            self.codebooks[j, :n_centroids] = centroids
+        return self
+
+    @staticmethod
+    def _nearest(points, centroids):
+        distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def encode(self, vectors):
+        n, dim = vectors.shape
+        sub_dim = dim // self.m
+        codes = np.empty((n, self.m), dtype=np.uint8)
+        for start in range(0, n, BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            for j in range(self.m):
+                part = block[:, j * sub_dim:(j + 1) * sub_dim]
+                codes[start:start + BLOCK_ROWS, j] = self._nearest(part, self.codebooks[j])
+        return codes
+
+    def scores(self, codes, query):
+        # Asymmetric distance: a (m, 256) table of query/centroid products
+        sub_dim = self.codebooks.shape[2]
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, sub_dim))
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        columns = np.arange(self.m)
+        for start in range(0, codes.shape[0], BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS]
+            scores[start:start + BLOCK_ROWS] = table[columns, block].sum(axis=1)
+        return scores
+
+    def state(self):
+        return {"m": np.int64(self.m), "codebooks": self.codebooks}
+
+
+def train_quantizer(kind, vectors, m=64, dims=128):
+    if kind == "int8":
+        return ScalarQuantizer().train(vectors)
+    if kind == "pq":
+        return ProductQuantizer(m=m).train(vectors)
+    if kind == "pca":
+        return PCAProjection(dims=dims).fit(vectors)
+    raise ValueError(f"Unknown quantization kind {kind!r}")
+
+
+def save_quantizer(path, quantizer, codes):
+    np.savez(path, kind=quantizer.kind, codes=codes, **quantizer.state())
+
+
+def load_quantizer(path):
+    data = np.load(path)
+    kind = str(data["kind"])
+    if kind == "int8":
+        quantizer = ScalarQuantizer(scale=data["scale"])
+    elif kind == "pca":
+        quantizer = load_projection(path)
+    else:
+        quantizer = ProductQuantizer(m=int(data["m"]), codebooks=data["codebooks"])
+    return quantizer, data["codes"]
+
+
+def quantizer_path(store_path, kind):
+    return os.path.join(store_path, f"quantizer_{kind}.npz")
+
+
+# Qdrant equivalents -------------------------------------------------
+
+def qdrant_quantization_config(kind, vector_size, m=64):
+    """
+    `quantization_config` for create_collection, or None for "none" and
+    "pca" (whose tier is a separate collection, see projection.py).
+    """
+    if kind == "int8":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True))
+    if kind == "pq":
+        # Qdrant expresses PQ as a compression ratio; pick the closest to m bytes/vector
+        ratios = {4: CompressionRatio.X4, 8: CompressionRatio.X8, 16: CompressionRatio.X16,
+                  32: CompressionRatio.X32, 64: CompressionRatio.X64}
+        wanted = vector_size * 4 / m
+        ratio = ratios[min(ratios, key=lambda r: abs(r - wanted))]
+        return ProductQuantization(product=ProductQuantizationConfig(compression=ratio, always_ram=True))
+    return None
+
+
+def qdrant_search_params(kind, rerank=4):
+    """
+    `search_params` that make Qdrant re-score an oversampled quantized
+    shortlist with the original vectors, like LocalIndex does. None for
+    "pca", which projection.two_tier_search re-ranks on the client.
+    """
+    if kind not in ("int8", "pq"):
+        return None
+    return SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=float(rerank)))
+
+
+def recall_at_k(index, queries, k=10):
+    """
+    Fraction of the exact top-k (full-precision scan) that `index.search`
+    returns, averaged over `queries`.
+    """
+    hits = 0
+    for query in queries:
+        exact_rows = top_k(dot(index.vectors, normalize(query)), k)
+        expected = {index.point_id(row) for row in exact_rows}
+        found = {point.id for point in index.search(query_vector=query, limit=k, with_payload=False)}
+        hits += len(expected & found)
+    return hits / (k * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a quantizer for a vector store and report recall@k.")
+    parser.add_argument("store")
+    parser.add_argument("--kind", choices=["int8", "pq", "pca"], default="int8")
+    parser.add_argument("--m", type=int, default=64, help="PQ sub-spaces (must divide the vector size)")
+    parser.add_argument("--dims", type=int, default=128, help="PCA dimensions kept")
+    parser.add_argument("--rerank", type=int, default=4, help="Shortlist size as a multiple of k")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    store = open_store(args.store)
+    started = time.perf_counter()
+    quantizer = train_quantizer(args.kind, store.vectors, m=args.m, dims=args.dims)
+    codes = quantizer.encode(store.vectors)
+    save_quantizer(quantizer_path(args.store, args.kind), quantizer, codes)
+    print(f"Trained {args.kind} in {time.perf_counter() - started:.1f}s: "
+          f"{codes.nbytes / 1e6:.1f} MB of codes vs {store.vectors.nbytes / 1e6:.1f} MB of vectors")
+
+    rng = np.random.default_rng(0)
+    queries = np.asarray(store.vectors[np.sort(rng.choice(len(store), min(args.queries, len(store)), replace=False))],
+                         dtype=np.float32)
+    index = LocalIndex.from_store(store)
+    for label, configure in (("exact", lambda: None),
+                             (args.kind, lambda: index.set_quantizer(quantizer, codes, rerank=args.rerank))):
+        configure()
+        started = time.perf_counter()
+        recall = recall_at_k(index, queries, args.k)
+        elapsed = (time.perf_counter() - started) / len(queries)
+        print(f"{label:>6}: recall@{args.k} = {recall:.3f}, {elapsed * 1000:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Backend queries behind the app's grids, importable without Streamlit.
+
+main.py calls these with its cached client and query cache;
+benchmark.py calls the same functions against a synthetic collection.
+`client` is a QdrantClient or a LocalIndex, and `query_cache` is a
+query_cache.QueryCache or None. `include` / `exclude` are {field: [values]}
+payload filters (see filters.py). `regions` is a regions.QdrantRegions or
+regions.StoreRegions. `projection` is a projection.PCAProjection whose
+`<collection>_pca` tier shortlists Qdrant searches, or None.
+"""
+from qdrant_client.models import SearchRequest
+
+import metrics
+from filters import build_filter, filter_key
+from projection import two_tier_search, two_tier_search_batch
+from query_cache import vector_key
+from regions import rerank
+
+
+# Function to filter unique records
+def filter_unique_records(records):
+    seen_images = set()
+    unique_records = []
+
+    for record in records:
+        image_url = record.payload.get("image_url", "")
+        if image_url and image_url not in seen_images:
+            seen_images.add(image_url)
+            unique_records.append(record)
+
+    if len(unique_records) < len(records):
+        metrics.inc("dedup_dropped_total", len(records) - len(unique_records))
+    return unique_records
+
+
+def _cached(query_cache, key, compute):
+    if query_cache is None:
+        return compute()
+    return query_cache.get_or_compute(key, compute)
+
+
+# Function to fetch the neighbours of a stored painting ("Find Similar")
+@metrics.span("recommend_similar")
+def recommend_similar(client, collection_name, point_id, limit=15, search_params=None, query_cache=None,
+                      include=None, exclude=None):
+    def compute():
+        similar_records = client.recommend(
+            collection_name=collection_name,
+            positive=[point_id],
+            limit=limit,
+            query_filter=build_filter(include, exclude),
+            search_params=search_params
+        )
+        return filter_unique_records(similar_records)[:limit]
+
+    key = ("recommend", point_id, limit)
+    if include or exclude:
+        key += filter_key(include, exclude)
+    return _cached(query_cache, key, compute)
+
+
+# Function to search the paintings closest to an embedding
+@metrics.span("search_similar_paintings")
+def search_similar_paintings(client, collection_name, embedding, top_k=9, search_params=None, query_cache=None,
+                             include=None, exclude=None, projection=None, rerank=4):
+    key = ("search", vector_key(embedding), top_k)
+    if include or exclude:
+        key += filter_key(include, exclude)
+    if projection is not None:
+        key += ("pca", projection.dims, rerank)
+
+    def compute():
+        if projection is not None:
+            return two_tier_search(
+                client, collection_name, projection, embedding, limit=top_k, rerank=rerank,
+                query_filter=build_filter(include, exclude), search_params=search_params,
+            )
+        return client.search(
+            collection_name=collection_name,
+            query_vector=embedding,
+            limit=top_k,
+            query_filter=build_filter(include, exclude),
+            search_params=search_params
+        )
+
+    return _paintings(_cached(query_cache, key, compute), top_k)
+
+
+# Function to search the paintings closest to each of many embeddings in
+# one request (offline batch jobs, see batch_query.py); no query cache
+@metrics.span("search_similar_paintings_batch")
+def search_similar_paintings_batch(client, collection_name, embeddings, top_k=9, search_params=None,
+                                   include=None, exclude=None, projection=None, rerank=4):
+    query_filter = build_filter(include, exclude)
+    if projection is not None:
+        results = two_tier_search_batch(
+            client, collection_name, projection, embeddings, limit=top_k, rerank=rerank,
+            query_filter=query_filter, search_params=search_params,
+        )
+    else:
+        results = client.search_batch(
+            collection_name=collection_name,
+            requests=[
+                SearchRequest(vector=[float(value) for value in embedding], limit=top_k, filter=query_filter,
+                              params=search_params, with_payload=True)
+                for embedding in embeddings
+            ],
+        )
+    return [_paintings(result, top_k) for result in results]
+
+
+# Function to search by image details: global shortlist, region re-rank
+@metrics.span("search_region_paintings")
+def search_region_paintings(client, collection_name, regions, embedding, query_regions, top_k=9, oversample=4,
+                            search_params=None, query_cache=None, include=None, exclude=None):
+    key = ("regions", vector_key(embedding), top_k, oversample)
+    if include or exclude:
+        key += filter_key(include, exclude)
+    results = _cached(
+        query_cache,
+        key,
+        lambda: rerank(
+            client, collection_name, regions, embedding, query_regions, limit=top_k, oversample=oversample,
+            query_filter=build_filter(include, exclude), search_params=search_params,
+        ),
+    )
+    return _paintings(results, top_k)
+
+
+def _paintings(results, top_k):
+    seen_images = set()
+    paintings = []
+    dropped = 0
+
+    for result in results:
+        image_url = result.payload.get("image_url", "")
+        if image_url and image_url not in seen_images:
+            seen_images.add(image_url)
+            author = result.payload.get("author", "Unknown Artist")
+            score = result.score
+            paintings.append({"image_url": image_url, "author": author, "score": score})
+
+            if len(paintings) >= top_k:
+                break
+        else:
+            dropped += 1
+
+    if dropped:
+        metrics.inc("dedup_dropped_total", dropped)
+    return paintings
@@ -0,0 +1,150 @@
+"""
+Process-wide cache of neighbour lists for "Find Similar" and uploads.
+
+Entries are keyed by (kind, point id or quantized query vector, k) and
+expire after `ttl` seconds; the cache is LRU-bounded. Every key also
+carries the collection version, so when the collection changes all old
+entries stop matching and are dropped.
+
+The version is the collection's point count (polled at most every
+`check_interval` seconds) combined with a local counter that ingest.py
+and compact.py bump after writing, so same-size updates are caught too.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+VERSION_DIR = ".collection_versions"
+
+
+# Local collection version counter ----------------------------------------
+
+def _version_path(collection_name):
+    return os.path.join(VERSION_DIR, collection_name)
+
+
+def read_local_version(collection_name):
+    try:
+        with open(_version_path(collection_name)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_collection_version(collection_name):
+    """
+    Called by writers after they change a collection.
+    """
+    os.makedirs(VERSION_DIR, exist_ok=True)
+    version = read_local_version(collection_name) + 1
+    tmp_path = _version_path(collection_name) + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(version))
+    os.replace(tmp_path, _version_path(collection_name))
+    return version
+
+
+def vector_key(vector, precision=127):
+    """
+    Hash of the unit-normalised vector rounded to int8, so the same image
+    embedded twice (tiny float noise included) maps to the same entry.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector = vector / norm
+    return hashlib.sha1(np.rint(vector * precision).astype(np.int8).tobytes()).hexdigest()
+
+
+class QueryCache:
+    def __init__(self, version_fn=None, max_items=2048, ttl=600, check_interval=30, on_invalidate=None):
+        """
+        `version_fn()` returns the current collection version (any hashable);
+        `on_invalidate()` runs after a version change cleared the cache.
+        """
+        self.version_fn = version_fn
+        self.on_invalidate = on_invalidate
+        self.max_items = max_items
+        self.ttl = ttl
+        self.check_interval = check_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+        self.views = Counter()
+
+        self._entries = OrderedDict()   # key -> (expires_at, compute_seconds, value)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = 0.0
+
+    def current_version(self):
+        now = time.monotonic()
+        if self.version_fn is not None and now - self._version_checked >= self.check_interval:
+            self._version_checked = now
+            version = self.version_fn()
+            changed = False
+            with self._lock:
+                if version != self._version:
+                    changed = self._version is not None
+                    if changed:
+                        self.invalidations += 1
+                    self._version = version
+                    self._entries.clear()
+            if changed and self.on_invalidate is not None:
+                self.on_invalidate()
+        return self._version
+
+    def get_or_compute(self, key, compute):
+        key = (self.current_version(), *key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return entry[2]
+
+        started = time.perf_counter()
+        value = compute()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (time.monotonic() + self.ttl, elapsed, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+        return value
+
+    def record_view(self, point_id):
+        with self._lock:
+            self.views[point_id] += 1
+
+    def most_viewed(self, n):
+        with self._lock:
+            return [point_id for point_id, _ in self.views.most_common(n)]
+
+    def warm(self, keys_and_computes):
+        """
+        Precomputes [(key, compute), ...], e.g. the most-viewed paintings.
+        """
+        for key, compute in keys_and_computes:
+            self.get_or_compute(key, compute)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
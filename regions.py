@@ -0,0 +1,215 @@
+"""
+Region vectors for detail search: the CLS token plus mean-pooled patch
+regions of each painting, scored against a query by late interaction.
+
+DINOv2 splits a 224px image into a 16x16 grid of patch tokens. Besides
+the global mean vector in the main collection, each painting can store
+`1 + grid * grid` vectors (CLS, then the patch grid pooled into
+`grid x grid` cells) in a companion collection `<collection>_regions`,
+a Qdrant multivector with the MAX_SIM comparator under the same point ids.
+
+Search stays two-stage: the global vector shortlists
+`limit * oversample` candidates from the main collection, then only
+those candidates' region vectors are fetched and re-ranked by MaxSim
+(for each query vector, the best-matching region; averaged). A face or
+a texture in the query image can then match one cell of a painting
+instead of being diluted by the painting's mean.
+
+    python ingest.py images --regions
+    python regions.py vector_store          # region vectors for the local engine
+
+With grid=2 the companion collection holds 5x the vectors of the main one.
+"""
+import argparse
+import os
+from math import isqrt
+
+import numpy as np
+from qdrant_client.models import Distance, MultiVectorComparator, MultiVectorConfig, PointStruct, VectorParams
+
+from config import COLLECTION_NAME
+
+REGIONS_FILE = "regions.npy"
+
+
+def region_collection(collection_name):
+    return f"{collection_name}_regions"
+
+
+def pool_regions(hidden, grid=2):
+    """
+    (batch, tokens, dim) last_hidden_state -> (batch, 1 + grid * grid, dim)
+    float32: the CLS token followed by the patch grid mean-pooled into
+    `grid x grid` cells, row by row. Register tokens, if the model has
+    any, sit between CLS and the patches and are skipped.
+    """
+    hidden = np.asarray(hidden, dtype=np.float32)
+    side = isqrt(hidden.shape[1] - 1)
+    patches = hidden[:, -side * side:].reshape(hidden.shape[0], side, side, hidden.shape[2])
+    cells = [
+        block.mean(axis=(1, 2))
+        for rows in np.array_split(patches, grid, axis=1)
+        for block in np.array_split(rows, grid, axis=2)
+    ]
+    return np.stack([hidden[:, 0]] + cells, axis=1)
+
+
+def maxsim(query, documents):
+    """
+    Late-interaction score of a (q, dim) query against (n, r, dim)
+    documents: the mean over query vectors of the best cosine similarity
+    among each document's vectors. Returns (n,) scores in [-1, 1].
+    """
+    query = query / np.linalg.norm(query, axis=-1, keepdims=True)
+    documents = documents / np.linalg.norm(documents, axis=-1, keepdims=True)
+    return np.einsum("qd,nrd->nqr", query, documents).max(axis=2).mean(axis=1)
+
+
+# Storage --------------------------------------------------------------
+
+def ensure_region_collection(client, collection_name, dim):
+    name = region_collection(collection_name)
+    if not client.collection_exists(name):
+        client.create_collection(
+            name,
+            vectors_config=VectorParams(
+                size=dim,
+                distance=Distance.COSINE,
+                multivector_config=MultiVectorConfig(comparator=MultiVectorComparator.MAX_SIM),
+            ),
+        )
+
+
+def upsert_regions(client, collection_name, point_ids, regions):
+    client.upsert(
+        region_collection(collection_name),
+        points=[
+            PointStruct(id=point_id, vector=np.asarray(vectors, dtype=np.float32).tolist())
+            for point_id, vectors in zip(point_ids, regions)
+        ],
+        wait=True,
+    )
+
+
+class QdrantRegions:
+    """
+    Region vectors from the companion collection, fetched per shortlist.
+    """
+
+    def __init__(self, client, collection_name=COLLECTION_NAME):
+        self.client = client
+        self.name = region_collection(collection_name)
+
+    def fetch(self, point_ids):
+        records = self.client.retrieve(self.name, ids=list(point_ids), with_payload=False, with_vectors=True)
+        return {record.id: np.asarray(record.vector, dtype=np.float32) for record in records}
+
+
+class StoreRegions:
+    """
+    Region vectors for the local engine: a (count, regions, dim) float16
+    array next to a vector store, row-aligned with it and memory-mapped.
+    """
+
+    def __init__(self, store_path, index):
+        self.regions = np.load(os.path.join(store_path, REGIONS_FILE), mmap_mode="r")
+        self.index = index
+
+    def fetch(self, point_ids):
+        row_of = self.index.row_of
+        return {
+            point_id: np.asarray(self.regions[row_of[point_id]], dtype=np.float32)
+            for point_id in point_ids if point_id in row_of
+        }
+
+
+def open_regions(client, collection_name=COLLECTION_NAME, store_path=None, index=None):
+    """
+    StoreRegions when `store_path` has a regions file, else QdrantRegions.
+    """
+    if store_path and index is not None and os.path.exists(os.path.join(store_path, REGIONS_FILE)):
+        return StoreRegions(store_path, index)
+    return QdrantRegions(client, collection_name)
+
+
+def export_regions(client, store_path, collection_name=COLLECTION_NAME, page_size=256):
+    """
+    Writes the companion collection's vectors to `store_path` in the row
+    order of the vector store there. Rows without region vectors repeat
+    the painting's global vector, which keeps their MaxSim score equal to
+    the global cosine.
+    """
+    from vector_index import LocalIndex
+    from vector_store import open_store
+
+    index = LocalIndex.from_store(open_store(store_path), collection_name)
+    source = QdrantRegions(client, collection_name)
+    regions = None
+    for start in range(0, len(index), page_size):
+        point_ids = [index.point_id(row) for row in range(start, min(start + page_size, len(index)))]
+        fetched = source.fetch(point_ids)
+        for row, point_id in enumerate(point_ids, start):
+            vectors = fetched.get(point_id)
+            if regions is None and vectors is not None:
+                regions = np.lib.format.open_memmap(
+                    os.path.join(store_path, REGIONS_FILE + ".tmp"), mode="w+", dtype=np.float16,
+                    shape=(len(index), vectors.shape[0], vectors.shape[1]),
+                )
+                regions[:row] = np.asarray(index.vectors[:row], dtype=np.float16)[:, None, :]
+            if regions is not None:
+                regions[row] = vectors if vectors is not None else index.vectors[row]
+    if regions is None:
+        raise ValueError(f"{region_collection(collection_name)} holds no region vectors")
+    regions.flush()
+    del regions
+    os.replace(os.path.join(store_path, REGIONS_FILE + ".tmp"), os.path.join(store_path, REGIONS_FILE))
+
+
+# Re-ranking -------------------------------------------------------------
+
+def rerank(client, collection_name, regions, query_vector, query_regions, limit=10, oversample=4,
+           query_filter=None, search_params=None):
+    """
+    Shortlists `limit * oversample` points on the global vector, then
+    orders them by MaxSim between `query_regions` and their region vectors.
+    Candidates without region vectors keep their global score. Returns
+    re-scored copies; the client's results (which it may cache) are left as
+    they are.
+    """
+    candidates = client.search(
+        collection_name=collection_name,
+        query_vector=query_vector,
+        limit=limit * oversample,
+        query_filter=query_filter,
+        search_params=search_params,
+    )
+    if not candidates:
+        return []
+    fetched = regions.fetch([candidate.id for candidate in candidates])
+    scored = [candidate for candidate in candidates if candidate.id in fetched]
+    rescored = {}
+    if scored:
+        scores = maxsim(np.asarray(query_regions, dtype=np.float32),
+                        np.stack([fetched[candidate.id] for candidate in scored]))
+        rescored = {
+            candidate.id: candidate.model_copy(update={"score": float(score)})
+            for candidate, score in zip(scored, scores)
+        }
+    results = [rescored.get(candidate.id, candidate) for candidate in candidates]
+    return sorted(results, key=lambda candidate: -candidate.score)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy region vectors from Qdrant next to a local vector store.")
+    parser.add_argument("store")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    args = parser.parse_args()
+
+    from resilient_client import create_client
+
+    export_regions(create_client(), args.store, args.collection)
+    print(f"Wrote {os.path.join(args.store, REGIONS_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
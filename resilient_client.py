@@ -0,0 +1,251 @@
+"""
+Qdrant client construction and a fault-tolerant wrapper for the app.
+
+`create_client()` applies the transport settings from config.py: gRPC
+(`QDRANT_PREFER_GRPC`), request timeout and HTTP connection pool size.
+
+`ResilientClient` wraps a client with the same API. Read calls
+(`READ_METHODS`) are
+
+  - retried on transient errors (timeouts, connection errors, 429/5xx)
+    with jittered exponential backoff;
+  - hedged: if the first attempt has not answered after `hedge_after`
+    seconds a second one is sent, and the first answer wins;
+  - guarded by a circuit breaker. After `failure_threshold` consecutive
+    failed calls the breaker opens, and for `cooldown` seconds reads go
+    straight to the fallback: a local replica (e.g. a LocalIndex over a
+    vector store), else the last good answer to the same call. After
+    the cooldown one trial call goes to Qdrant again.
+
+Writes pass straight through. Attempts, retries, hedges and fallbacks
+are counted in metrics.py; the app registers `client.breaker.stats` as
+its "circuit" collector.
+
+    client = ResilientClient(create_client(), fallback=LocalIndex.from_store(open_store("stores/paintings")))
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+import metrics
+from config import QDRANT_API, QDRANT_URL, QDRANT_PREFER_GRPC, QDRANT_TIMEOUT_S, QDRANT_POOL_SIZE
+from query_cache import vector_key
+
+READ_METHODS = {
+    "search", "search_batch", "recommend", "query_points", "scroll", "retrieve", "count", "facet",
+    "get_collection", "get_collections", "collection_exists", "get_aliases",
+}
+
+# Reads whose last answer is kept for the open-circuit fallback (not
+# scroll: id pages are large and paging is resumed from the ids anyway)
+STALE_METHODS = {"search", "search_batch", "recommend", "query_points", "retrieve", "count", "facet", "get_aliases"}
+
+# HTTP statuses worth retrying; anything else (400, 404, ...) is the caller's problem
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def create_client(url=QDRANT_URL, api_key=QDRANT_API, prefer_grpc=QDRANT_PREFER_GRPC,
+                  timeout=QDRANT_TIMEOUT_S, pool_size=QDRANT_POOL_SIZE):
+    import httpx
+
+    return QdrantClient(
+        url=url,
+        api_key=api_key,
+        prefer_grpc=prefer_grpc,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        grpc_options={"grpc.keepalive_time_ms": 30_000, "grpc.keepalive_permit_without_calls": 1},
+    )
+
+
+def is_transient(error):
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in TRANSIENT_STATUS
+    if isinstance(error, (ResponseHandlingException, TimeoutError, ConnectionError)):
+        return True
+    # httpx transport errors and grpc.RpcError, without importing either
+    if type(error).__module__.startswith("httpx"):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        return getattr(code(), "name", "") in {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED"}
+    return False
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; open ->
+    half-open after `cooldown` seconds, where one trial call decides
+    between closed and open again.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self.opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        # In half-open state only one caller gets through as the trial
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial:
+                    self.opened += 1
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self):
+        with self._lock:
+            state = self._state()
+            return {
+                "open": int(state != "closed"),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+            }
+
+
+def _frozen(value):
+    # Hashable stand-in for call arguments; vectors are quantized like query cache keys
+    if isinstance(value, np.ndarray) or (isinstance(value, list) and value and isinstance(value[0], float)):
+        return vector_key(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _frozen(item)) for key, item in value.items()))
+    return repr(value)
+
+
+class ResilientClient:
+    def __init__(self, client, fallback=None, retries=2, backoff=0.1, hedge_after=None,
+                 breaker=None, stale_items=1024, workers=8):
+        self._client = client
+        self._fallback = fallback
+        self._retries = retries
+        self._backoff = backoff
+        self._hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self._stale = OrderedDict()
+        self._stale_items = stale_items
+        self._stale_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qdrant") if hedge_after else None
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in READ_METHODS or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._read(name, attribute, args, kwargs)
+        call.__name__ = name
+        return call
+
+    # Reads ------------------------------------------------------------
+
+    def _read(self, name, method, args, kwargs):
+        key = None
+        if self._stale_items and name in STALE_METHODS:
+            key = (name, _frozen(args), _frozen(kwargs))
+        if not self.breaker.allow():
+            return self._fall_back(name, key, args, kwargs, None)
+        try:
+            result = self._with_retries(name, method, args, kwargs)
+        except Exception as error:
+            if not is_transient(error):
+                # The cluster answered; it is the request that is wrong
+                self.breaker.record_success()
+                raise
+            self.breaker.record_failure()
+            return self._fall_back(name, key, args, kwargs, error)
+        self.breaker.record_success()
+        if key is not None:
+            with self._stale_lock:
+                self._stale[key] = result
+                self._stale.move_to_end(key)
+                while len(self._stale) > self._stale_items:
+                    self._stale.popitem(last=False)
+        return result
+
+    def _with_retries(self, name, method, args, kwargs):
+        for attempt in range(self._retries + 1):
+            try:
+                result = self._attempt(name, method, args, kwargs)
+                metrics.inc("client_attempts_total", method=name, outcome="ok")
+                return result
+            except Exception as error:
+                metrics.inc("client_attempts_total", method=name, outcome="error")
+                if attempt == self._retries or not is_transient(error):
+                    raise
+                metrics.inc("client_retries_total", method=name)
+                # Full jitter: spread retries of concurrent sessions apart
+                time.sleep(random.uniform(0, self._backoff * 2 ** attempt))
+
+    def _attempt(self, name, method, args, kwargs):
+        if self._pool is None:
+            return method(*args, **kwargs)
+        first = self._pool.submit(method, *args, **kwargs)
+        done, _ = wait([first], timeout=self._hedge_after)
+        if done:
+            return first.result()
+        metrics.inc("client_hedges_total", method=name)
+        second = self._pool.submit(method, *args, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        metrics.inc("client_hedge_wins_total", method=name)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _fall_back(self, name, key, args, kwargs, error):
+        if self._fallback is not None and hasattr(self._fallback, name):
+            metrics.inc("client_fallbacks_total", method=name, source="replica")
+            return getattr(self._fallback, name)(*args, **kwargs)
+        if key is not None:
+            with self._stale_lock:
+                if key in self._stale:
+                    metrics.inc("client_fallbacks_total", method=name, source="stale")
+                    return self._stale[key]
+        metrics.inc("client_fallbacks_total", method=name, source="none")
+        raise error or ConnectionError(f"Qdrant circuit is open; no fallback for {name}")
@@ -0,0 +1,130 @@
+"""
+Random sampling and cursor pagination over the whole collection.
+
+`IdSampler` keeps the collection's point ids in memory. It fetches them
+once with an id-only scroll (no payloads, no vectors) and fetches them
+again when the exact point count or the collection's version counter
+(bumped by ingest, sync and compact, see query_cache.py) changes. A uniform sample of any size is
+then a `rng.choice` over the ids plus one `retrieve` call for the
+sampled points.
+
+`page()` walks the collection with `scroll` cursors, starting from any
+point and wrapping around once, so "Show more" can continue from a
+random position and still reach every painting.
+
+Both only request the payload fields the grid displays.
+"""
+import threading
+import time
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from query_cache import read_local_version
+
+DISPLAY_FIELDS = ["image_url", "author"]
+
+
+class Cursor(NamedTuple):
+    start: Any                  # point id the walk started from (None: the first point)
+    offset: Any                 # scroll offset of the next page
+    wrapped: bool = False       # already restarted from the first point
+    done: bool = False
+
+
+class IdSampler:
+    def __init__(self, client, collection_name, refresh_interval=60, page_size=10_000):
+        self.client = client
+        self.collection_name = collection_name
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+
+        self._ids = []
+        self._state = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _load_ids(self):
+        ids = []
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                with_payload=False,
+                with_vectors=False,
+                limit=self.page_size,
+                offset=offset,
+            )
+            ids.extend(record.id for record in records)
+            if offset is None:
+                return ids
+
+    def ids(self):
+        """
+        The cached id list, reloaded when the point count or the version
+        counter has changed (a sync that replaces points keeps the count).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked >= self.refresh_interval:
+                self._checked = now
+                state = (
+                    self.client.count(self.collection_name, exact=True).count,
+                    read_local_version(self.collection_name),
+                )
+                if state != self._state:
+                    self._ids = self._load_ids()
+                    self._state = state
+            return self._ids
+
+    def sample(self, size, rng=None):
+        """
+        Up to `size` points drawn uniformly without replacement, with only
+        the display payload fields.
+        """
+        ids = self.ids()
+        if not ids:
+            return []
+        rng = rng or np.random.default_rng()
+        chosen = rng.choice(len(ids), size=min(size, len(ids)), replace=False)
+        records = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[ids[i] for i in chosen],
+            with_payload=DISPLAY_FIELDS,
+            with_vectors=False,
+        )
+        # retrieve() does not promise to keep the requested order
+        rng.shuffle(records)
+        return records
+
+    def random_cursor(self, rng=None):
+        ids = self.ids()
+        rng = rng or np.random.default_rng()
+        start = ids[rng.integers(len(ids))] if ids else None
+        return Cursor(start=start, offset=start)
+
+    def page(self, cursor, limit=30):
+        """
+        Returns (records, next cursor). The walk runs from `cursor.start`
+        to the end of the collection, then from its first point back up
+        to `start`; `next cursor.done` is set once it has covered everything.
+        """
+        if cursor.done:
+            return [], cursor
+        records, offset = self.client.scroll(
+            collection_name=self.collection_name,
+            with_payload=DISPLAY_FIELDS,
+            with_vectors=False,
+            limit=limit,
+            offset=cursor.offset,
+        )
+        if cursor.wrapped:
+            ids = [record.id for record in records]
+            if cursor.start in ids:
+                records = records[:ids.index(cursor.start)]
+                return records, cursor._replace(offset=None, done=True)
+        if offset is None or (cursor.wrapped and offset == cursor.start):
+            if cursor.wrapped or cursor.start is None:
+                return records, cursor._replace(offset=None, done=True)
+            return records, cursor._replace(offset=None, wrapped=True)
+        return records, cursor._replace(offset=offset)
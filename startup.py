@@ -0,0 +1,102 @@
+"""
+Lazy model loading and startup timing for the Streamlit app.
+
+torch, transformers and the DINOv2 weights are only needed for uploads,
+so they are imported and loaded on the first call to `get_engine()` (or
+ahead of time in a background thread with `prewarm()`), never at import.
+
+`get_batcher()` puts a micro-batching queue (batching.py) in front of the
+engine so concurrent uploads share forward passes.
+
+`record()` keeps the first measurement of each startup phase for the
+process; `report()` returns them in the order they happened.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_timings = OrderedDict()
+_timings_lock = threading.Lock()
+
+_engine = None
+_engine_lock = threading.Lock()
+_prewarm_thread = None
+_batcher = None
+
+
+def record(phase, seconds):
+    with _timings_lock:
+        _timings.setdefault(phase, seconds)
+
+
+class timed:
+    """
+    Context manager that records how long a startup phase took.
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.phase, time.perf_counter() - self.started)
+
+
+def report():
+    with _timings_lock:
+        return list(_timings.items())
+
+
+def get_engine(**options):
+    """
+    Returns the process-wide EmbeddingEngine, building it on first use.
+    Concurrent callers wait for the same load instead of starting their own.
+    """
+    global _engine
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            with timed("import torch/transformers"):
+                from embeddings import EmbeddingEngine
+            with timed("model load"):
+                _engine = EmbeddingEngine(**options)
+    return _engine
+
+
+def get_batcher(max_batch_size=16, max_wait_ms=10, max_queue=64, **engine_options):
+    """
+    Returns the process-wide MicroBatcher in front of the engine, so
+    concurrent sessions share forward passes.
+    """
+    global _batcher
+    if _batcher is None:
+        engine = get_engine(**engine_options)
+        with _engine_lock:
+            if _batcher is None:
+                from batching import MicroBatcher
+                _batcher = MicroBatcher(
+                    engine.embed, max_batch_size=max_batch_size,
+                    max_wait_ms=max_wait_ms, max_queue=max_queue,
+                )
+    return _batcher
+
+
+def engine_ready():
+    return _engine is not None
+
+
+def prewarm(**options):
+    """
+    Starts loading the engine in a daemon thread (once per process).
+    """
+    global _prewarm_thread
+    with _engine_lock:
+        if _prewarm_thread is None and _engine is None:
+            _prewarm_thread = threading.Thread(
+                target=get_engine, kwargs=options, name="model-prewarm", daemon=True
+            )
+            _prewarm_thread.start()
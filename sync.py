@@ -0,0 +1,450 @@
+"""
+Incremental sync of an image directory into the collection.
+
+    python sync.py images                 # apply the changes since the last sync
+    python sync.py images --watch         # then keep applying them as files change
+
+A manifest (SQLite, `<directory>/.sync_manifest.sqlite`) records path,
+mtime, size, SHA-256 and point id of every synced file. A sync lists the
+directory, and only files whose mtime or size differ from the manifest
+are read and hashed. Of those, only files whose hash changed are
+embedded; points of removed files are deleted. With 1M unchanged files a
+sync costs one directory listing and a manifest load. Every
+acknowledged upsert chunk is recorded in the manifest right away, so an
+interrupted sync resumes where it stopped.
+
+For a collection that was filled by ingest.py before the first sync,
+`--adopt` records files whose point already exists instead of
+re-embedding them.
+
+`--watch` uses the optional `watchdog` package to collect changed paths
+and applies them every `--interval` seconds. Without it, the directory
+is re-listed every interval instead.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from qdrant_client.models import PointIdsList
+
+from config import (
+    COLLECTION_NAME, MODEL_NAME, EMBEDDING_CACHE_DIR, KNN_GRAPH_PATH, REGION_SEARCH, REGION_GRID,
+)
+from resilient_client import create_client
+from embedding_cache import EmbeddingCache
+from embeddings import load_model
+from ingest import (
+    IMAGE_EXTENSIONS, ensure_collection, extract_author, iter_decoded, iter_batches, embed_batch, to_point,
+)
+from knn_graph import update_graph
+from point_ids import path_point_id, digest_point_id
+from query_cache import bump_collection_version
+from regions import ensure_region_collection, region_collection, upsert_regions
+from projection import projected_collection, tier_projection, upsert_projected
+from vector_index import LocalIndex
+
+MANIFEST_NAME = ".sync_manifest.sqlite"
+
+
+class Entry(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: str
+    point_id: str
+
+
+class Manifest:
+    """
+    path -> Entry table of the synced files.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT, point_id TEXT)"
+        )
+
+    def load(self):
+        rows = self.connection.execute("SELECT path, mtime_ns, size, digest, point_id FROM files")
+        return {path: Entry(*values) for path, *values in rows}
+
+    def put(self, entries):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [(path, *entry) for path, entry in entries.items()],
+            )
+
+    def remove(self, paths):
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    def close(self):
+        self.connection.close()
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+# Same paths as ingest.list_image_paths, so payload image_urls and path ids match
+def scan_directory(base_directory):
+    """
+    {path: (mtime_ns, size)} of the images in `base_directory`.
+    """
+    stats = {}
+    with os.scandir(base_directory) as entries:
+        for entry in entries:
+            if is_image(entry.name) and entry.is_file():
+                stat = entry.stat()
+                stats[f"{base_directory}/{entry.name}"] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def stat_paths(paths):
+    """
+    {path: (mtime_ns, size)} of those `paths` that still exist.
+    """
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def file_digest(path, chunk_size=1 << 20):
+    # SHA-256 hex digest of the file, None if it is gone
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def existing_point_ids(client, collection_name, point_ids, chunk=1000):
+    found = set()
+    point_ids = list(point_ids)
+    for start in range(0, len(point_ids), chunk):
+        records = client.retrieve(
+            collection_name, ids=point_ids[start:start + chunk], with_payload=False, with_vectors=False
+        )
+        found.update(str(record.id) for record in records)
+    return found
+
+
+class Syncer:
+    """
+    Applies directory changes to a collection. `entries` (the manifest as a
+    dict) stays in memory between passes, so watching costs no reloads.
+    """
+
+    def __init__(self, base_directory, client, processor, model, collection_name=COLLECTION_NAME,
+                 manifest_path=None, batch_size=16, workers=4, upsert_chunk=256, cache=None,
+                 id_from="path", regions=False, region_grid=REGION_GRID):
+        self.base_directory = base_directory
+        self.client = client
+        self.processor = processor
+        self.model = model
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.workers = workers
+        self.upsert_chunk = upsert_chunk
+        self.cache = cache
+        self.id_from = id_from
+        self.regions = regions
+        self.region_grid = region_grid
+
+        self.manifest = Manifest(manifest_path or os.path.join(base_directory, MANIFEST_NAME))
+        self.entries = self.manifest.load()
+        ensure_collection(client, collection_name, model.config.hidden_size)
+        if regions:
+            ensure_region_collection(client, collection_name, model.config.hidden_size)
+        # Keeps an existing PCA tier (see projection.py) in step
+        self.projection = tier_projection(client, collection_name)
+
+    def point_id(self, path, digest):
+        return digest_point_id(digest) if self.id_from == "content" else path_point_id(path)
+
+    def sync(self, adopt=False):
+        """
+        Full pass: lists the directory and applies every difference.
+        """
+        return self.apply(scan_directory(self.base_directory), set(self.entries), adopt=adopt)
+
+    def sync_paths(self, paths):
+        """
+        Partial pass over `paths` only (e.g. from filesystem events).
+        """
+        paths = {path for path in paths if is_image(path)}
+        return self.apply(stat_paths(paths), paths & set(self.entries))
+
+    def apply(self, stats, known_paths, adopt=False):
+        """
+        `stats` holds the current {path: (mtime_ns, size)} of the files to
+        consider; `known_paths` are manifest paths in the same scope, of
+        which those missing from `stats` were removed.
+        """
+        started = time.perf_counter()
+        changed = [path for path, stat in stats.items()
+                   if path not in self.entries or self.entries[path][:2] != stat]
+
+        # Hash only files whose mtime or size moved; a touched but identical
+        # file just gets its new stat recorded
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            digests = dict(zip(changed, pool.map(file_digest, changed)))
+        for path in [path for path, digest in digests.items() if digest is None]:
+            # Deleted since it was listed
+            del stats[path], digests[path]
+        changed = [path for path in changed if path in digests]
+        removed = [path for path in known_paths if path not in stats]
+        touched, to_embed = {}, []
+        for path in changed:
+            entry = self.entries.get(path)
+            if entry is not None and entry.digest == digests[path]:
+                touched[path] = Entry(*stats[path], entry.digest, entry.point_id)
+            else:
+                to_embed.append(path)
+
+        if adopt and to_embed:
+            ids = {path: self.point_id(path, digests[path]) for path in to_embed}
+            existing = existing_point_ids(self.client, self.collection_name, set(ids.values()))
+            for path in [path for path in to_embed if ids[path] in existing]:
+                touched[path] = Entry(*stats[path], digests[path], ids[path])
+            to_embed = [path for path in to_embed if ids[path] not in existing]
+        if touched:
+            self.manifest.put(touched)
+            self.entries.update(touched)
+
+        written, stored = self._embed(to_embed, stats, digests)
+
+        # Point ids that were replaced (content ids of modified files) or whose
+        # file is gone, unless another file still maps to the same point
+        stale = {self.entries[path].point_id: path for path in removed}
+        for path in removed:
+            del self.entries[path]
+        stale.update(stored)
+        deleted, renamed = [], []
+        if stale:
+            remaining = {entry.point_id: path for path, entry in self.entries.items()}
+            deleted = [point_id for point_id in stale if point_id not in remaining]
+            renamed = list(stale.keys() & remaining.keys())
+            self._delete(deleted)
+            # A point shared by identical files may still name a removed file
+            for point_id in renamed:
+                path = remaining[point_id]
+                payload = {"image_url": path, "author": extract_author(path)}
+                self.client.set_payload(self.collection_name, payload=payload, points=[point_id], wait=True)
+                if self.projection is not None:
+                    self.client.set_payload(
+                        projected_collection(self.collection_name), payload=payload, points=[point_id], wait=True,
+                    )
+        self.manifest.remove(removed)
+
+        summary = {
+            "embedded": len(to_embed),
+            "removed": len(removed),
+            "touched": len(touched),
+            "unchanged": len(stats) - len(changed),
+            "seconds": time.perf_counter() - started,
+            # Point ids whose vector or payload was written, and deleted ones
+            "upserted": sorted(set(written) | set(renamed)),
+            "deleted": deleted,
+        }
+        if to_embed or removed:
+            bump_collection_version(self.collection_name)
+        return summary
+
+    def _embed(self, paths, stats, digests):
+        """
+        Embeds and upserts `paths` in chunks, recording each acknowledged
+        chunk in the manifest. Returns the point ids written and
+        {previous point id: path} for files whose point id changed.
+        """
+        written, replaced = [], {}
+        buffer, region_buffer = [], []
+
+        def flush():
+            if not buffer:
+                return
+            if region_buffer:
+                upsert_regions(self.client, self.collection_name, [point.id for point in buffer], region_buffer)
+            if self.projection is not None:
+                upsert_projected(self.client, self.collection_name, self.projection, buffer)
+            self.client.upsert(self.collection_name, points=buffer, wait=True)
+            written.extend(point.id for point in buffer)
+            entries = {
+                point.payload["image_url"]: Entry(
+                    *stats[point.payload["image_url"]], digests[point.payload["image_url"]], point.id
+                )
+                for point in buffer
+            }
+            for path, entry in entries.items():
+                previous = self.entries.get(path)
+                if previous is not None and previous.point_id != entry.point_id:
+                    replaced[previous.point_id] = path
+            self.manifest.put(entries)
+            self.entries.update(entries)
+            buffer.clear()
+            region_buffer.clear()
+
+        decoded = iter_decoded(
+            sorted(paths), self.workers, prefetch=self.batch_size * 2,
+            cache=None if self.regions else self.cache, id_from=self.id_from,
+        )
+        for batch in iter_batches(decoded, self.batch_size):
+            vectors, region_vectors = embed_batch(
+                self.processor, self.model, batch, self.cache, self.regions, self.region_grid
+            )
+            if region_vectors is not None:
+                region_buffer.extend(region_vectors)
+            buffer.extend(to_point(item, vector) for item, vector in zip(batch, vectors))
+            if len(buffer) >= self.upsert_chunk:
+                flush()
+        flush()
+        return written, replaced
+
+    def _delete(self, point_ids):
+        if not point_ids:
+            return
+        selector = PointIdsList(points=point_ids)
+        self.client.delete(self.collection_name, points_selector=selector, wait=True)
+        for companion in (region_collection(self.collection_name), projected_collection(self.collection_name)):
+            if self.client.collection_exists(companion):
+                self.client.delete(companion, points_selector=selector, wait=True)
+
+
+# Watching -------------------------------------------------------------
+
+def watch(syncer, interval=5.0, on_change=None):
+    """
+    Applies changes every `interval` seconds until interrupted: the paths
+    reported by watchdog when it is installed, otherwise a full re-listing.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        print("watchdog is not installed (`pip install watchdog`); re-listing the directory instead")
+        while True:
+            time.sleep(interval)
+            report(syncer.sync(), on_change)
+
+    dirty = set()
+    lock = threading.Lock()
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            # Moves report both ends; the source then counts as a removal
+            with lock:
+                for path in (event.src_path, getattr(event, "dest_path", None)):
+                    if path:
+                        dirty.add(f"{syncer.base_directory}/{os.path.basename(path)}")
+
+    observer = Observer()
+    observer.schedule(Handler(), syncer.base_directory, recursive=False)
+    observer.start()
+    try:
+        while True:
+            time.sleep(interval)
+            with lock:
+                paths = set(dirty)
+                dirty.clear()
+            if paths:
+                report(syncer.sync_paths(paths), on_change)
+    finally:
+        observer.stop()
+        observer.join()
+
+
+def report(summary, on_change=None):
+    if summary["embedded"] or summary["removed"]:
+        print(f"Embedded {summary['embedded']}, removed {summary['removed']}, "
+              f"unchanged {summary['unchanged']} ({summary['seconds']:.2f}s)")
+        if on_change is not None:
+            on_change(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync a directory of paintings into Qdrant incrementally.")
+    parser.add_argument("directory", nargs="?", default="images")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--manifest", default=None, help=f"Default: <directory>/{MANIFEST_NAME}")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--upsert-chunk", type=int, default=256)
+    parser.add_argument("--cache-dir", default=EMBEDDING_CACHE_DIR,
+                        help="Embedding cache directory; pass an empty string to disable")
+    parser.add_argument("--id-from", choices=["path", "content"], default="path",
+                        help="Must match how the collection was ingested")
+    parser.add_argument("--regions", action=argparse.BooleanOptionalAction, default=REGION_SEARCH,
+                        help="Also store CLS + patch region vectors (see regions.py)")
+    parser.add_argument("--adopt", action="store_true",
+                        help="Record files whose point already exists instead of re-embedding them")
+    parser.add_argument("--watch", action="store_true", help="Keep running and apply changes as they happen")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between batches when watching")
+    parser.add_argument("--knn-graph", default=KNN_GRAPH_PATH,
+                        help="Update this neighbour graph after every change (see knn_graph.py)")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(cache_dir=args.cache_dir, model_name=args.model) if args.cache_dir else None
+    processor, model = load_model(args.model)
+    client = create_client()
+    syncer = Syncer(
+        args.directory, client, processor, model,
+        collection_name=args.collection,
+        manifest_path=args.manifest,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        upsert_chunk=args.upsert_chunk,
+        cache=cache,
+        id_from=args.id_from,
+        regions=args.regions,
+    )
+
+    index = None
+
+    def on_change(summary):
+        # The collection is copied once; later batches only apply their changes to the copy
+        nonlocal index
+        if not args.knn_graph:
+            return
+        if index is None:
+            index = LocalIndex.from_qdrant(client, args.collection)
+        else:
+            index.delete(summary["deleted"])
+            index.upsert(client.retrieve(
+                args.collection, ids=summary["upserted"], with_payload=True, with_vectors=True
+            ))
+        update_graph(args.knn_graph, index, changed_ids=summary["upserted"])
+
+    summary = syncer.sync(adopt=args.adopt)
+    print(f"Embedded {summary['embedded']}, removed {summary['removed']}, touched {summary['touched']}, "
+          f"unchanged {summary['unchanged']} ({summary['seconds']:.2f}s)")
+    if summary["embedded"] or summary["removed"]:
+        on_change(summary)
+    if args.watch:
+        print(f"Watching {args.directory} (Ctrl+C to stop)")
+        try:
+            watch(syncer, args.interval, on_change)
+        except KeyboardInterrupt:
+            pass
+    syncer.manifest.close()
+
+
+if __name__ == "__main__":
+    main()
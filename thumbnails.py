@@ -0,0 +1,268 @@
+"""
+Thumbnail fetching and caching for the result grids.
+
+Sources (http(s) URLs or local paths) are fetched through one pooled HTTP
+session with timeouts, resized once per (source, target_size) and kept in
+a bounded in-memory LRU backed by a bounded directory of JPEG files.
+
+    python thumbnails.py --prewarm     # fill the cache for the whole collection
+"""
+import argparse
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+import metrics
+from config import COLLECTION_NAME, THUMBNAIL_CACHE_DIR
+from resilient_client import create_client
+from preprocess import check_size, draft
+
+# Every size the app renders; pre-warming fills all of them
+GRID_SIZES = [(180, 180), (140, 140), (256, 256), (100, 100)]
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir=".thumbnail_cache", max_memory_items=512,
+                 max_disk_items=50_000, workers=8, prewarm_workers=2, timeout=(3.05, 10)):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.timeout = timeout
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.errors = 0
+
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        # Pre-warming has its own few threads so it never queues ahead of a page's grid
+        self._prewarm_pool = ThreadPoolExecutor(max_workers=prewarm_workers, thread_name_prefix="thumbnail-prewarm")
+
+        self.session = requests.Session()
+        connections = workers + prewarm_workers
+        adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections, max_retries=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            entries = [
+                (entry.stat().st_mtime, entry.name[:-4])
+                for entry in os.scandir(cache_dir)
+                if entry.name.endswith(".jpg")
+            ]
+            for _, key in sorted(entries):
+                self._disk[key] = None
+
+    def _key(self, source, target_size):
+        return hashlib.sha1(f"{source}|{target_size[0]}x{target_size[1]}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def _read_source(self, source):
+        parsed = urlparse(source)
+        if parsed.scheme in ('http', 'https'):
+            response = self.session.get(source, timeout=self.timeout)
+            response.raise_for_status()
+            return Image.open(BytesIO(response.content))
+        if not os.path.isabs(source):
+            source = os.path.abspath(source)
+        return Image.open(source)
+
+    def _remember(self, key, image):
+        self._memory[key] = image
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    @metrics.span("load_image")
+    def get(self, source, target_size=(180, 180)):
+        """
+        Returns (image, error): the RGB thumbnail of `source` at
+        `target_size` and None, or None and the error message.
+        """
+        target_size = tuple(target_size)
+        key = self._key(source, target_size)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return self._memory[key], None
+            on_disk = self.cache_dir and key in self._disk
+
+        if on_disk:
+            try:
+                with Image.open(self._path(key)) as img:
+                    image = img.convert('RGB')
+                with self._lock:
+                    self.hits_disk += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._remember(key, image)
+                return image, None
+            except OSError:
+                with self._lock:
+                    self._disk.pop(key, None)
+
+        try:
+            with self._read_source(source) as img:
+                check_size(img)
+                draft(img, target_size)
+                image = img.convert('RGB').resize(target_size, Image.Resampling.LANCZOS)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            metrics.inc("errors_total", where="load_image")
+            return None, str(e)
+
+        with self._lock:
+            self.misses += 1
+            self._remember(key, image)
+        if self.cache_dir:
+            self._store(key, image)
+        return image, None
+
+    def _store(self, key, image):
+        tmp_path = self._path(key) + f".{threading.get_ident()}.tmp"
+        image.save(tmp_path, format="JPEG", quality=90)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._disk[key] = None
+            self._disk.move_to_end(key)
+            evicted = []
+            while len(self._disk) > self.max_disk_items:
+                evicted.append(self._disk.popitem(last=False)[0])
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def get_many(self, items):
+        """
+        Loads [(source, target_size), ...] concurrently and returns their
+        (image, error) pairs in the same order.
+        """
+        return list(self._pool.map(lambda item: self.get(*item), items))
+
+    def iter_completed(self, items):
+        """
+        Loads [(source, target_size), ...] concurrently and yields
+        (position, image, error) as each one finishes.
+        """
+        futures = {self._pool.submit(self.get, *item): position for position, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
+
+    def _warm(self, source, sizes):
+        # Fetch the source once and derive every missing size from it
+        with self._lock:
+            missing = [
+                tuple(size) for size in sizes
+                if self._key(source, size) not in self._disk
+            ]
+        if not missing:
+            return True
+        try:
+            with self._read_source(source) as img:
+                check_size(img)
+                draft(img, max(missing, key=max))
+                original = img.convert('RGB')
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return False
+        for size in missing:
+            image = original.resize(size, Image.Resampling.LANCZOS)
+            if self.cache_dir:
+                self._store(self._key(source, size), image)
+            else:
+                with self._lock:
+                    self._remember(self._key(source, size), image)
+        return True
+
+    def prewarm(self, sources, sizes=GRID_SIZES):
+        """
+        Fills the cache for every (source, size) pair on the pre-warm
+        threads. Returns the number of sources that are now cached.
+        """
+        return sum(self._prewarm_pool.map(lambda source: self._warm(source, sizes), sources))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "errors": self.errors,
+                "memory_items": len(self._memory),
+                "disk_items": len(self._disk),
+            }
+
+
+# Yield every image_url in the collection, one scroll page at a time
+def iter_collection_sources(client, collection_name=COLLECTION_NAME, page_size=256):
+    offset = None
+    seen = set()
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            with_payload=["image_url"],
+            with_vectors=False,
+            limit=page_size,
+            offset=offset,
+        )
+        for record in records:
+            image_url = record.payload.get("image_url", "")
+            if image_url and image_url not in seen:
+                seen.add(image_url)
+                yield image_url
+        if offset is None:
+            break
+
+
+def prewarm_collection(cache, client, collection_name=COLLECTION_NAME, sizes=GRID_SIZES, chunk=256):
+    loaded = total = 0
+    sources = []
+    for source in iter_collection_sources(client, collection_name):
+        sources.append(source)
+        if len(sources) == chunk:
+            loaded += cache.prewarm(sources, sizes)
+            total += len(sources)
+            sources = []
+    if sources:
+        loaded += cache.prewarm(sources, sizes)
+        total += len(sources)
+    return loaded, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the thumbnail cache.")
+    parser.add_argument("--prewarm", action="store_true", help="Fetch thumbnails for the whole collection")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--cache-dir", default=THUMBNAIL_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    cache = ThumbnailCache(cache_dir=args.cache_dir, workers=args.workers, prewarm_workers=args.workers)
+    if args.prewarm:
+        client = create_client()
+        loaded, total = prewarm_collection(cache, client, args.collection)
+        print(f"Pre-warmed thumbnails for {loaded}/{total} images")
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
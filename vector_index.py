@@ -0,0 +1,434 @@
+"""
+In-process vector index, usable in place of the Qdrant client.
+
+All vectors live in one contiguous float32 matrix with unit-norm rows, so
+cosine similarity is a single matrix-vector product and top-k is an
+`argpartition` over the scores. For larger collections an optional IVF
+mode clusters the rows with k-means and only scans the `nprobe` closest
+lists.
+
+`query_filter` (keyword match conditions, see filters.py) is resolved
+through an inverted index per payload field into the set of allowed
+rows before scoring. Selective filters scan exactly those rows instead
+of post-filtering a larger result.
+
+`LocalIndex` implements the subset of the QdrantClient API the app uses
+(`search`, `search_batch`, `recommend`, `scroll`, `retrieve`, `count`, `facet`) and returns the same
+`ScoredPoint` / `Record` models, so callers do not need to know which
+backend they are talking to.
+"""
+import numpy as np
+from qdrant_client.models import (
+    ScoredPoint, Record, CountResult, FacetResponse, FacetValueHit, FieldCondition, MatchAny, MatchValue,
+)
+
+from config import COLLECTION_NAME
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """
+    Indices of the k largest scores, best first.
+    """
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def kmeans(vectors, n_clusters, iterations=10, sample_size=100_000, seed=0):
+    """
+    Spherical k-means on a sample of the rows; returns unit-norm centroids.
+    """
+    rng = np.random.default_rng(seed)
+    if vectors.shape[0] > sample_size:
+        vectors = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+def dot(matrix, query, block_rows=65536):
+    """
+    matrix @ query in float32. Non-float32 matrices (float16 stores) are
+    upcast one block at a time so a scan never materialises a full copy.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    scores = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        scores[start:start + block_rows] = block @ query
+    return scores
+
+
+def top_k_batch(matrix, queries, k, block_rows=65536):
+    """
+    (rows, scores) of the k best matrix rows for each of the (b, dim)
+    `queries`, as (b, k) arrays, best first. The matrix is scanned once,
+    one (b, block_rows) product at a time.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, matrix.shape[0], block_rows):
+        scores = queries @ np.asarray(matrix[start:start + block_rows], dtype=np.float32).T
+        kept = min(k, scores.shape[1])
+        rows = np.argpartition(-scores, kept - 1, axis=1)[:, :kept]
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, rows, axis=1)], axis=1)
+        merged_rows = np.concatenate([best_rows, rows + start], axis=1)
+        keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class LocalIndex:
+    # Filters matching at most this many rows are scanned exactly, even in IVF mode
+    filter_full_scan_rows = 20_000
+
+    def __init__(self, ids, vectors, payloads, collection_name=COLLECTION_NAME, normalized=False):
+        """
+        `ids` and `payloads` may be any row-indexable sequences. With
+        `normalized=True` the vector matrix is used as-is (e.g. a read-only
+        memmap) instead of being copied into a normalised float32 array.
+        """
+        self.collection_name = collection_name
+        self.ids = ids if hasattr(ids, "__getitem__") else list(ids)
+        self.vectors = vectors if normalized else np.ascontiguousarray(normalize(vectors))
+        self.payloads = payloads if hasattr(payloads, "__getitem__") else list(payloads)
+        self._row_of = None
+        self._postings = {}
+
+        self.centroids = None
+        self.lists = None
+        self.nprobe = None
+
+        self.quantizer = None
+        self.codes = None
+        self.rerank = None
+
+    @classmethod
+    def from_qdrant(cls, client, collection_name=COLLECTION_NAME, page_size=1024):
+        """
+        Copies every point of a Qdrant collection into memory.
+        """
+        ids, vectors, payloads = [], [], []
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection_name,
+                with_payload=True,
+                with_vectors=True,
+                limit=page_size,
+                offset=offset,
+            )
+            for record in records:
+                ids.append(record.id)
+                vectors.append(record.vector)
+                payloads.append(record.payload or {})
+            if offset is None:
+                break
+        return cls(ids, np.asarray(vectors, dtype=np.float32), payloads, collection_name)
+
+    @classmethod
+    def from_store(cls, store, collection_name=COLLECTION_NAME):
+        """
+        Wraps an opened `vector_store.VectorStore` without copying it.
+        """
+        return cls(store.ids, store.vectors, store.payloads, collection_name, normalized=True)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def row_of(self):
+        # Built on first use so opening a large store stays cheap
+        if self._row_of is None:
+            self._row_of = {self.point_id(row): row for row in range(len(self))}
+        return self._row_of
+
+    def point_id(self, row):
+        point_id = self.ids[row]
+        return int(point_id) if isinstance(point_id, np.integer) else point_id
+
+    # Updates --------------------------------------------------------
+
+    def upsert(self, records):
+        """
+        Replaces or appends `records` (with vectors and payloads) in place,
+        e.g. to follow a collection without copying it again. Only for
+        in-memory indexes (`from_qdrant`); a store is read-only. IVF lists
+        and quantizer codes are dropped; rebuild them if needed.
+        """
+        appended = []
+        for record in records:
+            row = self.row_of.get(record.id)
+            if row is None:
+                appended.append(record)
+            else:
+                self.vectors[row] = normalize(record.vector)
+                self.payloads[row] = record.payload or {}
+        if appended:
+            self.ids = list(self.ids) + [record.id for record in appended]
+            self.vectors = np.concatenate([self.vectors, normalize([record.vector for record in appended])])
+            self.payloads = list(self.payloads) + [record.payload or {} for record in appended]
+        self._changed()
+
+    def delete(self, point_ids):
+        point_ids = set(point_ids)
+        keep = [row for row in range(len(self)) if self.point_id(row) not in point_ids]
+        if len(keep) == len(self):
+            return
+        self.ids = [self.ids[row] for row in keep]
+        self.vectors = np.ascontiguousarray(self.vectors[keep])
+        self.payloads = [self.payloads[row] for row in keep]
+        self._changed()
+
+    def _changed(self):
+        self._row_of = None
+        self._postings = {}
+        self.centroids = self.lists = self.nprobe = None
+        self.quantizer = self.codes = self.rerank = None
+
+    # IVF ------------------------------------------------------------
+
+    def build_ivf(self, n_lists=None, nprobe=8):
+        """
+        Switches the index to IVF mode: rows are bucketed by nearest
+        centroid and searches only scan the `nprobe` best buckets.
+        """
+        n_lists = n_lists or max(1, int(np.sqrt(len(self))))
+        vectors = np.asarray(self.vectors, dtype=np.float32)
+        self.centroids = kmeans(vectors, min(n_lists, len(self)))
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        self.nprobe = nprobe
+        return self
+
+    def _candidate_rows(self, query):
+        if self.centroids is None:
+            return None
+        probes = top_k(self.centroids @ query, self.nprobe)
+        return np.concatenate([self.lists[i] for i in probes])
+
+    # Quantization ---------------------------------------------------
+
+    def set_quantizer(self, quantizer, codes=None, rerank=4):
+        """
+        Scans compressed `codes` (see quantization.py) and re-ranks the best
+        `rerank * limit` candidates against the full-precision vectors.
+        """
+        self.quantizer = quantizer
+        self.codes = quantizer.encode(self.vectors) if codes is None else codes
+        self.rerank = rerank
+        return self
+
+    # Payload filters ------------------------------------------------
+
+    def postings(self, field):
+        """
+        {value: sorted row array} for a payload field, built on first use.
+        """
+        if field not in self._postings:
+            rows_by_value = {}
+            for row in range(len(self)):
+                value = self.payloads[row].get(field)
+                for item in value if isinstance(value, list) else [value]:
+                    if item is not None:
+                        rows_by_value.setdefault(item, []).append(row)
+            self._postings[field] = {
+                value: np.asarray(rows, dtype=np.int64) for value, rows in rows_by_value.items()
+            }
+        return self._postings[field]
+
+    def _condition_mask(self, condition):
+        if not isinstance(condition, FieldCondition) or not isinstance(condition.match, (MatchAny, MatchValue)):
+            raise NotImplementedError("LocalIndex only supports keyword match conditions")
+        values = condition.match.any if isinstance(condition.match, MatchAny) else [condition.match.value]
+        postings = self.postings(condition.key)
+        mask = np.zeros(len(self), dtype=bool)
+        for value in values:
+            if value in postings:
+                mask[postings[value]] = True
+        return mask
+
+    def filter_rows(self, query_filter):
+        """
+        Sorted rows matching a qdrant Filter (must / must_not / should), or
+        None for no filter.
+        """
+        if query_filter is None:
+            return None
+
+        def conditions(value):
+            return [] if value is None else value if isinstance(value, list) else [value]
+
+        mask = np.ones(len(self), dtype=bool)
+        for condition in conditions(query_filter.must):
+            mask &= self._condition_mask(condition)
+        for condition in conditions(query_filter.must_not):
+            mask &= ~self._condition_mask(condition)
+        should = conditions(query_filter.should)
+        if should:
+            mask &= np.logical_or.reduce([self._condition_mask(condition) for condition in should])
+        return np.flatnonzero(mask)
+
+    # Query API ------------------------------------------------------
+
+    def _payload(self, row, with_payload):
+        if with_payload is False:
+            return None
+        payload = self.payloads[row]
+        if isinstance(with_payload, (list, tuple)):
+            return {key: payload[key] for key in with_payload if key in payload}
+        return payload
+
+    def _search_rows(self, query, limit, exclude_rows=(), allowed_rows=None):
+        query = normalize(query)
+        rows = self._candidate_rows(query)
+        if allowed_rows is not None:
+            if rows is None or len(allowed_rows) <= self.filter_full_scan_rows:
+                rows = allowed_rows
+            else:
+                rows = np.intersect1d(rows, allowed_rows, assume_unique=True)
+        if self.quantizer is not None:
+            codes = self.codes if rows is None else self.codes[rows]
+            scores = self.quantizer.scores(codes, query)
+            shortlist = limit * self.rerank
+        else:
+            scores = dot(self.vectors if rows is None else self.vectors[rows], query)
+            shortlist = limit
+        if len(exclude_rows):
+            if rows is None:
+                scores[exclude_rows] = -np.inf
+            else:
+                scores[np.isin(rows, exclude_rows)] = -np.inf
+        best = top_k(scores, shortlist)
+        best = best[np.isfinite(scores[best])]
+        best_rows = best if rows is None else rows[best]
+        if self.quantizer is None:
+            return best_rows, scores[best]
+
+        # Re-rank the shortlist against the full-precision vectors
+        exact = dot(np.asarray(self.vectors[best_rows], dtype=np.float32), query)
+        order = top_k(exact, limit)
+        return best_rows[order], exact[order]
+
+    def _scored_points(self, rows, scores, with_payload=True, with_vectors=False):
+        return [
+            ScoredPoint(
+                id=self.point_id(row),
+                version=0,
+                score=float(score),
+                payload=self._payload(row, with_payload),
+                vector=np.asarray(self.vectors[row], dtype=np.float32).tolist() if with_vectors else None,
+            )
+            for row, score in zip(rows, scores)
+        ]
+
+    def search(self, collection_name=None, query_vector=None, limit=10, query_filter=None,
+               with_payload=True, with_vectors=False, **kwargs):
+        rows, scores = self._search_rows(query_vector, limit, allowed_rows=self.filter_rows(query_filter))
+        return self._scored_points(rows, scores, with_payload, with_vectors)
+
+    def search_batch(self, collection_name=None, requests=(), **kwargs):
+        """
+        Qdrant's search_batch over `SearchRequest`s. Unfiltered requests on
+        an exact index share one scan of the matrix (see `top_k_batch`);
+        the others are searched one by one.
+        """
+        results = [None] * len(requests)
+        shared = [] if self.centroids is not None or self.quantizer is not None else [
+            i for i, request in enumerate(requests) if request.filter is None
+        ]
+        if shared and len(self):
+            limit = max(requests[i].limit for i in shared)
+            rows, scores = top_k_batch(
+                self.vectors, normalize([requests[i].vector for i in shared]), min(limit, len(self))
+            )
+            for position, i in enumerate(shared):
+                request = requests[i]
+                results[i] = self._scored_points(
+                    rows[position, :request.limit], scores[position, :request.limit],
+                    request.with_payload if request.with_payload is not None else False,
+                    bool(request.with_vector),
+                )
+        for i, request in enumerate(requests):
+            if results[i] is None:
+                results[i] = self.search(
+                    query_vector=request.vector, limit=request.limit, query_filter=request.filter,
+                    with_payload=request.with_payload if request.with_payload is not None else False,
+                    with_vectors=bool(request.with_vector),
+                )
+        return results
+
+    def recommend(self, collection_name=None, positive=None, negative=None, limit=10, query_filter=None,
+                  with_payload=True, with_vectors=False, **kwargs):
+        """
+        Qdrant's average-vector strategy: query = 2 * mean(positive) - mean(negative),
+        with the example points themselves excluded from the results.
+        """
+        positive_rows = [self.row_of[point_id] for point_id in (positive or [])]
+        negative_rows = [self.row_of[point_id] for point_id in (negative or [])]
+        query = np.asarray(self.vectors[positive_rows], dtype=np.float32).mean(axis=0)
+        if negative_rows:
+            query = query + query - np.asarray(self.vectors[negative_rows], dtype=np.float32).mean(axis=0)
+        exclude = np.asarray(positive_rows + negative_rows, dtype=np.int64)
+        rows, scores = self._search_rows(
+            query, limit, exclude_rows=exclude, allowed_rows=self.filter_rows(query_filter)
+        )
+        return self._scored_points(rows, scores, with_payload, with_vectors)
+
+    def scroll(self, collection_name=None, limit=10, offset=None,
+               with_payload=True, with_vectors=False, **kwargs):
+        start = 0 if offset is None else self.row_of[offset]
+        end = min(start + limit, len(self))
+        records = [
+            Record(
+                id=self.point_id(row),
+                payload=self._payload(row, with_payload),
+                vector=np.asarray(self.vectors[row], dtype=np.float32).tolist() if with_vectors else None,
+            )
+            for row in range(start, end)
+        ]
+        next_offset = self.point_id(end) if end < len(self) else None
+        return records, next_offset
+
+    def retrieve(self, collection_name=None, ids=None, with_payload=True, with_vectors=False, **kwargs):
+        return [
+            Record(
+                id=self.point_id(row),
+                payload=self._payload(row, with_payload),
+                vector=np.asarray(self.vectors[row], dtype=np.float32).tolist() if with_vectors else None,
+            )
+            for row in (self.row_of[point_id] for point_id in ids or [] if point_id in self.row_of)
+        ]
+
+    def count(self, collection_name=None, **kwargs):
+        return CountResult(count=len(self))
+
+    def facet(self, collection_name=None, key=None, limit=10, **kwargs):
+        # Distinct values of a payload field, most common first, from the inverted index
+        counts = {value: len(rows) for value, rows in self.postings(key).items()}
+        values = sorted(counts, key=lambda value: (-counts[value], value))[:limit]
+        return FacetResponse(hits=[FacetValueHit(value=value, count=counts[value]) for value in values])
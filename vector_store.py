@@ -0,0 +1,308 @@
+"""
+Memory-mapped on-disk vector store.
+
+A store is a directory:
+
+    vectors.bin           64-byte header + (count, dim) float32/float16 block
+    ids.npy               point ids (int64), or an "id" string column when not all are integers
+    <column>.offsets.npy  int64 offsets into <column>.data.bin, one per row + 1
+    <column>.data.bin     UTF-8 bytes of a payload column, back to back
+    columns.json          payload column names and the id type
+
+Everything is opened with `np.memmap` / `np.load(mmap_mode="r")`, so
+opening a store costs a few syscalls regardless of its size and every
+process on the host shares the same page-cache pages.
+
+    python vector_store.py export stores/paintings --dtype float16
+    python vector_store.py import stores/paintings --collection restored
+"""
+import argparse
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+from qdrant_client.models import VectorParams, Distance, PointStruct
+
+from config import COLLECTION_NAME
+from resilient_client import create_client
+
+MAGIC = b"ARTVEC01"
+HEADER_FORMAT = "<8sIIQQQ"          # magic, version, dtype code, count, dim, data offset
+HEADER_SIZE = 64
+VERSION = 1
+DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+PAYLOAD_COLUMNS = ["image_url", "author"]
+
+
+# Header -------------------------------------------------------------
+
+def write_header(f, dtype, count, dim):
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, DTYPE_CODES[np.dtype(dtype)], count, dim, HEADER_SIZE)
+    f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    magic, version, dtype_code, count, dim, offset = struct.unpack_from(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a vector store file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported vector store version {version}")
+    return DTYPES[dtype_code], count, dim, offset
+
+
+# Columnar payload table -----------------------------------------------
+
+class StringColumn:
+    """
+    Read-only, memory-mapped column of strings.
+    """
+
+    def __init__(self, directory, name):
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+        data_path = os.path.join(directory, f"{name}.data.bin")
+        if os.path.getsize(data_path):
+            self.data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return bytes(self.data[start:end]).decode("utf-8")
+
+
+class IdColumn(StringColumn):
+    """
+    String column of point ids. Qdrant ids are unsigned integers or UUIDs,
+    so all-digit values are the integer ids of a mixed collection.
+    """
+
+    def __getitem__(self, row):
+        value = super().__getitem__(row)
+        return int(value) if value.isdigit() else value
+
+
+class StringColumnWriter:
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.offsets = [0]
+        self.data = open(os.path.join(directory, f"{name}.data.bin"), "wb")
+
+    def append(self, value):
+        encoded = ("" if value is None else str(value)).encode("utf-8")
+        self.data.write(encoded)
+        self.offsets.append(self.offsets[-1] + len(encoded))
+
+    def close(self):
+        self.data.close()
+        np.save(os.path.join(self.directory, f"{self.name}.offsets.npy"), np.asarray(self.offsets, dtype=np.int64))
+
+
+class PayloadTable:
+    """
+    Row view over the payload columns: `table[row]` is the payload dict.
+    Columns store a missing field as "", so empty values are left out of
+    the dict, as in a Qdrant payload without the field.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, row):
+        payload = {name: column[row] for name, column in self.columns.items()}
+        return {name: value for name, value in payload.items() if value}
+
+
+class VectorStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "columns.json")) as f:
+            meta = json.load(f)
+        dtype, count, dim, offset = read_header(os.path.join(path, "vectors.bin"))
+        self.dtype, self.count, self.dim = dtype, count, dim
+        if count:
+            self.vectors = np.memmap(
+                os.path.join(path, "vectors.bin"), dtype=dtype, mode="r", offset=offset, shape=(count, dim)
+            )
+        else:
+            self.vectors = np.empty((0, dim), dtype=dtype)
+
+        if meta["id_type"] == "int":
+            self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        else:
+            self.ids = IdColumn(path, "id")
+        self.payloads = PayloadTable({name: StringColumn(path, name) for name in meta["columns"]})
+
+    def __len__(self):
+        return self.count
+
+
+def open_store(path):
+    return VectorStore(path)
+
+
+# Writing ------------------------------------------------------------
+
+def write_store(path, points, count, dim, dtype=np.float32, columns=PAYLOAD_COLUMNS, id_type=None):
+    """
+    Streams `count` (id, vector, payload) tuples into a new store at `path`.
+    Vectors are stored unit-normalised (the collection uses cosine distance).
+    Ids go to `ids.npy` when every one is an integer and to an "id" string
+    column otherwise (`id_type` "int" / "str" forces one; None decides from
+    the ids). The store is built in a temporary directory and renamed into
+    place; a failed write removes it.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        id_type = _write_store(tmp_path, points, count, dim, dtype, columns, id_type)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    with open(os.path.join(tmp_path, "columns.json"), "w") as f:
+        json.dump({"columns": list(columns), "id_type": id_type}, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return count
+
+
+def _write_store(tmp_path, points, count, dim, dtype, columns, id_type):
+    # Writes the store files into `tmp_path`; returns the id type used
+    with open(os.path.join(tmp_path, "vectors.bin"), "wb") as f:
+        write_header(f, dtype, count, dim)
+    vectors = None
+    if count:
+        vectors = np.memmap(
+            os.path.join(tmp_path, "vectors.bin"), dtype=dtype, mode="r+",
+            offset=HEADER_SIZE, shape=(count, dim)
+        )
+
+    writers = {name: StringColumnWriter(tmp_path, name) for name in columns}
+    # Ids are written both ways until one that is not an integer shows up
+    id_writer = StringColumnWriter(tmp_path, "id") if id_type != "int" else None
+    int_ids = np.empty(count, dtype=np.int64) if id_type != "str" else None
+
+    written = 0
+    for row, (point_id, vector, payload) in enumerate(points):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vectors[row] = vector / norm if norm else vector
+        if int_ids is not None:
+            if not isinstance(point_id, (int, np.integer)):
+                if id_type == "int":
+                    raise ValueError(f"Point id {point_id!r} is not an integer (id_type='int')")
+                int_ids = None
+            else:
+                int_ids[row] = point_id
+        if id_writer is not None:
+            id_writer.append(point_id)
+        for name, writer in writers.items():
+            writer.append((payload or {}).get(name))
+        written += 1
+    if written != count:
+        raise ValueError(f"Expected {count} points, got {written}")
+
+    if vectors is not None:
+        vectors.flush()
+        del vectors
+    for writer in writers.values():
+        writer.close()
+    if id_writer is not None:
+        id_writer.close()
+    if int_ids is None:
+        return "str"
+    np.save(os.path.join(tmp_path, "ids.npy"), int_ids)
+    if id_writer is not None:
+        for name in ("id.offsets.npy", "id.data.bin"):
+            os.remove(os.path.join(tmp_path, name))
+    return "int"
+
+
+# Qdrant export / import -----------------------------------------------
+
+def iter_points(client, collection_name, page_size=1024):
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            with_payload=True,
+            with_vectors=True,
+            limit=page_size,
+            offset=offset,
+        )
+        for record in records:
+            yield record.id, record.vector, record.payload
+        if offset is None:
+            break
+
+
+def export_collection(client, path, collection_name=COLLECTION_NAME, dtype=np.float32, id_type=None):
+    # ingest.py writes UUID ids; collections from older notebook runs use
+    # integers, and one that was not compacted yet holds both
+    info = client.get_collection(collection_name)
+    dim = info.config.params.vectors.size
+    count = client.count(collection_name, exact=True).count
+    return write_store(path, iter_points(client, collection_name), count, dim, dtype=dtype, id_type=id_type)
+
+
+def import_store(client, path, collection_name, batch_size=256):
+    store = open_store(path)
+    client.create_collection(
+        collection_name,
+        vectors_config=VectorParams(size=store.dim, distance=Distance.COSINE),
+    )
+    for start in range(0, len(store), batch_size):
+        end = min(start + batch_size, len(store))
+        block = np.asarray(store.vectors[start:end], dtype=np.float32)
+        client.upsert(collection_name, points=[
+            PointStruct(
+                id=int(store.ids[row]) if isinstance(store.ids, np.ndarray) else store.ids[row],
+                vector=block[row - start].tolist(),
+                payload=store.payloads[row],
+            )
+            for row in range(start, end)
+        ], wait=True)
+    return len(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export/import the memory-mapped vector store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write a Qdrant collection to a store directory")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--collection", default=COLLECTION_NAME)
+    export_parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    export_parser.add_argument("--id-type", choices=["int", "str"], default=None,
+                               help="Default: int if every point id is an integer, else str")
+
+    import_parser = subparsers.add_parser("import", help="Create a Qdrant collection from a store directory")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--collection", required=True)
+
+    args = parser.parse_args()
+    client = create_client()
+    if args.command == "export":
+        written = export_collection(client, args.path, args.collection, dtype=args.dtype, id_type=args.id_type)
+        print(f"Exported {written} points to {args.path}")
+    else:
+        imported = import_store(client, args.path, args.collection)
+        print(f"Imported {imported} points into {args.collection}")
+
+
+if __name__ == "__main__":
+    main()
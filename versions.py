@@ -0,0 +1,314 @@
+"""
+Versioned collections behind an alias.
+
+`COLLECTION_NAME` names a Qdrant alias. Each re-ingestion goes into a new
+collection `<name>@v<N>` while the app keeps querying the live one. The
+new version is smoke-tested (HNSW recall against exact search, search
+latency, point count against the live version) and then the alias is
+switched in one atomic request. Rolling back moves the alias to the
+previous version, which is kept until it is dropped.
+
+    python versions.py migrate              # once: move a plain collection to <name>@v1 + alias
+    python versions.py build images --switch
+    python versions.py list
+    python versions.py rollback
+    python versions.py drop 3
+
+The app resolves the alias every `COLLECTION_ALIAS_CHECK_S` seconds and
+refreshes its caches when the target changes (see main.py). Companion
+collections (region vectors, see regions.py, and the PCA tier, see
+projection.py) follow their version under the aliases `<name>_regions`
+and `<name>_pca`.
+"""
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+from qdrant_client.models import (
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation, PointStruct, SearchParams,
+)
+
+from config import (
+    COLLECTION_NAME, MODEL_NAME, EMBEDDING_CACHE_DIR, QUANTIZATION, REGION_SEARCH,
+)
+from resilient_client import create_client
+from filters import ensure_payload_indexes
+from query_cache import bump_collection_version
+from projection import projected_collection
+from regions import region_collection
+from sampling import IdSampler
+
+SEPARATOR = "@v"
+
+# Companion collection names, derived from the main collection's
+COMPANIONS = (region_collection, projected_collection)
+
+# Smoke test thresholds for a new version
+MIN_RECALL = 0.95
+MAX_P95_MS = 200.0
+MIN_POINTS_RATIO = 0.9
+
+
+def version_name(alias, version):
+    return f"{alias}{SEPARATOR}{version}"
+
+
+def list_versions(client, alias):
+    """
+    [(version number, collection name)] of `alias`, oldest first.
+    """
+    pattern = re.compile(re.escape(alias + SEPARATOR) + r"(\d+)$")
+    versions = []
+    for collection in client.get_collections().collections:
+        match = pattern.match(collection.name)
+        if match:
+            versions.append((int(match.group(1)), collection.name))
+    return sorted(versions)
+
+
+def resolve_alias(client, alias):
+    """
+    Collection the alias points to; `alias` itself when it is a plain collection.
+    """
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return alias
+
+
+def switch_alias(client, alias, collection_name):
+    """
+    Points `alias` (and the companion aliases, when the version has those
+    companions) at `collection_name` in a single atomic request.
+    """
+    current = {description.alias_name for description in client.get_aliases().aliases}
+    pairs = [(alias, collection_name)]
+    for companion in COMPANIONS:
+        if client.collection_exists(companion(collection_name)):
+            pairs.append((companion(alias), companion(collection_name)))
+    operations = []
+    for alias_name, target in pairs:
+        if alias_name in current:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias_name)))
+        operations.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=alias_name)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    bump_collection_version(alias)
+
+
+# Smoke test -------------------------------------------------------------
+
+def smoke_test(client, collection_name, reference=None, queries=50, k=10, seed=0):
+    """
+    Searches `queries` stored vectors, drawn at random from the whole
+    collection, with the index and exactly. Returns (report, failures);
+    `failures` is empty when the recall, p95 latency and point count
+    (against `reference`, e.g. the live version) meet the thresholds above.
+    """
+    points = client.count(collection_name, exact=True).count
+    report = {"collection": collection_name, "points": points}
+    if points == 0:
+        return report, ["collection is empty"]
+
+    # Queries drawn from the whole id list, not the id-ordered head of a scroll
+    ids = IdSampler(client, collection_name).ids()
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(len(ids), size=min(queries, len(ids)), replace=False)
+    sample = client.retrieve(collection_name, ids=[ids[i] for i in chosen], with_payload=False, with_vectors=True)
+
+    recalls, latencies = [], []
+    for record in sample:
+        started = time.perf_counter()
+        approximate = client.search(collection_name, query_vector=record.vector, limit=k, with_payload=False)
+        latencies.append(time.perf_counter() - started)
+        exact = client.search(
+            collection_name, query_vector=record.vector, limit=k, with_payload=False,
+            search_params=SearchParams(exact=True),
+        )
+        expected = {hit.id for hit in exact}
+        recalls.append(len(expected & {hit.id for hit in approximate}) / max(len(expected), 1))
+
+    report["recall"] = float(np.mean(recalls))
+    report["p50_ms"] = float(np.percentile(latencies, 50) * 1000)
+    report["p95_ms"] = float(np.percentile(latencies, 95) * 1000)
+
+    failures = []
+    if report["recall"] < MIN_RECALL:
+        failures.append(f"recall@{k} {report['recall']:.3f} < {MIN_RECALL}")
+    if report["p95_ms"] > MAX_P95_MS:
+        failures.append(f"p95 {report['p95_ms']:.1f} ms > {MAX_P95_MS} ms")
+    if reference and reference != collection_name and client.collection_exists(reference):
+        report["reference_points"] = client.count(reference, exact=True).count
+        if points < MIN_POINTS_RATIO * report["reference_points"]:
+            failures.append(f"{points} points < {MIN_POINTS_RATIO:.0%} of {reference} ({report['reference_points']})")
+    return report, failures
+
+
+# Building and migrating ---------------------------------------------------
+
+def copy_collection(client, source, target, chunk=256):
+    """
+    Creates `target` with the vector and quantization settings of `source` and copies every point.
+    """
+    config = client.get_collection(source).config
+    client.create_collection(
+        target,
+        vectors_config=config.params.vectors,
+        quantization_config=config.quantization_config,
+    )
+    offset = None
+    while True:
+        records, offset = client.scroll(source, limit=chunk, offset=offset, with_payload=True, with_vectors=True)
+        if records:
+            client.upsert(target, points=[
+                PointStruct(id=record.id, vector=record.vector, payload=record.payload) for record in records
+            ], wait=True)
+        if offset is None:
+            break
+
+
+def migrate(client, alias):
+    """
+    Turns a plain collection named `alias` into `<alias>@v1` plus an alias.
+    Queries fail for the moment between deleting the original and creating
+    the alias.
+    """
+    target = version_name(alias, 1)
+    copy_collection(client, alias, target)
+    ensure_payload_indexes(client, target)
+    for companion in COMPANIONS:
+        if client.collection_exists(companion(alias)):
+            copy_collection(client, companion(alias), companion(target))
+            ensure_payload_indexes(client, companion(target))
+            client.delete_collection(companion(alias))
+    client.delete_collection(alias)
+    switch_alias(client, alias, target)
+    return target
+
+
+def build_version(client, alias, directory, **ingest_options):
+    """
+    Ingests `directory` into the next `<alias>@v<N>`; returns its name.
+    """
+    from embedding_cache import EmbeddingCache
+    from embeddings import load_model
+    from ingest import run_ingestion
+
+    versions = list_versions(client, alias)
+    target = version_name(alias, versions[-1][0] + 1 if versions else 1)
+    model_name = ingest_options.pop("model", MODEL_NAME)
+    cache_dir = ingest_options.pop("cache_dir", EMBEDDING_CACHE_DIR)
+    cache = EmbeddingCache(cache_dir=cache_dir, model_name=model_name) if cache_dir else None
+    processor, model = load_model(model_name)
+    run_ingestion(
+        directory, client, processor, model,
+        collection_name=target,
+        checkpoint_path=os.path.join(directory, f".ingest_checkpoint.{target}.json"),
+        cache=cache,
+        model_name=model_name,
+        **ingest_options,
+    )
+    return target
+
+
+def print_report(report, failures):
+    print(", ".join(f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}"
+                    for key, value in report.items()))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage versioned collections behind an alias.")
+    parser.add_argument("--alias", default=COLLECTION_NAME)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Show the versions and which one is live")
+    commands.add_parser("migrate", help="Move a plain collection to <alias>@v1 behind the alias")
+    build = commands.add_parser("build", help="Ingest a directory into the next version")
+    build.add_argument("directory")
+    build.add_argument("--switch", action="store_true", help="Switch the alias if the smoke test passes")
+    build.add_argument("--batch-size", type=int, default=16)
+    build.add_argument("--workers", type=int, default=4)
+    build.add_argument("--quantization", choices=["none", "int8", "pq", "pca"], default=QUANTIZATION)
+    build.add_argument("--id-from", choices=["path", "content"], default="path")
+    build.add_argument("--regions", action=argparse.BooleanOptionalAction, default=REGION_SEARCH)
+    smoke = commands.add_parser("smoke", help="Smoke-test a version")
+    smoke.add_argument("version", type=int)
+    switch = commands.add_parser("switch", help="Point the alias at a version")
+    switch.add_argument("version", type=int)
+    switch.add_argument("--force", action="store_true", help="Skip the smoke test")
+    commands.add_parser("rollback", help="Point the alias at the version before the live one")
+    drop = commands.add_parser("drop", help="Delete a version that is not live")
+    drop.add_argument("version", type=int)
+    args = parser.parse_args()
+
+    client = create_client()
+    alias = args.alias
+    live = resolve_alias(client, alias)
+
+    if args.command == "list":
+        for version, name in list_versions(client, alias):
+            marker = "*" if name == live else " "
+            print(f"{marker} v{version}  {name}  {client.count(name, exact=True).count} points")
+        if live == alias:
+            print(f"{alias} is a plain collection; run `python versions.py migrate` first")
+
+    elif args.command == "migrate":
+        if live != alias:
+            parser.error(f"{alias} is already an alias of {live}")
+        print(f"{alias} now points to {migrate(client, alias)}")
+
+    elif args.command == "build":
+        # Checked up front: the alias cannot take the name of an existing collection
+        if args.switch and live == alias and client.collection_exists(alias):
+            parser.error(f"{alias} is a plain collection; run `python versions.py migrate` before build --switch")
+        target = build_version(
+            client, alias, args.directory, batch_size=args.batch_size, workers=args.workers,
+            quantization=args.quantization, id_from=args.id_from, regions=args.regions,
+        )
+        report, failures = smoke_test(client, target, reference=live)
+        print_report(report, failures)
+        if args.switch and not failures:
+            switch_alias(client, alias, target)
+            print(f"{alias} now points to {target}")
+
+    elif args.command == "smoke":
+        print_report(*smoke_test(client, version_name(alias, args.version), reference=live))
+
+    elif args.command == "switch":
+        target = version_name(alias, args.version)
+        if not client.collection_exists(target):
+            parser.error(f"{target} does not exist")
+        if live == alias and client.collection_exists(alias):
+            parser.error(f"{alias} is a plain collection; run `python versions.py migrate` first")
+        if not args.force:
+            report, failures = smoke_test(client, target, reference=live)
+            print_report(report, failures)
+            if failures:
+                raise SystemExit("Not switching; pass --force to override")
+        switch_alias(client, alias, target)
+        print(f"{alias} now points to {target}")
+
+    elif args.command == "rollback":
+        versions = list_versions(client, alias)
+        live_version = next((version for version, name in versions if name == live), None)
+        older = [name for version, name in versions if live_version is not None and version < live_version]
+        if not older:
+            parser.error("There is no earlier version to roll back to")
+        switch_alias(client, alias, older[-1])
+        print(f"{alias} now points to {older[-1]}")
+
+    elif args.command == "drop":
+        target = version_name(alias, args.version)
+        if target == live:
+            parser.error(f"{target} is live; switch to another version first")
+        client.delete_collection(target)
+        for companion in COMPANIONS:
+            if client.collection_exists(companion(target)):
+                client.delete_collection(companion(target))
+        print(f"Dropped {target}")
+
+
+if __name__ == "__main__":
+    main()